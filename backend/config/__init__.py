@@ -19,6 +19,14 @@ EMAIL_CONFIG = {
     'smtp_port': int(os.getenv('SMTP_PORT', 465)),
     'sender_email': os.getenv('MAIL_USERNAME'),
     'sender_password': os.getenv('MAIL_PASSWORD'),
+    'use_ssl': os.getenv('SMTP_SSL', 'true').lower() != 'false',  # false 时使用普通 SMTP（如本地测试服务器）
+    'timeout': int(os.getenv('SMTP_TIMEOUT', 60)),  # SMTP 连接超时（秒）
+    'pool_size': int(os.getenv('SMTP_POOL_SIZE', 4)),  # 保留的空闲 SMTP 连接数上限
+    'keepalive_interval': int(os.getenv('SMTP_KEEPALIVE_INTERVAL', 30)),  # 连接空闲超过该秒数后，使用前先发送 NOOP 检查
+    'idle_timeout': int(os.getenv('SMTP_IDLE_TIMEOUT', 240)),  # 空闲超过该秒数的连接直接关闭
+    'zip_threshold': int(os.getenv('MAIL_ZIP_THRESHOLD', 10 * 1024 * 1024)),  # 附件超过该字节数时压缩为 zip，0 表示不压缩
+    'max_attachment_size': int(os.getenv('MAIL_MAX_ATTACHMENT_SIZE', 20 * 1024 * 1024)),  # 压缩后仍超过该字节数时改为发送下载链接
+    'download_base_url': os.getenv('MAIL_DOWNLOAD_BASE_URL'),  # 收件人可访问的下载服务地址，未设置时超过上限的附件仍直接发送
     # 添加用户组
     'user_groups': {
         
@@ -36,6 +44,76 @@ OUTPUT_DIR = {
     'format': 'tools/format/output'
 }
 
+# 报表生成配置
+REPORT_CONFIG = {
+    # 渲染引擎：openpyxl（内存工作簿）/ streaming（先布局再逐行写入的只写工作簿，内存占用低）
+    'engine': os.getenv('REPORT_ENGINE', 'openpyxl'),
+    # 并发执行SQL的线程数，以及同一数据库的最大并发数
+    'query_workers': int(os.getenv('REPORT_QUERY_WORKERS', 4)),
+    'query_workers_per_db': int(os.getenv('REPORT_QUERY_WORKERS_PER_DB', 2)),
+    # 每次从数据库读取的行数，超过一个分块的结果暂存到临时文件
+    'query_chunk_size': int(os.getenv('REPORT_QUERY_CHUNK_SIZE', 5000)),
+    # 手动生成报表的运行方式：thread（线程内生成）/ process（进程池中生成，可利用多核）
+    'render_mode': os.getenv('REPORT_RENDER_MODE', 'thread'),
+    'render_processes': int(os.getenv('REPORT_RENDER_PROCESSES', os.cpu_count() or 1)),
+    # 已解析模板的缓存数量（按文件内容哈希）
+    'template_cache_size': int(os.getenv('REPORT_TEMPLATE_CACHE_SIZE', 32)),
+    # 性能剖析：开启后所有报表都在输出文件旁写入剖析结果（也可按请求或按任务开启，见 backend.report_profiler）
+    'profile': os.getenv('REPORT_PROFILE', 'false').lower() == 'true',
+    'profile_interval': float(os.getenv('REPORT_PROFILE_INTERVAL', 0.005))  # 调用栈采样间隔（秒）
+}
+
+# 报表查询连接池配置
+DB_POOL_CONFIG = {
+    'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 5)),  # 每组 (host, port, user, database) 的最大连接数
+    'idle_timeout': int(os.getenv('DB_POOL_IDLE_TIMEOUT', 300)),  # 空闲连接保留秒数
+    'acquire_timeout': int(os.getenv('DB_POOL_ACQUIRE_TIMEOUT', 600)),  # 等待空闲连接的最长秒数
+    # 系统表（租约、运行记录、邮件队列、健康检查）使用的独立连接池，不与报表查询争用连接
+    'control_max_size': int(os.getenv('DB_CONTROL_POOL_MAX_SIZE', 5)),
+    'control_acquire_timeout': int(os.getenv('DB_CONTROL_POOL_ACQUIRE_TIMEOUT', 5))
+}
+
+# 定时任务调度配置
+SCHEDULER_CONFIG = {
+    'workers': int(os.getenv('SCHEDULER_WORKERS', 4)),  # 并发执行到期任务的工作线程数
+    'metrics_size': int(os.getenv('SCHEDULER_METRICS_SIZE', 200)),  # 内存中保留的最近运行指标条数
+    # local：单实例；distributed：多个实例共用数据库，到期任务通过 autoreport_tasks 中的租约分配给一个节点执行
+    'mode': os.getenv('SCHEDULER_MODE', 'local'),
+    'node_id': os.getenv('SCHEDULER_NODE_ID'),  # 节点标识，默认为 主机名:进程号:随机后缀
+    'lease_seconds': int(os.getenv('SCHEDULER_LEASE_SECONDS', 300)),  # 租约时长（秒），节点崩溃后其他节点最晚在到期后接手
+    'lease_check_interval': int(os.getenv('SCHEDULER_LEASE_CHECK_INTERVAL', 15))  # 续约和巡检到期任务的间隔（秒）
+}
+
+# 邮件发送队列配置
+MAIL_QUEUE_CONFIG = {
+    'workers': int(os.getenv('MAIL_QUEUE_WORKERS', 2)),  # 并发发送邮件的工作线程数
+    'poll_interval': int(os.getenv('MAIL_QUEUE_POLL_INTERVAL', 5)),  # 检查到期邮件的间隔（秒）
+    'max_attempts': int(os.getenv('MAIL_QUEUE_MAX_ATTEMPTS', 5)),  # 最多尝试发送次数，超过后标记为失败
+    'retry_base': int(os.getenv('MAIL_QUEUE_RETRY_BASE', 60)),  # 第一次重试的等待秒数，之后每次翻倍
+    'retry_max': int(os.getenv('MAIL_QUEUE_RETRY_MAX', 3600)),  # 重试等待的上限（秒）
+    # 发送中的邮件超过该秒数仍未完成时视为取走它的节点已崩溃，重新置为待发送
+    'claim_timeout': int(os.getenv('MAIL_QUEUE_CLAIM_TIMEOUT', 3600))
+}
+
+# 任务收件人缓存配置
+RECIPIENT_CACHE_CONFIG = {
+    'ttl': int(os.getenv('RECIPIENT_CACHE_TTL', 3600))  # 缓存有效期（秒），0 表示不缓存；通过接口修改收件人时会立即清除，多节点调度时不缓存
+}
+
+# 查询结果缓存配置
+QUERY_CACHE_CONFIG = {
+    'cache_dir': os.getenv('QUERY_CACHE_DIR', os.path.join('cache', 'query_results')),
+    'max_bytes': int(os.getenv('QUERY_CACHE_MAX_BYTES', 512 * 1024 * 1024)),  # 缓存总大小上限，超过后按最近使用淘汰
+    'default_ttl': int(os.getenv('QUERY_CACHE_TTL', 0))  # 模板未设置时的有效期（秒），0 表示不缓存
+}
+
+# 增量报表配置（模板 setting 工作表中 fun 为"增量"时启用）
+INCREMENTAL_CONFIG = {
+    'state_dir': os.getenv('INCREMENTAL_STATE_DIR', os.path.join('cache', 'incremental')),
+    'max_bytes': int(os.getenv('INCREMENTAL_STATE_MAX_BYTES', 2 * 1024 * 1024 * 1024)),  # 超过后按最近使用淘汰，被淘汰的任务下次全量查询
+    'initial_watermark': os.getenv('INCREMENTAL_INITIAL_WATERMARK', '1970-01-01 00:00:00')  # 模板未设置时的初始水位
+}
+
 # 日志配置
 LOG_CONFIG = {
     'log_dir': 'logs',
@@ -0,0 +1,167 @@
+"""
+数据库连接池
+
+按 (host, port, user, database) 分组复用连接，跨结果块、跨定时任务共享；每组连接数有上限，空闲超时的连接会被关闭。
+归还连接时重置会话（COM_RESET_CONNECTION），模板SQL中的 USE、用户变量、临时表等不会带到下一次使用；
+报表查询的会话参数（apply_session_settings）在创建连接和每次重置后设置。
+
+有两个连接池：
+- connection_pool：执行报表模板SQL，等待时间长，连接带报表会话参数（如不含严格模式的 sql_mode）
+- control_pool：调度租约、运行记录、邮件队列和健康检查等系统表读写，独立的连接数、较短的等待时间，
+  不设置报表会话参数；报表查询占满 connection_pool 时不受影响
+"""
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from backend.config import DB_POOL_CONFIG
+from backend.utils import connect_db_with_config, apply_session_settings
+
+
+class ConnectionPool:
+    """
+    数据库连接池
+
+    Args:
+        max_size: 每组 (host, port, user, database) 的最大连接数
+        idle_timeout: 空闲连接的最长保留秒数
+        acquire_timeout: 连接数已满时等待空闲连接的最长秒数
+        session_settings: 是否为连接设置报表查询的会话参数
+    """
+
+    def __init__(self, max_size=None, idle_timeout=None, acquire_timeout=None, session_settings=True):
+        self.max_size = max(1, max_size or DB_POOL_CONFIG['max_size'])
+        self.idle_timeout = idle_timeout or DB_POOL_CONFIG['idle_timeout']
+        self.acquire_timeout = acquire_timeout or DB_POOL_CONFIG['acquire_timeout']
+        self.session_settings = session_settings
+        self._condition = threading.Condition()
+        self._idle = {}  # {key: deque([(connection, last_used)])}
+        self._open = {}  # {key: 已创建且未关闭的连接数}
+
+    @staticmethod
+    def _key(db_config):
+        return (db_config.get('host'), db_config.get('port'), db_config.get('user'), db_config.get('database'))
+
+    def acquire(self, db_config):
+        """获取一个连接，用完后必须调用 release 归还"""
+        key = self._key(db_config)
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._condition:
+            while True:
+                self._close_expired()
+                idle = self._idle.get(key)
+                if idle:
+                    connection, _ = idle.pop()
+                    break
+                if self._open.get(key, 0) < self.max_size:
+                    self._open[key] = self._open.get(key, 0) + 1
+                    connection = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f'等待数据库连接超时: {key[0]}:{key[1]}/{key[3]}')
+                self._condition.wait(remaining)
+
+        if connection is not None:
+            if self._is_alive(connection):
+                return connection
+            # 连接已断开，丢弃后重新创建
+            self._discard(key, connection)
+            with self._condition:
+                self._open[key] = self._open.get(key, 0) + 1
+
+        try:
+            connection = connect_db_with_config(db_config)
+            if self.session_settings:
+                apply_session_settings(connection)
+            return connection
+        except Exception:
+            with self._condition:
+                self._open[key] -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, db_config, connection, discard=False):
+        """归还连接；discard 为 True 或连接状态异常时直接关闭"""
+        key = self._key(db_config)
+        if not discard:
+            try:
+                # 回滚未提交的事务并清除会话状态（USE、用户变量、临时表、会话参数），再恢复报表会话参数
+                connection.reset_session()
+                if self.session_settings:
+                    apply_session_settings(connection)
+            except Exception as e:
+                logging.warning(f'重置数据库连接失败，关闭连接: {e}')
+                discard = True
+        if discard:
+            self._discard(key, connection)
+            return
+        with self._condition:
+            self._idle.setdefault(key, deque()).append((connection, time.monotonic()))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self, db_config):
+        """with 语句获取连接，出错时关闭该连接"""
+        connection = self.acquire(db_config)
+        try:
+            yield connection
+        except Exception:
+            self.release(db_config, connection, discard=True)
+            raise
+        else:
+            self.release(db_config, connection)
+
+    def close_all(self):
+        """关闭所有空闲连接"""
+        with self._condition:
+            keys = list(self._idle)
+        for key in keys:
+            with self._condition:
+                idle = self._idle.pop(key, deque())
+            for connection, _ in idle:
+                self._discard(key, connection)
+
+    def stats(self):
+        """各组连接的数量 {key: {'open': n, 'idle': n}}"""
+        with self._condition:
+            return {key: {'open': count, 'idle': len(self._idle.get(key, ()))}
+                    for key, count in self._open.items()}
+
+    def _close_expired(self):
+        """关闭所有分组中空闲超时的连接（调用方需持有锁）"""
+        now = time.monotonic()
+        for key, idle in self._idle.items():
+            while idle and now - idle[0][1] > self.idle_timeout:
+                connection, _ = idle.popleft()
+                self._open[key] -= 1
+                self._close(connection)
+
+    def _discard(self, key, connection):
+        with self._condition:
+            self._open[key] = max(0, self._open.get(key, 0) - 1)
+            self._condition.notify()
+        self._close(connection)
+
+    @staticmethod
+    def _is_alive(connection):
+        try:
+            return connection.is_connected()
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception as e:
+            logging.warning(f'关闭数据库连接失败: {e}')
+
+
+# 进程内共享的连接池：报表查询 / 系统表读写
+connection_pool = ConnectionPool()
+control_pool = ConnectionPool(max_size=DB_POOL_CONFIG['control_max_size'],
+                              acquire_timeout=DB_POOL_CONFIG['control_acquire_timeout'],
+                              session_settings=False)
@@ -3,6 +3,7 @@ import json
 import traceback
 from mysql.connector import Error
 from backend.utils import connect_db, execute_query
+from backend.recipient_cache import recipient_cache
 
 # 设置更详细的日志格式
 logging.basicConfig(
@@ -345,6 +346,7 @@ def add_email(email_data):
 
         # 提交事务
         conn.commit()
+        recipient_cache.clear()
         logger.info(f"邮箱 {email_data['email']} 添加成功")
 
         return {'status': 'success', 'message': '邮箱添加成功', 'id': email_id}
@@ -428,6 +430,7 @@ def update_email(email_data):
         
         # 提交事务
         conn.commit()
+        recipient_cache.clear()
         
         return {'status': 'success', 'message': '邮箱更新成功'}
     except Error as e:
@@ -488,6 +491,7 @@ def delete_email(email_id):
 
         # 提交事务
         conn.commit()
+        recipient_cache.clear()
         logger.info(f"邮箱删除成功，ID: {email_id}")
         
         return {
@@ -571,6 +575,7 @@ def batch_delete_emails(email_ids):
 
         # 提交事务
         conn.commit()
+        recipient_cache.clear()
         logger.info(f"批量删除邮箱成功，共 {len(email_ids)} 个")
         
         return {
@@ -914,6 +919,7 @@ def add_group(group_data):
 
         # 提交事务
         conn.commit()
+        recipient_cache.clear()
         logger.info(f"邮箱组 {group_name} 添加成功，ID: {group_id}")
 
         return {
@@ -1036,6 +1042,7 @@ def update_group(group_data):
         
         # 提交事务
         conn.commit()
+        recipient_cache.clear()
         logger.info(f"邮箱组 {group_name} 更新成功")
         
         return {
@@ -1105,6 +1112,7 @@ def delete_group(group_id):
         
         # 提交事务
         conn.commit()
+        recipient_cache.clear()
         logger.info(f"邮箱组删除成功，ID: {group_id}")
         
         return {
@@ -1180,6 +1188,7 @@ def batch_delete_groups(group_ids):
         
         # 提交事务
         conn.commit()
+        recipient_cache.clear()
         logger.info(f"批量删除邮箱组成功，共 {len(group_ids)} 个")
         
         return {
@@ -1276,6 +1285,7 @@ def update_group_members(group_id, member_ids):
         
         # 提交事务
         conn.commit()
+        recipient_cache.clear()
         logger.info(f"邮箱组成员更新成功，组ID: {group_id}, 成员数量: {len(member_ids)}")
         
         return {
@@ -1,8 +1,10 @@
 import smtplib
+import base64
+import tempfile
+import uuid
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
-from email import encoders
 import os
 import re
 import logging
@@ -10,10 +12,237 @@ from datetime import datetime
 from typing import List, Optional
 import mimetypes  # 导入 mimetypes 模块
 import sys
+import io
+import threading
+import time
 import urllib.parse
+from contextlib import contextmanager
 from email.header import Header
+from email.generator import BytesGenerator
 # 修改导入路径
 from .config import EMAIL_CONFIG
+from .recipient_cache import is_valid_email
+from .metrics import SMTP_SEND_SECONDS
+
+# 连接已断开时可以重连后重试的异常
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+# 附件按块读取编码，57 的整数倍保证每块编码后都是完整的 76 字符行
+ATTACHMENT_CHUNK_SIZE = 57 * 1024
+# 发送邮件内容时每次写入连接的字节数
+SEND_CHUNK_SIZE = 64 * 1024
+
+
+def write_message(msg, files, fp):
+    """
+    将邮件写入文件对象，文件附件按块从磁盘读取并 base64 编码，内存占用与附件大小无关
+
+    Args:
+        msg: 邮件对象，文件附件的内容为占位符
+        files: [(占位符, 文件路径)]
+        fp: 二进制文件对象，写入的内容已按 SMTP DATA 要求使用 CRLF 换行并转义行首的点
+    """
+    buffer = io.BytesIO()
+    BytesGenerator(buffer, policy=msg.policy.clone(linesep='\r\n')).flatten(msg)
+    data = buffer.getvalue()
+
+    for token, file_path in files:
+        head, data = data.split(token.encode(), 1)
+        fp.write(re.sub(rb'(?m)^\.', b'..', head))
+        with open(file_path, 'rb') as attachment:
+            first = True
+            for chunk in iter(lambda: attachment.read(ATTACHMENT_CHUNK_SIZE), b''):
+                if not first:
+                    fp.write(b'\r\n')
+                fp.write(base64.encodebytes(chunk).rstrip(b'\n').replace(b'\n', b'\r\n'))
+                first = False
+    fp.write(re.sub(rb'(?m)^\.', b'..', data))
+    if not data.endswith(b'\r\n'):
+        fp.write(b'\r\n')
+
+
+class SMTPSession:
+    """
+    一个已登录的 SMTP 连接
+
+    连接空闲超过 keepalive_interval 后，使用前先发送 NOOP 检查；
+    检查失败或发送时发现连接已断开，则重新连接登录（发送只重试一次）。
+    """
+
+    def __init__(self, server, port, user, password, use_ssl=True, timeout=60):
+        self.server = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.last_used = 0
+        self._smtp = None
+
+    def connect(self):
+        self.close()
+        smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        self._smtp = smtp_class(self.server, self.port, timeout=self.timeout)
+        if self.user and self.password:
+            self._smtp.login(self.user, self.password)
+        self.last_used = time.monotonic()
+        logging.info(f"SMTP 连接已建立: {self.server}:{self.port}")
+
+    def is_alive(self):
+        """发送 NOOP 检查连接是否可用"""
+        if self._smtp is None:
+            return False
+        try:
+            return self._smtp.noop()[0] == 250
+        except (smtplib.SMTPException,) + RECONNECT_ERRORS:
+            return False
+
+    def ensure(self, keepalive_interval):
+        """确保连接可用：未连接时连接，空闲较久且 NOOP 失败时重连"""
+        if self._smtp is None:
+            self.connect()
+        elif time.monotonic() - self.last_used > keepalive_interval and not self.is_alive():
+            logging.info(f"SMTP 连接已失效，重新连接: {self.server}:{self.port}")
+            self.connect()
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        if self._smtp is None:
+            self.connect()
+        try:
+            result = self._smtp.sendmail(from_addr, to_addrs, msg)
+        except RECONNECT_ERRORS as e:
+            logging.warning(f"SMTP 连接已断开，重新连接后重试: {e}")
+            self.connect()
+            result = self._smtp.sendmail(from_addr, to_addrs, msg)
+        self.last_used = time.monotonic()
+        return result
+
+    def _send_stream(self, from_addr, to_addrs, fp):
+        smtp = self._smtp
+        smtp.ehlo_or_helo_if_needed()
+        code, resp = smtp.mail(from_addr)
+        if code != 250:
+            smtp.rset()
+            raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+        refused = {}
+        for addr in to_addrs:
+            code, resp = smtp.rcpt(addr)
+            if code not in (250, 251):
+                refused[addr] = (code, resp)
+        if len(refused) == len(to_addrs):
+            smtp.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        smtp.putcmd('data')
+        code, resp = smtp.getreply()
+        if code != 354:
+            smtp.rset()
+            raise smtplib.SMTPDataError(code, resp)
+        fp.seek(0)
+        for chunk in iter(lambda: fp.read(SEND_CHUNK_SIZE), b''):
+            smtp.send(chunk)
+        smtp.send(b'.\r\n')
+        code, resp = smtp.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, resp)
+        return refused
+
+    def send_stream(self, from_addr, to_addrs, fp):
+        """
+        发送已写入文件对象的邮件（见 write_message），按块写入连接而不是整体读入内存
+
+        Returns:
+            dict: 被拒绝的收件人，与 smtplib.SMTP.sendmail 相同
+        """
+        if self._smtp is None:
+            self.connect()
+        try:
+            result = self._send_stream(from_addr, to_addrs, fp)
+        except RECONNECT_ERRORS as e:
+            logging.warning(f"SMTP 连接已断开，重新连接后重试: {e}")
+            self.connect()
+            result = self._send_stream(from_addr, to_addrs, fp)
+        self.last_used = time.monotonic()
+        return result
+
+    def close(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            try:
+                self._smtp.close()
+            except Exception:
+                pass
+        self._smtp = None
+
+
+class SMTPPool:
+    """
+    SMTP 连接池
+
+    按 (server, port, user) 保留已登录的空闲连接，多次发送复用同一连接，避免每封邮件都做 TLS 握手和登录。
+    """
+
+    def __init__(self, max_idle=None, keepalive_interval=None, idle_timeout=None):
+        self.max_idle = max(1, max_idle or EMAIL_CONFIG['pool_size'])
+        self.keepalive_interval = keepalive_interval or EMAIL_CONFIG['keepalive_interval']
+        self.idle_timeout = idle_timeout or EMAIL_CONFIG['idle_timeout']
+        self._lock = threading.Lock()
+        self._idle = {}  # {key: [SMTPSession]}
+
+    def _acquire(self, key):
+        with self._lock:
+            idle = self._idle.get(key, [])
+            now = time.monotonic()
+            expired = [session for session in idle if now - session.last_used > self.idle_timeout]
+            idle[:] = [session for session in idle if now - session.last_used <= self.idle_timeout]
+            session = idle.pop() if idle else None
+        for expired_session in expired:
+            expired_session.close()
+        return session
+
+    def _release(self, key, session):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(session)
+                return
+        session.close()
+
+    @contextmanager
+    def session(self, server, port, user, password, use_ssl=True, timeout=60):
+        """获取一个可用的连接，用完自动归还；发送过程中出现连接错误时丢弃该连接"""
+        key = (server, port, user, use_ssl)
+        session = self._acquire(key) or SMTPSession(server, port, user, password, use_ssl, timeout)
+        reusable = False
+        try:
+            session.ensure(self.keepalive_interval)
+            yield session
+            reusable = True
+        except (smtplib.SMTPException,) + RECONNECT_ERRORS:
+            raise
+        except Exception:
+            reusable = True  # 与连接无关的错误（如附件读取失败），连接可以继续使用
+            raise
+        finally:
+            if reusable:
+                self._release(key, session)
+            else:
+                session.close()
+
+    def close_all(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            sessions = [session for idle in self._idle.values() for session in idle]
+            self._idle.clear()
+        for session in sessions:
+            session.close()
+
+
+# 进程内共享的 SMTP 连接池
+smtp_pool = SMTPPool()
+
 
 class EmailSender:
     def __init__(self):
@@ -21,6 +250,8 @@ class EmailSender:
         self.smtp_port = EMAIL_CONFIG['smtp_port']
         self.sender_email = EMAIL_CONFIG['sender_email']
         self.sender_password = EMAIL_CONFIG['sender_password']
+        self.use_ssl = EMAIL_CONFIG.get('use_ssl', True)
+        self.timeout = EMAIL_CONFIG.get('timeout', 60)
         self.user_groups = EMAIL_CONFIG.get('user_groups', {})
         self._setup_logging()
 
@@ -55,26 +286,23 @@ class EmailSender:
 
     def _validate_email(self, email: str) -> bool:
         """验证邮箱格式"""
-        pattern = r'^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$'
-        return re.match(pattern, email) is not None
+        return is_valid_email(email)
 
-    def send_email(
+    def _build_message(
         self,
         subject: str,
         recipients: List[str],
         body: Optional[str] = None,
         cc: Optional[List[str]] = None,
         attachments: Optional[List[str]] = None
-    ) -> bool:
+    ):
         """
-        发送邮件
-        
-        Args:
-            subject: 邮件主题（必填）
-            recipients: 收件人列表（必填）
-            body: 邮件正文（可选）
-            cc: 抄送人列表（可选）
-            attachments: 附件路径列表或MIMEBase对象列表（可选）
+        构建邮件
+
+        文件附件只写入占位符，发送时由 write_message 从磁盘按块读取编码
+
+        Returns:
+            tuple: (邮件对象, 收件人列表, 抄送人列表, [(占位符, 文件路径)])，添加附件失败时返回 None
         """
         if not subject:
             raise ValueError("邮件主题不能为空")
@@ -103,6 +331,7 @@ class EmailSender:
             msg.attach(MIMEText(body, 'plain'))
 
         # 添加附件
+        files = []
         if attachments:
             for attachment_item in attachments:
                 try:
@@ -113,16 +342,19 @@ class EmailSender:
                     else:
                         # 假设是文件路径
                         file_path = attachment_item
-                        with open(file_path, 'rb') as attachment:
-                            # 推断附件的 MIME 类型
-                            mime_type, encoding = mimetypes.guess_type(file_path)
-                            if mime_type is None:
-                                mime_type = 'application/octet-stream'
-                            
-                            maintype, subtype = mime_type.split('/', 1)
-                            part = MIMEBase(maintype, subtype)
-                            part.set_payload(attachment.read())
-                        encoders.encode_base64(part)
+                        if not os.access(file_path, os.R_OK) or not os.path.isfile(file_path):
+                            raise FileNotFoundError(f"文件不存在或不可读: {file_path}")
+                        # 推断附件的 MIME 类型
+                        mime_type, encoding = mimetypes.guess_type(file_path)
+                        if mime_type is None:
+                            mime_type = 'application/octet-stream'
+                        
+                        maintype, subtype = mime_type.split('/', 1)
+                        part = MIMEBase(maintype, subtype)
+                        token = f'attachment-{uuid.uuid4().hex}'
+                        part.set_payload(token)
+                        part['Content-Transfer-Encoding'] = 'base64'
+                        files.append((token, file_path))
                         
                         # 修改这里，使用更简单的方式处理中文文件名
                         filename = os.path.basename(file_path)
@@ -136,17 +368,55 @@ class EmailSender:
                         msg.attach(part)
                 except Exception as e:
                     logging.error(f"无法添加附件 {attachment_item}: {e}")
-                    return False
+                    return None
+
+        return msg, to_emails, cc_emails, files
+
+    def _send(self, session, msg, to_addrs, files):
+        """将邮件写入临时文件后按块发送"""
+        with tempfile.TemporaryFile() as fp:
+            write_message(msg, files, fp)
+            started = time.perf_counter()
+            status = 'failure'
+            try:
+                result = session.send_stream(self.sender_email, to_addrs, fp)
+                status = 'success'
+                return result
+            finally:
+                SMTP_SEND_SECONDS.observe(time.perf_counter() - started, status=status)
+
+    def _session(self):
+        """从连接池获取已登录的 SMTP 连接"""
+        return smtp_pool.session(self.smtp_server, self.smtp_port, self.sender_email, self.sender_password,
+                                 use_ssl=self.use_ssl, timeout=self.timeout)
+
+    def send_email(
+        self,
+        subject: str,
+        recipients: List[str],
+        body: Optional[str] = None,
+        cc: Optional[List[str]] = None,
+        attachments: Optional[List[str]] = None
+    ) -> bool:
+        """
+        发送邮件（复用连接池中的 SMTP 连接）
+        
+        Args:
+            subject: 邮件主题（必填）
+            recipients: 收件人列表（必填）
+            body: 邮件正文（可选）
+            cc: 抄送人列表（可选）
+            attachments: 附件路径列表或MIMEBase对象列表（可选）
+        """
+        message = self._build_message(subject, recipients, body, cc, attachments)
+        if message is None:
+            return False
+        msg, to_emails, cc_emails, files = message
 
         # 发送邮件
         try:
-            with smtplib.SMTP_SSL(self.smtp_server, self.smtp_port) as server:
-                server.login(self.sender_email, self.sender_password)
-                server.sendmail(
-                    self.sender_email,
-                    to_emails + cc_emails,
-                    msg.as_string()
-                )
+            with self._session() as session:
+                self._send(session, msg, to_emails + cc_emails, files)
             
             # 记录成功日志
             logging.info(
@@ -168,6 +438,35 @@ class EmailSender:
             )
             raise RuntimeError(f"邮件发送失败: {str(e)}")
 
+    def send_batch(self, messages: List[dict]) -> list:
+        """
+        通过同一个 SMTP 连接依次发送多封邮件，单封失败不影响其他邮件
+
+        Args:
+            messages: 邮件列表，每项为 send_email 的参数字典（subject, recipients, body, cc, attachments）
+
+        Returns:
+            list: 与 messages 一一对应，发送成功为 True，失败为异常对象
+
+        Raises:
+            连接或登录 SMTP 服务器失败时抛出异常
+        """
+        results = []
+        with self._session() as session:
+            for item in messages:
+                try:
+                    message = self._build_message(**item)
+                    if message is None:
+                        raise RuntimeError("添加附件失败")
+                    msg, to_emails, cc_emails, files = message
+                    self._send(session, msg, to_emails + cc_emails, files)
+                    logging.info(f"邮件发送成功, 主题: {item.get('subject')}, 收件人: {', '.join(to_emails)}")
+                    results.append(True)
+                except Exception as e:
+                    logging.error(f"邮件发送失败, 主题: {item.get('subject')}, 错误信息: {e}")
+                    results.append(e)
+        return results
+
 # 示例用法
 if __name__ == "__main__":
     sender = EmailSender()
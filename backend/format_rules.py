@@ -0,0 +1,300 @@
+"""
+格式规则编译
+
+format 字段（如 "bold:1-1,1-max;border:1-max,1-max;data_bar:2-max,1-1"）只解析一次，
+编译为 CompiledFormatRules 并按规则文本缓存，不同结果块、不同任务之间共享。
+应用时先按顺序确定每条规则的区域（"max" 取当时结果块的范围），
+再把覆盖同一区域的样式规则合并为一个组合样式，对每个单元格只写一次。
+"""
+import logging
+from collections import namedtuple
+from copy import copy
+from functools import lru_cache
+
+from openpyxl.formatting.rule import DataBarRule, ColorScaleRule
+from openpyxl.styles import Font, Border, Side, PatternFill, Alignment
+from openpyxl.utils import get_column_letter
+
+from backend.report_profiler import profile_section
+
+# 区域中的 "max"，应用时取结果块当前的最大行/列
+MAX = None
+
+# 一条编译后的规则：kind 为 'style' 或 'conditional'，area 为 (起始行, 结束行, 起始列, 结束列)，
+# 样式规则的 change 为 ((字段, 新值), ...)，新值为 ((属性, 值), ...) 时表示在原对象上修改部分属性，
+# name 为规则类型（RULE_NAMES 的键），用作性能剖析的区段名
+FormatRule = namedtuple('FormatRule', ['kind', 'area', 'change', 'name'], defaults=(None,))
+
+# 规则类型对应的日志名称
+RULE_NAMES = {
+    'bold': '加粗样式',
+    'bg_color': '背景颜色',
+    'font_color': '字体颜色',
+    'font': '字体样式',
+    'border': '边框样式',
+    'data_bar': '数据条',
+    'color_scale': '色阶',
+    'alignment': '对齐样式',
+    'number_format': '数字格式',
+    'decimal': '小数格式',
+}
+
+BOLD_FONT = Font(bold=True)
+THIN_BORDER = Border(left=Side(style='thin'),
+                     right=Side(style='thin'),
+                     top=Side(style='thin'),
+                     bottom=Side(style='thin'))
+
+
+def _parse_range(text, kind):
+    """解析 "start-end" 或 "start-max"，kind 为 'row' 或 'column'"""
+    label = 'row' if kind == 'row' else 'column'
+    parts = text.split('-')
+    if len(parts) != 2:
+        raise ValueError(f'Invalid {label} range format. Expected format: "start_{label[:3]}-end_{label[:3]}" or "start_{label[:3]}-max"')
+    try:
+        start = int(parts[0])
+        if start <= 0:
+            raise ValueError(f'Start {label} must be a positive integer')
+        if parts[1].lower() == 'max':
+            return start, MAX
+        end = int(parts[1])
+        if end <= 0:
+            raise ValueError(f'End {label} must be a positive integer')
+        if start > end:
+            raise ValueError(f'Start {label} must be less than or equal to end {label}')
+        return start, end
+    except ValueError:
+        raise ValueError(f'{label.capitalize()} numbers must be integers or "max"')
+
+
+def _parse_area(rows, cols):
+    start_row, end_row = _parse_range(rows, 'row')
+    start_col, end_col = _parse_range(cols, 'column')
+    return start_row, end_row, start_col, end_col
+
+
+def _split(params, count, message):
+    parts = params.split(',')
+    if len(parts) != count:
+        raise ValueError(message)
+    return parts
+
+
+def _compile_rule(rule_type, params):
+    """编译单条规则，返回 FormatRule，无需处理时返回 None"""
+    if rule_type == 'decimal':
+        raise ValueError('不支持的格式规则: decimal，请使用 number_format')
+    if not params:
+        return None
+
+    if rule_type == 'bold':
+        rows, cols = _split(params, 2, 'Invalid bold format')
+        return FormatRule('style', _parse_area(rows, cols), (('font', BOLD_FONT),))
+
+    if rule_type == 'bg_color':
+        color, rows, cols = _split(params, 3, 'Invalid bg_color format. Expected format: "color,start_row-end_row,start_col-end_col"')
+        color = color.strip()
+        # 确保颜色以#开头
+        if not color.startswith('#'):
+            color = '#' + color
+        # 确保颜色为6位十六进制
+        if len(color) != 7:
+            raise ValueError('Invalid color format, must be 6-digit hex')
+        fill = PatternFill(start_color=color[1:], end_color=color[1:], fill_type='solid')
+        return FormatRule('style', _parse_area(rows, cols), (('fill', fill),))
+
+    if rule_type == 'font_color':
+        color, rows, cols = _split(params, 3, 'Invalid font_color format. Expected format: "color,start_row-end_row,start_col-end_col"')
+        color = color.strip()
+        area = _parse_area(rows, cols)
+        Font(color=color[1:])  # 提前校验颜色（去掉#号）
+        return FormatRule('style', area, (('font', (('color', color[1:]),)),))
+
+    if rule_type == 'font':
+        name, size, rows, cols = _split(params, 4, 'Invalid font format. Expected format: "font_name,font_size,start_row-end_row,start_col-end_col"')
+        # 如果未指定字体名称，则使用默认字体（微软雅黑）
+        font_name = name.strip() or '微软雅黑'
+        font_size = 12
+        try:
+            if size.strip():
+                font_size = int(size.strip())
+                if font_size <= 0:
+                    raise ValueError('Font size must be greater than 0')
+        except ValueError:
+            raise ValueError('Font size must be a positive integer')
+        return FormatRule('style', _parse_area(rows, cols), (('font', (('name', font_name), ('size', font_size))),))
+
+    if rule_type == 'border':
+        rows, cols = _split(params, 2, 'Invalid border format')
+        return FormatRule('style', _parse_area(rows, cols), (('border', THIN_BORDER),))
+
+    if rule_type == 'alignment':
+        align_type, rows, cols = _split(params, 3, 'Invalid alignment format. Expected format: "alignment_type,start_row-end_row,start_col-end_col"')
+        align_type = align_type.strip().lower()
+        if align_type not in ['left', 'center', 'right']:
+            raise ValueError('Invalid alignment type. Must be one of: left, center, right')
+        return FormatRule('style', _parse_area(rows, cols), (('alignment', Alignment(horizontal=align_type)),))
+
+    if rule_type == 'number_format':
+        format_type, decimals, rows, cols = _split(params, 4, 'Invalid number format. Expected format: "format_type,decimal_places,start_row-end_row,start_col-end_col"')
+        format_type = format_type.strip().lower()
+        if format_type not in ['general', 'number', 'percentage']:
+            raise ValueError('Invalid format type. Must be one of: general, number, percentage')
+        try:
+            decimal_places = int(decimals)
+            if decimal_places < 0:
+                raise ValueError('Decimal places must be a non-negative integer')
+        except ValueError:
+            raise ValueError('Decimal places must be an integer')
+        if format_type == 'general':
+            number_format = 'General'
+        elif format_type == 'number':
+            number_format = f'0.{decimal_places * "0"}'
+        else:
+            number_format = f'0.{decimal_places * "0"}%'
+        return FormatRule('style', _parse_area(rows, cols), (('number_format', number_format),))
+
+    if rule_type == 'data_bar':
+        rows, cols = _split(params, 2, 'Invalid data_bar format')
+        return FormatRule('conditional', _parse_area(rows, cols), 'data_bar')
+
+    if rule_type == 'color_scale':
+        rows, cols = _split(params, 2, 'Invalid color_scale format')
+        return FormatRule('conditional', _parse_area(rows, cols), 'color_scale')
+
+
+def _rule_type(name):
+    """规则名称归类（与原有的前缀匹配方式一致），无法识别时返回 None"""
+    if name in ('bold', 'border', 'alignment', 'number_format'):
+        return name
+    for prefix in ('bg_color', 'font_color', 'font', 'data_bar', 'color_scale', 'decimal'):
+        if name.startswith(prefix):
+            return prefix
+    return None
+
+
+def _conditional_rule(name):
+    """每次应用都新建条件格式规则对象，优先级由各自的工作表分配"""
+    if name == 'data_bar':
+        return DataBarRule(start_type='min', end_type='max', color="638EC6",
+                           showValue=True, minLength=None, maxLength=None)
+    return ColorScaleRule(start_type='min', start_color='FCFCFF', end_type='max', end_color='63BE7B')
+
+
+def _apply_change(style, changes):
+    """在单元格样式上依次应用一组修改，返回新的样式"""
+    updates = {}
+    for field, value in changes:
+        if isinstance(value, tuple):
+            # 在现有字体基础上修改部分属性
+            font = copy(updates.get(field, getattr(style, field)))
+            for key, item in value:
+                setattr(font, key, item)
+            updates[field] = font
+        else:
+            updates[field] = value
+    return style._replace(**updates)
+
+
+class CompiledFormatRules:
+    """编译后的格式规则，可重复应用到多个结果块"""
+
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+
+    def apply(self, block):
+        """
+        将规则应用到结果块
+
+        按规则顺序确定区域：样式规则访问的区域会扩展结果块的范围，
+        之后的 "max" 取扩展后的范围（与逐条应用时一致）。
+        开启性能剖析时，每条条件格式按规则类型记录为一个区段；样式规则合并为一次遍历，
+        记录为 "style_rules:类型,..."（按出现顺序列出参与合并的规则类型）。
+        """
+        max_row, max_col = block.max_row, block.max_column
+        style_rules = []
+        style_names = []
+        for rule in self.rules:
+            start_row, end_row, start_col, end_col = rule.area
+            end_row = max_row if end_row is MAX else end_row
+            end_col = max_col if end_col is MAX else end_col
+
+            if rule.kind == 'conditional':
+                cell_range = f'{get_column_letter(start_col)}{start_row}:{get_column_letter(end_col)}{end_row}'
+                with profile_section(rule.name or rule.change):
+                    block.conditional_formatting.add(cell_range, _conditional_rule(rule.change))
+                continue
+
+            if start_row <= end_row and start_col <= end_col:
+                style_rules.append((start_row, end_row, start_col, end_col, rule.change))
+                if rule.name not in style_names:
+                    style_names.append(rule.name)
+                max_row, max_col = max(max_row, end_row), max(max_col, end_col)
+
+        block.extend(max_row, max_col)
+        if style_rules:
+            with profile_section('style_rules:' + ','.join(str(name) for name in style_names)):
+                _sweep(block, style_rules)
+
+
+def _sweep(block, style_rules):
+    """
+    按规则区域的边界把结果块切分为若干矩形，每个矩形内的单元格被同一组规则覆盖，
+    合并为一个组合修改后逐单元格应用一次；相同的（原样式，组合修改）只计算一次
+    """
+    row_bounds = sorted({bound for r1, r2, _, _, _ in style_rules for bound in (r1, r2 + 1)})
+    col_bounds = sorted({bound for _, _, c1, c2, _ in style_rules for bound in (c1, c2 + 1)})
+    resolved = {}
+
+    for row_start, row_stop in zip(row_bounds, row_bounds[1:]):
+        row_rules = [rule for rule in style_rules if rule[0] <= row_start and row_stop - 1 <= rule[1]]
+        if not row_rules:
+            continue
+        for col_start, col_stop in zip(col_bounds, col_bounds[1:]):
+            covering = tuple(change for _, _, c1, c2, change in row_rules if c1 <= col_start and col_stop - 1 <= c2)
+            if not covering:
+                continue
+            changes = tuple(item for change in covering for item in change)
+            for row in range(row_start, row_stop):
+                for col in range(col_start, col_stop):
+                    style = block.style_at(row, col)
+                    key = (id(style), changes)
+                    new_style = resolved.get(key)
+                    if new_style is None:
+                        new_style = resolved[key] = block.intern(_apply_change(style, changes))
+                    block.set_style(row, col, new_style)
+
+
+@lru_cache(maxsize=512)
+def compile_format_rules(format_rules):
+    """
+    编译格式规则文本，结果按规则文本缓存
+
+    Raises:
+        ValueError: 规则参数不合法（背景颜色规则除外，背景颜色不合法时记录警告并忽略该规则）
+    """
+    rules = []
+    for text in format_rules.split(';') if format_rules else []:
+        if not text.strip():
+            continue
+
+        # 解析规则类型和参数
+        parts = text.split(':')
+        name = parts[0].strip()
+        params = parts[1].strip() if len(parts) > 1 else ''
+        rule_type = _rule_type(name)
+        if rule_type is None:
+            continue
+
+        try:
+            rule = _compile_rule(rule_type, params)
+        except Exception as e:
+            if rule_type == 'bg_color':
+                logging.warning(f'应用背景颜色失败，使用默认格式: {e}')
+                continue
+            logging.error(f'应用{RULE_NAMES.get(rule_type, rule_type)}失败: {e}')
+            raise
+        if rule is not None:
+            rules.append(rule._replace(name=rule_type))
+    return CompiledFormatRules(rules)
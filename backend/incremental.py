@@ -0,0 +1,125 @@
+"""
+增量报表状态
+
+只追加数据的日报可以在模板 setting 工作表中启用增量模式（fun 为"增量"，title 为水位列，config 为初始水位），
+SQL 中用 {watermark} 表示上次结果中水位列的最大值，例如：
+
+    SELECT dt, ... FROM daily_stats WHERE dt > '{watermark}' ORDER BY dt
+
+每次运行只查询水位之后的新增行，与上次保存的结果合并后再生成报表，数据库查询量只与当天新增的数据量有关。
+SQL 需按水位列排序：升序（ORDER BY dt）时新增行追加在后，降序（ORDER BY dt DESC）时新增行放在前面；
+结果不按水位列排序时无法合并，每次按初始水位全量查询并记录警告。
+水位替换到SQL时单引号按SQL字符串的写法转义（' 写为 ''），占位符应写在引号中。
+每个定时任务的每条增量SQL保存一份结果和水位，SQL、变量或数据库配置变化后自动重新全量查询。
+
+结果和水位保存在本机的 state_dir 中。多节点调度（SCHEDULER_CONFIG['mode'] 为 distributed）时任务可能在
+任意节点执行，各节点的水位互不相同，会导致重复或缺失的行，因此该模式下不启用增量，含 {watermark} 的SQL
+按初始水位全量查询（与手动生成相同）。
+"""
+import logging
+import time
+
+from backend.config import INCREMENTAL_CONFIG, SCHEDULER_CONFIG
+from backend.query_cache import QueryCache, cache_key
+
+# SQL 中的水位占位符
+WATERMARK_PLACEHOLDER = '{watermark}'
+
+
+class IncrementalStore(QueryCache):
+    """
+    增量结果存储：与查询缓存的文件格式相同，头信息中额外保存水位，没有有效期
+    """
+
+    def __init__(self, state_dir=None, max_bytes=None):
+        super().__init__(state_dir or INCREMENTAL_CONFIG['state_dir'],
+                         max_bytes or INCREMENTAL_CONFIG['max_bytes'])
+
+    def load(self, key, rows):
+        """
+        读取上次的结果，行追加到 rows
+
+        Returns:
+            tuple: (列名, 水位)，没有保存的结果时为 (None, None)
+        """
+        header = self._read(key, float('inf'), rows)
+        if header is None or 'watermark' not in header:
+            return None, None
+        return header['columns'], header['watermark']
+
+    def save(self, key, column_names, chunks, watermark):
+        """保存合并后的结果和新的水位"""
+        self.put(key, column_names, chunks, watermark=watermark, updated=time.time())
+
+
+def incremental_enabled():
+    """是否可以使用本机保存的增量状态：多节点调度时不启用"""
+    if SCHEDULER_CONFIG['mode'] == 'distributed':
+        logging.warning('多节点调度模式下增量状态不在节点间共享，增量模式不生效，按初始水位全量查询')
+        return False
+    return True
+
+
+def state_key(task_id, sql, variables, db_config):
+    """增量状态键：任务ID + 替换水位前的SQL、变量和数据库配置"""
+    return f'{task_id}_{cache_key(sql, variables, db_config)}'
+
+
+def _watermark_index(column_names, watermark_column):
+    try:
+        return list(column_names).index(watermark_column)
+    except ValueError:
+        raise ValueError(f'增量水位列不存在: {watermark_column}，查询结果的列为: {list(column_names)}')
+
+
+def sql_literal(watermark):
+    """水位转为SQL字符串内容：单引号写为两个单引号（报表连接的 sql_mode 为 NO_BACKSLASH_ESCAPES，不能用反斜杠转义）"""
+    return str(watermark).replace("'", "''")
+
+
+def fill_watermark(sql, watermark):
+    """把SQL中的 {watermark} 替换为转义后的水位"""
+    return sql.replace(WATERMARK_PLACEHOLDER, sql_literal(watermark))
+
+
+def watermark_orders(column_names, chunks, watermark_column):
+    """
+    结果行按水位列的排列顺序（忽略空值）
+
+    Returns:
+        set: 'asc' / 'desc' 的子集，行数不超过 1 或水位都相同时两者都有，无序时为空
+    """
+    index = _watermark_index(column_names, watermark_column)
+    orders = {'asc', 'desc'}
+    previous = None
+    for chunk in chunks:
+        for row in chunk:
+            value = row[index]
+            if value is None:
+                continue
+            if previous is not None:
+                if value < previous:
+                    orders.discard('asc')
+                elif value > previous:
+                    orders.discard('desc')
+                if not orders:
+                    return orders
+            previous = value
+    return orders
+
+
+def advance_watermark(watermark, column_names, chunks, watermark_column):
+    """
+    计算新增行中水位列的最大值
+
+    Raises:
+        ValueError: 查询结果中没有水位列
+    """
+    index = _watermark_index(column_names, watermark_column)
+
+    values = [row[index] for chunk in chunks for row in chunk if row[index] is not None]
+    return max(values) if values else watermark
+
+
+# 进程内共享的增量状态存储
+incremental_store = IncrementalStore()
@@ -0,0 +1,88 @@
+"""
+报表邮件附件处理
+
+按附件大小决定发送方式：
+- 不超过 zip_threshold：直接作为附件
+- 超过 zip_threshold：压缩为同目录下的 zip（压缩后更小时使用 zip）
+- 压缩后仍超过 max_attachment_size：不再作为附件，正文中附上 /task_management/download_file 的下载链接；
+  未设置 download_base_url（MAIL_DOWNLOAD_BASE_URL）时无法生成收件人可访问的链接，记录警告后仍作为附件发送
+
+阈值见 EMAIL_CONFIG 的 zip_threshold / max_attachment_size / download_base_url。
+"""
+import logging
+import os
+import urllib.parse
+import zipfile
+
+from backend.config import EMAIL_CONFIG
+
+
+def task_output_dir(task_id):
+    """定时任务的报表输出目录（与下载接口读取的目录一致）"""
+    return os.path.abspath(os.path.join('output', 'report_scheduler', str(task_id)))
+
+
+def compress(file_path):
+    """
+    将文件压缩为同目录下的同名 zip，按块读写不整体读入内存
+
+    Returns:
+        str: zip 文件路径
+    """
+    zip_path = os.path.splitext(file_path)[0] + '.zip'
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.write(file_path, arcname=os.path.basename(file_path))
+    return zip_path
+
+
+def download_link(task_id, file_path):
+    """
+    文件的下载链接
+
+    Raises:
+        ValueError: 文件不在任务输出目录下，下载接口无法访问
+    """
+    base_dir = task_output_dir(task_id)
+    relative = os.path.relpath(os.path.abspath(file_path), base_dir)
+    if relative.startswith(os.pardir):
+        raise ValueError(f'文件不在任务输出目录下，无法生成下载链接: {file_path}')
+    base_url = EMAIL_CONFIG['download_base_url'].rstrip('/')
+    filename = urllib.parse.quote(relative.replace(os.sep, '/'))
+    return f'{base_url}/task_management/download_file/{task_id}/{filename}'
+
+
+def prepare_attachments(file_paths, task_id, zip_threshold=None, max_attachment_size=None):
+    """
+    按大小处理报表附件
+
+    Returns:
+        tuple: (作为附件发送的文件路径列表, 下载链接列表)
+    """
+    zip_threshold = EMAIL_CONFIG['zip_threshold'] if zip_threshold is None else zip_threshold
+    max_attachment_size = EMAIL_CONFIG['max_attachment_size'] if max_attachment_size is None else max_attachment_size
+
+    attachments = []
+    links = []
+    for file_path in file_paths:
+        size = os.path.getsize(file_path)
+        if zip_threshold and size > zip_threshold:
+            zip_path = compress(file_path)
+            zip_size = os.path.getsize(zip_path)
+            logging.info(f"附件 {file_path} 大小 {size} 字节，压缩后 {zip_size} 字节")
+            if zip_size < size:
+                file_path, size = zip_path, zip_size
+            else:
+                os.remove(zip_path)
+
+        if max_attachment_size and size > max_attachment_size:
+            if not EMAIL_CONFIG['download_base_url']:
+                logging.warning(f"附件 {file_path} 大小 {size} 字节，超过 {max_attachment_size} 字节，"
+                                f"但未设置 MAIL_DOWNLOAD_BASE_URL，仍作为附件发送")
+                attachments.append(file_path)
+                continue
+            link = download_link(task_id, file_path)
+            logging.info(f"附件 {file_path} 大小 {size} 字节，超过 {max_attachment_size} 字节，改为发送下载链接: {link}")
+            links.append(link)
+        else:
+            attachments.append(file_path)
+    return attachments, links
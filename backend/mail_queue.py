@@ -0,0 +1,253 @@
+"""
+邮件发送队列
+
+定时任务生成报表后只把邮件写入 autoreport_mail_queue 表即结束，由后台工作线程负责发送，
+SMTP 服务器响应慢或不可用时不会阻塞其他报表。发送失败按指数退避重试，
+每封邮件的状态（pending / sending / sent / failed）、尝试次数和最后一次错误都记录在表中，
+服务重启后未发送完的邮件继续发送。
+
+多个实例共用一个数据库时，取走邮件的节点和时间记录在 claimed_by / claimed_at 中。
+启动时只恢复本节点取走的邮件（节点标识为 SCHEDULER_NODE_ID，未设置时每次启动都不同，不恢复），
+其他节点取走的邮件超过 claim_timeout 仍在发送中时才视为该节点已崩溃，重新置为待发送，
+避免重启的节点把其他节点正在发送的邮件再发一次。
+"""
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from backend.config import DB_CONFIG, MAIL_QUEUE_CONFIG, SCHEDULER_CONFIG
+from backend.db_pool import control_pool
+from backend.email_sender import EmailSender
+from backend.task_lease import default_node_id
+
+STATUS_PENDING = 'pending'
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+
+class MailQueue:
+    """
+    持久化的邮件发送队列
+
+    Args:
+        workers: 发送线程数，默认 MAIL_QUEUE_CONFIG['workers']
+        poll_interval: 检查到期邮件的间隔（秒）
+        max_attempts: 最多尝试次数
+        retry_base: 第一次重试的等待秒数，之后每次翻倍，不超过 retry_max
+        claim_timeout: 发送中的邮件超过该秒数视为取走它的节点已崩溃
+        node_id: 本节点标识，默认 SCHEDULER_CONFIG['node_id'] 或 default_node_id()
+    """
+
+    def __init__(self, workers=None, poll_interval=None, max_attempts=None, retry_base=None, retry_max=None,
+                 claim_timeout=None, node_id=None):
+        self.workers = max(1, workers or MAIL_QUEUE_CONFIG['workers'])
+        self.poll_interval = poll_interval or MAIL_QUEUE_CONFIG['poll_interval']
+        self.max_attempts = max(1, max_attempts or MAIL_QUEUE_CONFIG['max_attempts'])
+        self.retry_base = retry_base or MAIL_QUEUE_CONFIG['retry_base']
+        self.retry_max = retry_max or MAIL_QUEUE_CONFIG['retry_max']
+        self.claim_timeout = claim_timeout or MAIL_QUEUE_CONFIG['claim_timeout']
+        self.node_id = node_id or SCHEDULER_CONFIG['node_id'] or default_node_id()
+        self._executor = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def _execute(self, sql, params=(), fetch=False):
+        """执行一条语句并提交，fetch 为 True 时返回所有行（字典）"""
+        with control_pool.connection(DB_CONFIG) as connection:
+            cursor = connection.cursor(dictionary=True)
+            try:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall() if fetch else cursor.rowcount
+                connection.commit()
+                return rows
+            finally:
+                cursor.close()
+
+    def enqueue(self, subject, recipients, body=None, cc=None, attachments=None, task_id=None):
+        """
+        添加一封待发送的邮件
+
+        Returns:
+            int: 邮件ID
+        """
+        if not subject:
+            raise ValueError("邮件主题不能为空")
+        if not recipients:
+            raise ValueError("收件人不能为空")
+
+        with control_pool.connection(DB_CONFIG) as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(
+                    "INSERT INTO autoreport_mail_queue "
+                    "(task_id, subject, recipients, cc, body, attachments, status, next_attempt_at) "
+                    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+                    (task_id, subject, json.dumps(list(recipients), ensure_ascii=False),
+                     json.dumps(list(cc), ensure_ascii=False) if cc else None, body,
+                     json.dumps(list(attachments), ensure_ascii=False) if attachments else None,
+                     STATUS_PENDING, datetime.now())
+                )
+                message_id = cursor.lastrowid
+                connection.commit()
+            finally:
+                cursor.close()
+
+        logging.info(f"邮件已加入发送队列: id={message_id}, 主题: {subject}")
+        self._wakeup.set()
+        return message_id
+
+    def start(self):
+        """启动发送线程；本节点上次退出时正在发送的邮件重新置为待发送"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop_event.clear()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='mail-sender')
+            self._thread = threading.Thread(target=self._dispatch_loop, name='mail-queue', daemon=True)
+
+        try:
+            recovered = self._execute(
+                "UPDATE autoreport_mail_queue SET status = %s, claimed_by = NULL, claimed_at = NULL "
+                "WHERE status = %s AND claimed_by = %s",
+                (STATUS_PENDING, STATUS_SENDING, self.node_id)
+            )
+            if recovered:
+                logging.info(f"恢复 {recovered} 封本节点未发送完成的邮件")
+        except Exception as e:
+            logging.error(f"恢复邮件队列失败: {e}")
+
+        self._thread.start()
+        logging.info(f"邮件发送队列已启动，发送线程数: {self.workers}")
+
+    def stop(self):
+        """停止发送线程，正在发送的邮件会继续完成"""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._stop_event.set()
+            self._wakeup.set()
+            thread, self._thread = self._thread, None
+            executor, self._executor = self._executor, None
+        thread.join(timeout=self.poll_interval + 1)
+        executor.shutdown(wait=False)
+        logging.info("邮件发送队列已停止")
+
+    def _dispatch_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                with self._lock:
+                    free = self.workers - self._in_flight
+                self._recover_stale()
+                if free > 0:
+                    for message in self._claim(free):
+                        with self._lock:
+                            self._in_flight += 1
+                        self._executor.submit(self._deliver, message)
+            except Exception as e:
+                logging.error(f"读取邮件队列失败: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _recover_stale(self):
+        """发送中超过 claim_timeout 的邮件（取走它的节点已崩溃）重新置为待发送，按数据库时间判断"""
+        recovered = self._execute(
+            "UPDATE autoreport_mail_queue SET status = %s, claimed_by = NULL, claimed_at = NULL "
+            "WHERE status = %s AND claimed_at < NOW() - INTERVAL %s SECOND",
+            (STATUS_PENDING, STATUS_SENDING, self.claim_timeout)
+        )
+        if recovered:
+            logging.warning(f"恢复 {recovered} 封超过 {self.claim_timeout} 秒仍未发送完成的邮件")
+
+    def _claim(self, limit):
+        """取出到期的待发送邮件并标记为发送中（按ID条件更新，多个进程同时读取时只有一个能取到）"""
+        rows = self._execute(
+            "SELECT * FROM autoreport_mail_queue WHERE status = %s AND next_attempt_at <= %s "
+            "ORDER BY next_attempt_at, id LIMIT %s",
+            (STATUS_PENDING, datetime.now(), limit), fetch=True
+        )
+        claimed = []
+        for row in rows:
+            updated = self._execute(
+                "UPDATE autoreport_mail_queue SET status = %s, attempts = attempts + 1, claimed_by = %s, "
+                "claimed_at = NOW() WHERE id = %s AND status = %s",
+                (STATUS_SENDING, self.node_id, row['id'], STATUS_PENDING)
+            )
+            if updated:
+                row['attempts'] += 1
+                claimed.append(row)
+        return claimed
+
+    @property
+    def in_flight(self):
+        """正在发送的邮件数"""
+        with self._lock:
+            return self._in_flight
+
+    def retry_delay(self, attempts):
+        """第 attempts 次发送失败后的等待秒数"""
+        return min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+
+    def _deliver(self, message):
+        try:
+            sender = EmailSender()
+            success = sender.send_email(
+                subject=message['subject'],
+                recipients=json.loads(message['recipients']),
+                body=message['body'],
+                cc=json.loads(message['cc']) if message['cc'] else None,
+                attachments=json.loads(message['attachments']) if message['attachments'] else None
+            )
+            if success is False:
+                raise RuntimeError("添加附件失败")
+            self._execute(
+                "UPDATE autoreport_mail_queue SET status = %s, sent_at = %s, last_error = NULL WHERE id = %s",
+                (STATUS_SENT, datetime.now(), message['id'])
+            )
+            logging.info(f"队列邮件发送成功: id={message['id']}, 主题: {message['subject']}")
+        except Exception as e:
+            self._record_failure(message, e)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._wakeup.set()
+
+    def _record_failure(self, message, error):
+        attempts = message['attempts']
+        try:
+            if attempts >= self.max_attempts:
+                self._execute(
+                    "UPDATE autoreport_mail_queue SET status = %s, last_error = %s WHERE id = %s",
+                    (STATUS_FAILED, str(error), message['id'])
+                )
+                logging.error(f"队列邮件发送失败，已达到最大尝试次数 {attempts}: id={message['id']}, 错误: {error}")
+            else:
+                delay = self.retry_delay(attempts)
+                self._execute(
+                    "UPDATE autoreport_mail_queue SET status = %s, last_error = %s, next_attempt_at = %s WHERE id = %s",
+                    (STATUS_PENDING, str(error), datetime.now() + timedelta(seconds=delay), message['id'])
+                )
+                logging.warning(f"队列邮件发送失败，{delay} 秒后重试（第 {attempts} 次）: id={message['id']}, 错误: {error}")
+        except Exception as e:
+            logging.error(f"更新邮件状态失败: id={message['id']}, 错误: {e}")
+
+    def list_messages(self, task_id=None, limit=50):
+        """最近的邮件及其状态，按创建时间倒序"""
+        sql = ("SELECT id, task_id, subject, recipients, status, attempts, next_attempt_at, last_error, "
+               "sent_at, created_at FROM autoreport_mail_queue")
+        params = []
+        if task_id is not None:
+            sql += " WHERE task_id = %s"
+            params.append(task_id)
+        sql += " ORDER BY id DESC LIMIT %s"
+        params.append(limit)
+        return self._execute(sql, params, fetch=True)
+
+
+# 进程内共享的邮件发送队列
+mail_queue = MailQueue()
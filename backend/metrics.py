@@ -0,0 +1,212 @@
+"""
+Prometheus 格式的运行指标
+
+计数器和直方图在各处理环节直接更新（只在内存中累加，加锁开销很小），
+队列深度、连接池等当前状态在采集时由回调读取；采集不访问数据库，可以频繁抓取。
+/metrics 接口返回 render() 的文本（Prometheus text exposition format 0.0.4）。
+
+REPORT_RENDER_MODE 为 process 时报表在子进程中生成，子进程中累加的计数器和直方图（SQL 耗时、写入行数）
+在每个报表结束时由 registry.drain() 取出并清零，通过进度队列发回主进程，由 registry.merge() 累加到主进程的指标中。
+"""
+import math
+import threading
+from bisect import bisect_left
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        if not self.labelnames:
+            # 没有标签的指标从 0 开始输出
+            self._values[()] = self._initial()
+
+    def _initial(self):
+        return 0
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'指标 {self.name} 的标签应为 {self.labelnames}，实际为 {tuple(labels)}')
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def drain(self):
+        """取出自上次 drain 以来累加的值并清零，返回 {标签: 值}"""
+        with self._lock:
+            values = self._values
+            self._values = {(): self._initial()} if not self.labelnames else {}
+        return values
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def merge(self, values):
+        """累加 drain() 取出的值"""
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0) + value
+
+    def collect(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f'{self.name}{_format_labels(key)} {_format_value(value)}' for key, value in sorted(values.items())]
+
+
+class Gauge(_Metric):
+    """
+    当前值
+
+    Args:
+        callback: 采集时调用，返回 [(标签字典, 值)]；设置后忽略 set/inc/dec 的值
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def collect(self):
+        if self.callback is not None:
+            values = {self._key(labels): value for labels, value in self.callback()}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [f'{self.name}{_format_labels(key)} {_format_value(value)}' for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """按上界累计的分布，另含总和与次数"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(name, documentation, labelnames)
+
+    def _initial(self):
+        return [0] * len(self.buckets), 0.0
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or self._initial()
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def merge(self, values):
+        """累加 drain() 取出的值"""
+        with self._lock:
+            for key, (counts, total) in values.items():
+                current, current_total = self._values.get(key) or self._initial()
+                self._values[key] = ([a + b for a, b in zip(current, counts)], current_total + total)
+
+    def collect(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        lines = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(key + (("le", _format_value(bound)),))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """已注册的指标，按注册顺序输出"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def drain(self):
+        """取出全部计数器和直方图累加的值并清零（当前状态类的 Gauge 不传递），返回 {指标名: {标签: 值}}"""
+        return {name: metric.drain() for name, metric in list(self._metrics.items())
+                if isinstance(metric, (Counter, Histogram))}
+
+    def merge(self, updates):
+        """把另一个进程 drain() 取出的值累加到同名指标"""
+        for name, values in updates.items():
+            metric = self._metrics.get(name)
+            if metric is not None:
+                metric.merge(values)
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.header())
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+# 进程内共享的指标
+registry = Registry()
+
+REPORT_GENERATION_SECONDS = registry.register(Histogram(
+    'autoreport_report_generation_seconds', '报表生成耗时（秒）',
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800), labelnames=('source', 'status')))
+SQL_QUERY_SECONDS = registry.register(Histogram(
+    'autoreport_sql_query_seconds', '报表SQL查询耗时（秒，不含命中缓存的查询）',
+    buckets=(0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300), labelnames=('db_name',)))
+ROWS_RENDERED = registry.register(Counter(
+    'autoreport_rows_rendered_total', '写入报表的数据行数'))
+ACTIVE_REPORT_TASKS = registry.register(Gauge(
+    'autoreport_active_report_tasks', '正在执行的手动报表任务（ReportTask）数量'))
+SCHEDULER_LAG_SECONDS = registry.register(Histogram(
+    'autoreport_scheduler_lag_seconds', '定时任务实际触发时间与计划执行时间（next_run_at）的差（秒）',
+    buckets=(0.01, 0.1, 0.5, 1, 5, 15, 60, 300)))
+SMTP_SEND_SECONDS = registry.register(Histogram(
+    'autoreport_smtp_send_seconds', '单封邮件的 SMTP 发送耗时（秒）',
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30), labelnames=('status',)))
@@ -0,0 +1,149 @@
+"""
+报表查询结果缓存
+
+相同（规范化后的）SQL、变量和数据库配置在有效期内直接复用上次的查询结果，不再访问数据库。
+结果按列存储并压缩，保存在本地磁盘，总大小超过上限时按最近使用时间淘汰。
+有效期由模板决定，读取时传入，因此同一份结果可以被不同有效期的模板共享。
+"""
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+import threading
+import time
+import zlib
+
+from backend.config import QUERY_CACHE_CONFIG
+
+CACHE_FORMAT_VERSION = 1
+
+# 引号内的字符串原样保留；其余连续的空白和注释合并为一个空格。
+# 注释按 MySQL 规则整体匹配："-- "（后跟空白）和 "#" 到行尾，"/* */" 到结束符；
+# "/*!...*/"（按版本执行的语句）和 "/*+...*/"（优化器提示）会影响执行，不作为注释去掉
+_SQL_TOKEN = re.compile(
+    r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|`[^`]*`"
+    r"|(?:\s+|--(?=\s|$)[^\n]*|#[^\n]*|/\*(?![!+]).*?\*/)+",
+    re.DOTALL
+)
+
+
+def normalize_sql(sql):
+    """规范化SQL文本：引号外的空白和注释合并为一个空格，去掉首尾空白和结尾的分号"""
+    normalized = _SQL_TOKEN.sub(lambda m: m.group(0) if m.group(0)[0] in '\'"`' else ' ', sql)
+    return normalized.strip().rstrip(';').strip()
+
+
+def cache_key(sql, variables, db_config):
+    """缓存键：规范化SQL + 变量 + 数据库配置（不含密码）"""
+    payload = json.dumps({
+        'sql': normalize_sql(sql),
+        'variables': {str(k): str(v) for k, v in (variables or {}).items()},
+        'db': [db_config.get('host'), db_config.get('port'), db_config.get('user'), db_config.get('database')],
+    }, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class QueryCache:
+    """
+    磁盘查询结果缓存
+
+    文件格式：pickle 依次写入头信息、若干分块和结束标记 None，每个分块为按列组织后压缩的数据
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or QUERY_CACHE_CONFIG['cache_dir']
+        self.max_bytes = max_bytes or QUERY_CACHE_CONFIG['max_bytes']
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.cache')
+
+    def get(self, key, ttl, rows):
+        """
+        读取缓存，结果行追加到 rows（需提供 extend 方法，如 SpooledRows）
+
+        Returns:
+            list: 列名，缓存不存在或已过期时返回 None
+        """
+        if not ttl or ttl <= 0:
+            return None
+        header = self._read(key, ttl, rows)
+        return header['columns'] if header is not None else None
+
+    def _read(self, key, ttl, rows):
+        """读取缓存文件，结果行追加到 rows，返回头信息；不存在、已过期或读取失败时返回 None"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                header = pickle.load(f)
+                if header.get('version') != CACHE_FORMAT_VERSION or time.time() - header['created'] > ttl:
+                    return None
+                while True:
+                    blob = pickle.load(f)
+                    if blob is None:
+                        break
+                    columns = pickle.loads(zlib.decompress(blob))
+                    rows.extend(list(zip(*columns)))
+            # 更新访问时间，用于按最近使用淘汰
+            os.utime(path, None)
+            return header
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f'读取查询缓存失败: {path}, 错误: {e}')
+            return None
+
+    def put(self, key, column_names, chunks, **extra):
+        """写入缓存，chunks 为逐块的行列表，extra 随头信息一起保存"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                header = {'version': CACHE_FORMAT_VERSION, 'created': time.time(), 'columns': list(column_names)}
+                header.update(extra)
+                pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+                for chunk in chunks:
+                    if chunk:
+                        # 按列组织后压缩，同一列的值类型相近，压缩率更高
+                        columns = [list(column) for column in zip(*chunk)]
+                        blob = zlib.compress(pickle.dumps(columns, protocol=pickle.HIGHEST_PROTOCOL))
+                        pickle.dump(blob, f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(None, f)  # 结束标记
+            os.replace(temp_path, path)
+        except Exception as e:
+            logging.warning(f'写入查询缓存失败: {path}, 错误: {e}')
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """总大小超过上限时，按最近使用时间从旧到新删除缓存文件"""
+        with self._lock:
+            try:
+                entries = []
+                for name in os.listdir(self.cache_dir):
+                    if not name.endswith('.cache'):
+                        continue
+                    path = os.path.join(self.cache_dir, name)
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            except FileNotFoundError:
+                return
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    logging.info(f'淘汰查询缓存: {path}')
+                except OSError as e:
+                    logging.warning(f'删除查询缓存失败: {path}, 错误: {e}')
+
+
+# 进程内共享的查询缓存
+query_cache = QueryCache()
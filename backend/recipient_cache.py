@@ -0,0 +1,107 @@
+"""
+定时任务收件人缓存
+
+任务的收件人由直接关联的邮箱和所关联邮箱组的成员合并得到，每次运行都查询数据库并逐个校验邮箱格式。
+收件人变化远少于任务运行，因此按任务缓存合并、校验后的收件人列表：
+- 修改任务收件人、删除任务时只清除该任务的缓存
+- 修改邮箱、邮箱组及其成员时清除全部缓存（一个邮箱或邮箱组可能关联多个任务）
+- 绕过接口直接修改数据库的情况，由有效期兜底
+- 多节点调度（SCHEDULER_CONFIG['mode'] 为 distributed）时不缓存：清除只发生在处理修改请求的节点上，
+  其他节点的缓存会在有效期内继续使用旧的收件人
+"""
+import logging
+import re
+import threading
+import time
+from functools import lru_cache
+
+from backend.config import RECIPIENT_CACHE_CONFIG, SCHEDULER_CONFIG
+
+# 任务的全部收件人：直接关联的邮箱 + 关联邮箱组的成员
+RECIPIENTS_SQL = """
+    WITH task_emails AS (
+        -- 直接关联的邮箱
+        SELECT e.email
+        FROM autoreport_emails e
+        JOIN autoreport_task_recipients tr ON e.id = tr.email_id
+        WHERE tr.task_id = %s
+
+        UNION
+
+        -- 通过邮箱组关联的邮箱
+        SELECT e.email
+        FROM autoreport_emails e
+        JOIN autoreport_email_group_members egm ON e.id = egm.email_id
+        JOIN autoreport_task_recipients tr ON egm.group_id = tr.group_id
+        WHERE tr.task_id = %s
+    )
+    SELECT email FROM task_emails ORDER BY email
+"""
+
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$')
+
+
+@lru_cache(maxsize=4096)
+def is_valid_email(email):
+    """验证邮箱格式"""
+    return EMAIL_PATTERN.match(email) is not None
+
+
+class RecipientCache:
+    """
+    按任务ID缓存收件人列表
+
+    Args:
+        ttl: 缓存有效期（秒），0 表示不缓存；省略时使用配置，多节点调度时为 0
+    """
+
+    def __init__(self, ttl=None):
+        if ttl is None:
+            ttl = 0 if SCHEDULER_CONFIG['mode'] == 'distributed' else RECIPIENT_CACHE_CONFIG['ttl']
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}  # {task_id: (加载时间, 收件人列表)}
+        # 每次清除缓存加一；查询期间发生过清除时，查询结果可能已过期，不写入缓存
+        self._generation = 0
+
+    def get(self, task_id, cursor):
+        """
+        获取任务的收件人列表（已去重、排序并过滤格式错误的邮箱），未缓存时使用 cursor 查询数据库
+        """
+        task_id = str(task_id)
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                return list(entry[1])
+            generation = self._generation
+
+        cursor.execute(RECIPIENTS_SQL, (task_id, task_id))
+        recipients = []
+        for row in cursor.fetchall():
+            email = row[0]
+            if is_valid_email(email):
+                recipients.append(email)
+            else:
+                logging.warning(f"任务 {task_id} 的收件人邮箱格式错误，已跳过: {email}")
+
+        if self.ttl > 0:
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[task_id] = (time.monotonic(), recipients)
+        return list(recipients)
+
+    def invalidate(self, task_id):
+        """清除一个任务的缓存"""
+        with self._lock:
+            self._entries.pop(str(task_id), None)
+            self._generation += 1
+
+    def clear(self):
+        """清除全部缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+
+# 进程内共享的收件人缓存
+recipient_cache = RecipientCache()
@@ -0,0 +1,411 @@
+"""
+报表结果块模型
+
+每条SQL的查询结果在内存中表示为一个 ReportBlock（表头 + 数据行 + 样式 + 条件格式），
+按 pos 规则计算位置后直接写入汇总表的目标位置，样式对象在工作簿内共享；
+只写模式下先完成整个工作表的布局，再逐行写入。
+"""
+import logging
+from collections import OrderedDict, namedtuple
+from copy import copy
+
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import Cell, TIME_TYPES, get_time_format
+from openpyxl.formatting.formatting import ConditionalFormattingList
+from openpyxl.styles import Font, Border, PatternFill, Protection, Alignment
+from openpyxl.styles.borders import DEFAULT_BORDER
+from openpyxl.styles.fills import DEFAULT_EMPTY_FILL
+from openpyxl.styles.fonts import DEFAULT_FONT
+from openpyxl.utils import get_column_letter
+
+# 单元格样式（number_format 为 None 表示未显式设置，由单元格的值决定）
+CellStyle = namedtuple('CellStyle', ['font', 'border', 'fill', 'number_format', 'protection', 'alignment'])
+
+# 未设置任何样式的单元格
+BLANK_STYLE = CellStyle(DEFAULT_FONT, DEFAULT_BORDER, DEFAULT_EMPTY_FILL, None, Protection(), Alignment())
+
+# Excel最大列数
+EXCEL_MAX_COLUMN = 16384
+
+
+class ReportBlock:
+    """
+    一条SQL的查询结果块
+
+    行列号从1开始，与临时工作表中的坐标一致：第1行为表头，之后为数据行。
+    样式规则由 format_rules 编译后通过 extend/intern/set_style 写入结果块。
+    number_formats 为按列推断的数字格式（见 result_columns），推断出格式的列中非空单元格直接使用该格式。
+    """
+
+    def __init__(self, columns, data, header_font, data_font, border, number_formats=None):
+        self.columns = list(columns)
+        self.data = data
+        self._row_styles = (
+            CellStyle(header_font, border, DEFAULT_EMPTY_FILL, None, Protection(), Alignment()),
+            CellStyle(data_font, border, DEFAULT_EMPTY_FILL, None, Protection(), Alignment()),
+        )
+        self._interned = {style: style for style in self._row_styles}
+        self._interned[BLANK_STYLE] = BLANK_STYLE
+        self._column_styles = tuple(
+            self.intern(self._row_styles[1]._replace(number_format=number_format)) if number_format else self._row_styles[1]
+            for number_format in (number_formats or ())
+        )
+        # 被样式规则修改过的单元格 {(row, col): CellStyle}
+        self._styles = {}
+        self.conditional_formatting = ConditionalFormattingList()
+
+        # 与 openpyxl 一致：空表的 max_row/max_column 为 1
+        self._max_row = max(1, len(data) + 1)
+        self._max_column = max([1, len(self.columns)] + [len(row) for row in data])
+
+    @property
+    def max_row(self):
+        return self._max_row
+
+    @property
+    def max_column(self):
+        return self._max_column
+
+    def extend(self, row, column):
+        """扩展结果块的范围（与 openpyxl 一致，样式规则访问到的单元格计入范围）"""
+        if row > self._max_row:
+            self._max_row = row
+        if column > self._max_column:
+            self._max_column = column
+
+    def _values(self, row):
+        if row == 1:
+            return self.columns
+        if row - 2 < len(self.data):
+            return self.data[row - 2]
+        return ()
+
+    def value_at(self, row, column):
+        values = self._values(row)
+        return values[column - 1] if column <= len(values) else None
+
+    def _data_style(self, column, value):
+        """数据行中有值单元格的默认样式"""
+        if value is not None and column <= len(self._column_styles):
+            return self._column_styles[column - 1]
+        return self._row_styles[1]
+
+    def _default_style(self, row, column):
+        values = self._values(row)
+        if column > len(values):
+            return BLANK_STYLE
+        return self._row_styles[0] if row == 1 else self._data_style(column, values[column - 1])
+
+    def style_at(self, row, column):
+        style = self._styles.get((row, column))
+        return style if style is not None else self._default_style(row, column)
+
+    def intern(self, style):
+        """返回与 style 相等的共享样式对象"""
+        return self._interned.setdefault(style, style)
+
+    def set_style(self, row, column, style):
+        self._styles[(row, column)] = style
+
+    def iter_row(self, row):
+        """
+        遍历结果块某一行中有值或有样式的单元格
+        返回 (列号, 值, 样式)，样式为 None 表示无样式
+        """
+        values = self._values(row)
+        styles = self._styles
+        header = row == 1
+        for column in range(1, self._max_column + 1):
+            if column <= len(values):
+                value = values[column - 1]
+                style = styles.get((row, column))
+                if style is None:
+                    style = self._row_styles[0] if header else self._data_style(column, value)
+            else:
+                style = styles.get((row, column))
+                if style is None:
+                    continue
+                value = None
+            if style is BLANK_STYLE:
+                if value is None:
+                    continue
+                style = None
+            yield column, value, style
+
+
+def _bound_number_format(value):
+    """新单元格写入值后 openpyxl 自动设置的数字格式"""
+    if isinstance(value, TIME_TYPES):
+        return get_time_format(type(value))
+    return 'General'
+
+
+def _summary_style(style, value):
+    """
+    计算写入汇总表的最终样式
+    保留的字段与原先从临时表逐单元格复制样式时一致
+    """
+    font, border, fill = style.font, style.border, style.fill
+    return CellStyle(
+        Font(name=font.name, size=font.size, bold=font.bold, italic=font.italic,
+             vertAlign=font.vertAlign, underline=font.underline, strike=font.strike, color=font.color),
+        Border(left=border.left, right=border.right, top=border.top, bottom=border.bottom,
+               diagonal=border.diagonal, diagonal_direction=border.diagonal_direction,
+               outline=border.outline, vertical=border.vertical, horizontal=border.horizontal),
+        PatternFill(fill_type=fill.fill_type, start_color=fill.start_color, end_color=fill.end_color),
+        style.number_format if style.number_format is not None else _bound_number_format(value),
+        Protection(locked=style.protection.locked, hidden=style.protection.hidden),
+        Alignment(horizontal=style.alignment.horizontal, vertical=style.alignment.vertical,
+                  text_rotation=style.alignment.text_rotation, wrap_text=style.alignment.wrap_text,
+                  shrink_to_fit=style.alignment.shrink_to_fit, indent=style.alignment.indent),
+    )
+
+
+class StyleCache:
+    """
+    工作簿级别的样式缓存：相同样式只生成一次，单元格之间共享样式索引
+    """
+
+    def __init__(self, worksheet):
+        self._worksheet = worksheet
+        self._arrays = {}
+
+    def apply(self, cell, style, value):
+        """将结果块中的样式应用到汇总表单元格，value 为结果块中该单元格的值"""
+        number_format = style.number_format
+        if number_format is None and isinstance(value, TIME_TYPES):
+            number_format = get_time_format(type(value))
+        key = (style, number_format)
+        style_array = self._arrays.get(key)
+        if style_array is None:
+            final = _summary_style(style, value)
+            template = Cell(self._worksheet)
+            template.font = final.font
+            template.border = final.border
+            template.fill = final.fill
+            template.number_format = final.number_format
+            template.protection = final.protection
+            template.alignment = final.alignment
+            style_array = self._arrays[key] = template._style
+        cell._style = copy(style_array)
+
+
+def render_block(worksheet, block, start_row, start_col, styles, task=None):
+    """
+    将结果块的值和样式直接写入汇总表的目标位置
+
+    与原先从临时表逐单元格复制一致：值为 None 时不覆盖已有的值，无样式时不覆盖已有的样式
+    """
+    for block_row in range(1, block.max_row + 1):
+        if task is not None and task.cancelled:  # 检查是否取消
+            raise Exception('Task cancelled')
+
+        row_idx = start_row + block_row - 1
+        for block_col, value, style in block.iter_row(block_row):
+            cell = worksheet.cell(row=row_idx, column=start_col + block_col - 1, value=value)
+            if style is not None:
+                styles.apply(cell, style, value)
+
+
+def place_block(pos, block_rows, block_cols, pos_dict, summary_row_offset):
+    """
+    根据 pos 字段（n-m）计算结果块在汇总表中的起始位置
+
+    Returns:
+        tuple: (start_row, start_col, summary_row_offset)
+    """
+    if pos:
+        try:
+            # 解析pos格式 n-m
+            pos_parts = pos.split('-')
+            if len(pos_parts) != 2:
+                raise ValueError('Invalid pos format')
+
+            pos_row = int(pos_parts[0])
+            pos_col = int(pos_parts[1])
+
+            if pos_row <= 0 or pos_col <= 0:
+                raise ValueError('Pos values must be positive integers')
+
+            # 处理位置
+            if pos_row == 1 and pos_col == 1:
+                # 第一个表格，放在左上角
+                start_row = 1
+                start_col = 1
+            else:
+                if pos_col == 1:
+                    # 当m_number=1时
+                    # 寻找n-1的所有结果的最大行
+                    max_row = 0
+                    # 遍历所有以n-1开头的pos键
+                    for key in pos_dict.keys():
+                        if key.startswith(f'{pos_row-1}-'):
+                            max_row = max(max_row, pos_dict[key]['end_row'])
+                    start_row = max_row + 2  # 增加1行间隔
+                    start_col = 1
+                else:
+                    # 当m_number >= 2时
+                    # 找到n=pos_row且m=pos_col-1的结果
+                    prev_key = f'{pos_row}-{pos_col-1}'
+                    if prev_key in pos_dict:
+                        start_row = pos_dict[prev_key]['start_row']
+                        start_col = pos_dict[prev_key]['end_col'] + 2  # 增加1列间隔
+                    else:
+                        # 如果找不到前一个表格，使用默认位置
+                        start_row = summary_row_offset + 1  # 增加1行间隔
+                        start_col = 1
+
+            # 将当前表格的位置信息存入字典
+            pos_dict[f'{pos_row}-{pos_col}'] = {
+                'start_row': start_row,
+                'start_col': start_col,
+                'end_row': start_row + block_rows - 1,
+                'end_col': start_col + block_cols - 1
+            }
+
+            # 增加表格间的空行
+            summary_row_offset += 1
+
+        except Exception as e:
+            logging.warning(f'Invalid pos value "{pos}": {e}. Using default position.')
+            start_row = summary_row_offset
+            start_col = 1
+    else:
+        # 没有pos字段，使用默认顺序
+        start_row = summary_row_offset
+        start_col = 1
+
+    return start_row, start_col, summary_row_offset
+
+
+def translate_range(cell_range, start_row, start_col):
+    """将结果块内的区域换算为汇总表中的区域字符串"""
+    # 计算新范围的起始和结束坐标
+    new_start_row = start_row + cell_range.min_row - 1
+    new_end_row = new_start_row + (cell_range.max_row - cell_range.min_row)
+    new_start_col = start_col + cell_range.min_col - 1
+    new_end_col = start_col + cell_range.max_col - 1
+
+    # 确保列索引不超过Excel最大列数限制
+    if new_end_col > EXCEL_MAX_COLUMN:
+        new_end_col = EXCEL_MAX_COLUMN
+        new_start_col = new_end_col - (cell_range.max_col - cell_range.min_col + 1) + 1
+        if new_start_col < 1:
+            new_start_col = 1
+
+    return f"{get_column_letter(new_start_col)}{new_start_row}:{get_column_letter(new_end_col)}{new_end_row}"
+
+
+def block_conditional_formats(block, start_row, start_col):
+    """
+    结果块的条件格式在汇总表中的区域和规则
+    与原先复制临时表时一致，每个区域只取第一个区域和第一条规则
+    """
+    for cf in block.conditional_formatting:
+        orig_range = list(cf.cells.ranges)[0]
+        yield translate_range(orig_range, start_row, start_col), cf.rules[0]
+
+
+class ConditionalFormatRegistry:
+    """
+    工作表级别的条件格式登记表
+
+    每个结果块的条件格式只换算一次，相同区域只保留第一次登记的规则，
+    保存前一次性写入工作表，规则数量只与结果块和区域有关，与数据行数无关。
+    """
+
+    def __init__(self, row_offset=0, col_offset=0):
+        self.row_offset = row_offset
+        self.col_offset = col_offset
+        self._rules = OrderedDict()
+
+    def add_block(self, block, start_row, start_col):
+        """登记结果块的条件格式，start_row/start_col 为结果块在汇总表中的起始位置（不含边距）"""
+        for cell_range, rule in block_conditional_formats(
+                block, start_row + self.row_offset, start_col + self.col_offset):
+            self._rules.setdefault(cell_range, rule)
+
+    def __len__(self):
+        return len(self._rules)
+
+    def apply(self, worksheet):
+        """将登记的条件格式写入工作表"""
+        for cell_range, rule in self._rules.items():
+            worksheet.conditional_formatting.add(cell_range, rule)
+
+
+def stream_blocks(worksheet, placed_blocks, row_offset=1, col_offset=1, task=None):
+    """
+    将已布局的结果块逐行写入只写（write_only）工作表
+
+    Args:
+        worksheet: 只写模式的工作表
+        placed_blocks: [(block, start_row, start_col)]，按模板顺序排列，后写入的块覆盖先写入的块
+        row_offset: 顶部留空的行数
+        col_offset: 左侧留空的列数
+        task: 用于检查取消状态的任务对象
+    """
+    styles = StyleCache(worksheet)
+
+    # 条件格式：相同区域只保留第一次出现的规则
+    conditional_formats = ConditionalFormatRegistry(row_offset, col_offset)
+    for block, start_row, start_col in placed_blocks:
+        conditional_formats.add_block(block, start_row, start_col)
+    conditional_formats.apply(worksheet)
+
+    # 按起始行排序，逐行维护当前覆盖的结果块
+    spans = sorted(
+        ((start_row, start_row + block.max_row - 1, index, block, start_col)
+         for index, (block, start_row, start_col) in enumerate(placed_blocks)),
+        key=lambda span: span[0]
+    )
+    last_row, _ = sheet_extent(placed_blocks)
+
+    for _ in range(row_offset):
+        worksheet.append([])
+
+    active = []
+    next_span = 0
+    for row_idx in range(1, last_row + 1):
+        if task is not None and task.cancelled:  # 检查是否取消
+            raise Exception('Task cancelled')
+
+        while next_span < len(spans) and spans[next_span][0] == row_idx:
+            active.append(spans[next_span])
+            next_span += 1
+        active = [span for span in active if span[1] >= row_idx]
+        active.sort(key=lambda span: span[2])
+
+        # 合并当前行涉及的所有结果块 {列号: (值, 样式, 结果块中的值)}
+        merged = {}
+        for start_row, _, _, block, start_col in active:
+            for block_col, value, style in block.iter_row(row_idx - start_row + 1):
+                col = start_col + block_col - 1
+                previous = merged.get(col)
+                if previous is None:
+                    merged[col] = (value, style, value)
+                else:
+                    merged[col] = (
+                        value if value is not None else previous[0],
+                        style if style is not None else previous[1],
+                        value if style is not None else previous[2],
+                    )
+
+        if not merged:
+            worksheet.append([])
+            continue
+
+        cells = [None] * (max(merged) + col_offset)
+        for col, (value, style, style_value) in merged.items():
+            cell = WriteOnlyCell(worksheet, value)
+            if style is not None:
+                styles.apply(cell, style, style_value)
+            cells[col + col_offset - 1] = cell
+        worksheet.append(cells)
+
+
+def sheet_extent(placed_blocks):
+    """已布局结果块占用的最大行号和最大列号"""
+    max_row = max((start_row + block.max_row - 1 for block, start_row, _ in placed_blocks), default=0)
+    max_col = max((start_col + block.max_column - 1 for block, _, start_col in placed_blocks), default=0)
+    return max_row, max_col
@@ -0,0 +1,283 @@
+"""
+报表SQL并发执行
+
+模板中每一行SQL相互独立，提交到有上限的线程池并发执行；
+同一数据库的并发数单独限制，避免同时压到一个库上。结果由调用方按模板顺序取用，保证输出稳定。
+查询结果按分块读取，超过一个分块的结果暂存到临时文件，内存占用以分块大小为上限；
+每个分块读取后按列处理空值和类型，并推断每列的数字格式（见 result_columns）。
+"""
+import logging
+import pickle
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.config import REPORT_CONFIG
+from backend.db_pool import connection_pool
+from backend.query_cache import query_cache, cache_key
+from backend.incremental import incremental_store, advance_watermark, fill_watermark, watermark_orders
+from backend.result_columns import coerce_rows, merge_number_formats
+from backend.utils import iter_query
+
+
+class SpooledRows:
+    """
+    分块存储的查询结果行
+
+    行数不超过一个分块时只保存在内存中；超过后按分块写入临时文件，
+    读取时每次载入一个分块，支持 len()、按下标访问和顺序遍历，接口与行列表一致。
+    """
+
+    def __init__(self, chunk_size):
+        self.chunk_size = max(1, chunk_size)
+        self._buffer = []
+        self._file = None
+        self._offsets = []  # 每个分块在临时文件中的起始位置
+        self._length = 0
+        self._loaded_index = None
+        self._loaded = None
+        self._number_formats = None
+        self.query_seconds = 0.0  # 数据库查询耗时（命中缓存时为 0）
+
+    def extend(self, rows):
+        """追加一批行（按列统一空值和类型后保存）"""
+        if not rows:
+            return
+        rows, number_formats = coerce_rows(rows, len(rows[0]))
+        self._number_formats = merge_number_formats(self._number_formats, number_formats)
+        self._buffer.extend(rows)
+        self._length += len(rows)
+        while len(self._buffer) > self.chunk_size:
+            self._spill(self._buffer[:self.chunk_size])
+            del self._buffer[:self.chunk_size]
+
+    def _spill(self, rows):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix='report_rows_')
+        self._file.seek(0, 2)
+        self._offsets.append(self._file.tell())
+        pickle.dump(rows, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _chunk(self, index):
+        if index == len(self._offsets):
+            return self._buffer
+        if index != self._loaded_index:
+            self._file.seek(self._offsets[index])
+            self._loaded = pickle.load(self._file)
+            self._loaded_index = index
+        return self._loaded
+
+    @property
+    def number_formats(self):
+        """每列推断出的数字格式，无法推断的列为 None"""
+        if self._number_formats is None:
+            return None
+        return [number_format or None for number_format in self._number_formats]
+
+    @property
+    def nbytes(self):
+        """结果序列化后的字节数（近似结果集大小）"""
+        size = 0
+        if self._file is not None:
+            self._file.seek(0, 2)
+            size = self._file.tell()
+        if self._buffer:
+            size += len(pickle.dumps(self._buffer, protocol=pickle.HIGHEST_PROTOCOL))
+        return size
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('row index out of range')
+        return self._chunk(index // self.chunk_size)[index % self.chunk_size]
+
+    def iter_chunks(self):
+        """按分块顺序返回行列表"""
+        for index in range(len(self._offsets) + 1):
+            yield self._chunk(index)
+
+    def __iter__(self):
+        for chunk in self.iter_chunks():
+            yield from chunk
+
+    def close(self):
+        """删除临时文件（可重复调用）"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def close_results(futures):
+    """
+    关闭不再使用的查询结果的临时文件
+
+    已完成的结果立即关闭；仍在执行的在完成后关闭（生成失败或取消时线程池不等待正在执行的SQL）。
+    """
+    def close(future):
+        if not future.cancelled() and future.exception() is None:
+            future.result()[1].close()
+
+    for future in futures:
+        future.add_done_callback(close)
+
+
+class QueryExecutor:
+    """
+    报表SQL执行器
+
+    Args:
+        max_workers: 线程池大小，默认 REPORT_CONFIG['query_workers']
+        per_db_limit: 同一数据库（host, port, database）的最大并发数，默认 REPORT_CONFIG['query_workers_per_db']
+        chunk_size: 每次从数据库读取的行数，默认 REPORT_CONFIG['query_chunk_size']
+    """
+
+    def __init__(self, max_workers=None, per_db_limit=None, chunk_size=None):
+        self.max_workers = max(1, max_workers or REPORT_CONFIG['query_workers'])
+        self.per_db_limit = max(1, per_db_limit or REPORT_CONFIG['query_workers_per_db'])
+        self.chunk_size = max(1, chunk_size or REPORT_CONFIG['query_chunk_size'])
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='report-query')
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _db_semaphore(self, db_config):
+        key = (db_config.get('host'), db_config.get('port'), db_config.get('database'))
+        with self._lock:
+            semaphore = self._semaphores.get(key)
+            if semaphore is None:
+                semaphore = self._semaphores[key] = threading.BoundedSemaphore(self.per_db_limit)
+            return semaphore
+
+    def submit(self, db_config, sql, task=None, variables=None, cache_ttl=0):
+        """
+        提交一条SQL
+
+        Args:
+            variables: 已替换到SQL中的变量，作为缓存键的一部分
+            cache_ttl: 查询结果缓存的有效期（秒），0 表示不使用缓存
+
+        Returns:
+            Future: 结果为 (column_names, SpooledRows, from_cache)，执行失败时抛出原始异常
+        """
+        return self._pool.submit(self._run, db_config, sql, task, variables, cache_ttl)
+
+    def _run(self, db_config, sql, task, variables, cache_ttl):
+        key = None
+        if cache_ttl and cache_ttl > 0:
+            key = cache_key(sql, variables, db_config)
+            rows = SpooledRows(self.chunk_size)
+            columns = query_cache.get(key, cache_ttl, rows)
+            if columns is not None:
+                logging.info(f'查询缓存命中: {key}')
+                return columns, rows, True
+            rows.close()
+
+        columns, rows = self._query(db_config, sql, task)
+        if key is not None:
+            query_cache.put(key, columns, rows.iter_chunks())
+        return columns, rows, False
+
+    def submit_incremental(self, db_config, sql, key, watermark_column, initial_watermark, task=None):
+        """
+        提交一条增量SQL（见 backend.incremental）
+
+        SQL 中的 {watermark} 替换为上次结果的水位（转义单引号），只查询新增的行，按SQL的水位列顺序
+        追加到上次的结果之后（升序）或之前（降序）；没有上次的结果、结果的列发生变化或结果不按水位列排序时，
+        使用初始水位全量查询
+
+        Args:
+            key: 增量状态键
+            watermark_column: 水位列名
+            initial_watermark: 初始水位
+
+        Returns:
+            Future: 结果与 submit 相同，from_cache 为 False
+        """
+        return self._pool.submit(self._run_incremental, db_config, sql, key, watermark_column, initial_watermark, task)
+
+    def _run_incremental(self, db_config, sql, key, watermark_column, initial_watermark, task):
+        rows = SpooledRows(self.chunk_size)
+        columns, watermark = incremental_store.load(key, rows)
+        if columns is None:
+            watermark = initial_watermark
+
+        delta_columns, delta = self._query(db_config, fill_watermark(sql, watermark), task)
+        query_seconds = delta.query_seconds
+        try:
+            orders = None  # 上次结果和新增行共同的水位列顺序，全量查询时为 None
+            if columns is not None:
+                if list(delta_columns) != list(columns):
+                    reason = '结果的列与上次不一致'
+                else:
+                    orders = (watermark_orders(columns, rows.iter_chunks(), watermark_column)
+                              & watermark_orders(delta_columns, delta.iter_chunks(), watermark_column))
+                    reason = None if orders else '结果不按水位列排序，无法与上次的结果合并'
+                if reason:
+                    logging.warning(f'增量查询{reason}，重新全量查询: {key}')
+                    rows.close()
+                    delta.close()
+                    rows = SpooledRows(self.chunk_size)
+                    orders = None
+                    watermark = initial_watermark
+                    delta_columns, delta = self._query(db_config, fill_watermark(sql, watermark), task)
+                    query_seconds += delta.query_seconds
+
+            watermark = advance_watermark(watermark, delta_columns, delta.iter_chunks(), watermark_column)
+            if orders is not None and 'asc' not in orders:
+                # 按水位列降序：新增行在上次的结果之前
+                merged = SpooledRows(self.chunk_size)
+                for chunk in delta.iter_chunks():
+                    merged.extend(chunk)
+                for chunk in rows.iter_chunks():
+                    merged.extend(chunk)
+                rows.close()
+                rows = merged
+            else:
+                for chunk in delta.iter_chunks():
+                    rows.extend(chunk)
+            incremental_store.save(key, delta_columns, rows.iter_chunks(), watermark)
+            rows.query_seconds = query_seconds
+            logging.info(f'增量查询完成: 新增 {len(delta)} 行，共 {len(rows)} 行，水位 {watermark}')
+        except Exception:
+            rows.close()
+            raise
+        finally:
+            delta.close()
+        return delta_columns, rows, False
+
+    def _query(self, db_config, sql, task):
+        with self._db_semaphore(db_config):
+            if task is not None and task.cancelled:  # 检查是否取消
+                raise Exception('Task cancelled')
+
+            # 从连接池获取连接，会话参数已在创建连接时设置
+            started = time.perf_counter()
+            with connection_pool.connection(db_config) as connection:
+                columns, chunks = iter_query(connection, sql, self.chunk_size, apply_session=False)
+                rows = SpooledRows(self.chunk_size)
+                try:
+                    for chunk in chunks:
+                        if task is not None and task.cancelled:  # 检查是否取消
+                            chunks.close()
+                            raise Exception('Task cancelled')
+                        rows.extend(chunk)
+                except Exception:
+                    rows.close()
+                    raise
+                rows.query_seconds = time.perf_counter() - started
+                return columns, rows
+
+    def shutdown(self):
+        """关闭线程池，尚未开始的SQL不再执行"""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        return False
@@ -0,0 +1,120 @@
+"""
+多进程报表渲染
+
+generate_report 的渲染是纯 Python 的 CPU 密集型工作，多个 ReportTask 线程只能共用一个核。
+开启进程模式后，报表在进程池中生成：子进程通过队列把进度发回主进程，
+主进程的取消操作通过事件通知子进程，ReportTask 的进度和取消接口保持不变。
+子进程中累加的运行指标在报表结束（包括失败）时以 {'metrics': ...} 发到同一个队列，由主进程合并。
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from backend.config import REPORT_CONFIG
+from backend.metrics import registry
+
+_pool = None
+_manager = None
+_lock = threading.Lock()
+
+
+class ProcessTaskProxy:
+    """
+    子进程中传给 generate_report 的任务对象
+    接口与 ReportTask 一致：update_progress 把进度发回主进程，cancelled 读取主进程设置的取消事件
+    """
+
+    def __init__(self, original_filename, progress_queue, cancel_event):
+        self.original_filename = original_filename
+        self._progress_queue = progress_queue
+        self._cancel_event = cancel_event
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def update_progress(self, progress):
+        """更新进度"""
+        self._progress_queue.put(progress)
+
+        # 检查是否取消
+        if self.cancelled:
+            raise Exception('任务已取消')
+
+
+def _init_worker(log_file):
+    """子进程初始化：日志写入与主进程相同的文件"""
+    os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[logging.FileHandler(log_file, mode='a')]
+    )
+
+
+# generate_report 写在任务对象上、需要传回主进程的属性
+RESULT_ATTRIBUTES = ('stage_timings', 'query_stats', 'profile_files')
+
+
+def _render(input_file, original_filename, variables_filename, progress_queue, cancel_event, profile=None):
+    """
+    在子进程中生成报表
+
+    Returns:
+        tuple: (输出文件路径, {RESULT_ATTRIBUTES 中的属性: 值})
+    """
+    from backend.report_generator_v2 import generate_report
+
+    task = ProcessTaskProxy(original_filename, progress_queue, cancel_event)
+    try:
+        output_path = generate_report(task, task, input_file=input_file, variables_filename=variables_filename,
+                                      profile=profile)
+    finally:
+        # 本次生成在子进程中累加的指标发回主进程
+        progress_queue.put({'metrics': registry.drain()})
+    return output_path, {name: getattr(task, name, None) for name in RESULT_ATTRIBUTES}
+
+
+def _get_pool(log_file):
+    global _pool, _manager
+    with _lock:
+        if _pool is None:
+            # 使用 spawn 启动子进程，避免在多线程的 Flask 进程中 fork
+            context = multiprocessing.get_context('spawn')
+            _manager = context.Manager()
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, REPORT_CONFIG['render_processes']),
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(log_file,)
+            )
+            logging.info(f"报表渲染进程池已启动，进程数: {REPORT_CONFIG['render_processes']}")
+        return _pool, _manager
+
+
+def submit_render(input_file, original_filename, variables_filename, log_file, profile=None):
+    """
+    提交报表到进程池生成
+
+    Returns:
+        tuple: (future, progress_queue, cancel_event)
+    """
+    pool, manager = _get_pool(log_file)
+    progress_queue = manager.Queue()
+    cancel_event = manager.Event()
+    future = pool.submit(_render, input_file, original_filename, variables_filename, progress_queue, cancel_event,
+                         profile)
+    return future, progress_queue, cancel_event
+
+
+def shutdown():
+    """关闭进程池"""
+    global _pool, _manager
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _manager.shutdown()
+            _pool = None
+            _manager = None
@@ -0,0 +1,163 @@
+"""
+报表生成性能剖析（按需开启）
+
+开启后（手动生成时请求参数 profile 为 true，定时任务 settings 中 profile 为 true，或 REPORT_PROFILE=true），
+generate_report 的每个阶段（StageTimer.stage）以及格式规则、冻结窗格、保存等环节作为嵌套的剖析区段，
+记录各区段的调用次数、墙钟时间、CPU 时间和内存块数量变化；同时按 REPORT_CONFIG['profile_interval']
+对生成报表的线程采样调用栈。结束后在输出文件旁写入：
+
+    <报表名>.profile.json     各区段的汇总
+    <报表名>.cpu.folded       按区段嵌套的 CPU 时间（微秒，collapsed stack 格式）
+    <报表名>.samples.folded   调用栈采样（区段路径 + Python 调用栈，值为采样次数）
+
+.folded 文件可直接用 flamegraph.pl 或 speedscope 生成火焰图。
+
+说明：CPU 时间只统计生成报表的线程（SQL 在查询线程池中执行，等待查询阶段主要是墙钟时间）；
+内存块数量为整个进程的净变化（sys.getallocatedblocks），并发的查询线程也会计入。
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+from backend.config import REPORT_CONFIG
+
+_local = threading.local()
+
+
+def current_profiler():
+    """当前线程正在使用的剖析器，未开启时为 None"""
+    return getattr(_local, 'profiler', None)
+
+
+@contextmanager
+def profile_section(name):
+    """在当前线程的剖析器中记录一个区段，未开启剖析时不做任何事"""
+    profiler = current_profiler()
+    if profiler is None:
+        yield
+        return
+    with profiler.section(name):
+        yield
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', os.path.basename(code.co_filename))
+    return f'{module}:{code.co_name}'
+
+
+class ReportProfiler:
+    """
+    单次报表生成的剖析器
+
+    在生成报表的线程中 start()，结束后 stop() 并 write(输出文件路径)。
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval or REPORT_CONFIG['profile_interval']
+        self.sections = OrderedDict()  # 区段路径 -> {'calls', 'wall', 'cpu', 'blocks'}
+        self.samples = Counter()  # 折叠后的调用栈 -> 采样次数
+        self._path = []
+        self._thread_id = None
+        self._root_code = None
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def start(self, root=None):
+        """
+        开始剖析当前线程
+
+        Args:
+            root: 采样时调用栈从该函数开始（如 generate_report），省略其上的线程启动等帧
+        """
+        _local.profiler = self
+        self._thread_id = threading.get_ident()
+        self._root_code = getattr(root, '__code__', None)
+        self._sampler = threading.Thread(target=self._sample_loop, name='report-profiler', daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        if getattr(_local, 'profiler', None) is self:
+            _local.profiler = None
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+    @contextmanager
+    def section(self, name):
+        """统计 with 块的墙钟时间、CPU 时间和内存块变化，嵌套的区段按路径分别统计"""
+        self._path.append(name)
+        key = ';'.join(self._path)
+        wall, cpu, blocks = time.perf_counter(), time.thread_time(), sys.getallocatedblocks()
+        try:
+            yield
+        finally:
+            item = self.sections.setdefault(key, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'blocks': 0})
+            item['calls'] += 1
+            item['wall'] += time.perf_counter() - wall
+            item['cpu'] += time.thread_time() - cpu
+            item['blocks'] += sys.getallocatedblocks() - blocks
+            self._path.pop()
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            path = list(self._path)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                if frame.f_code is self._root_code:
+                    break
+                frame = frame.f_back
+            stack.reverse()
+            self.samples[';'.join(path + stack)] += 1
+
+    def _self_time(self, field):
+        """各区段去掉直接子区段后的值（collapsed stack 格式中父区段的值不含子区段）"""
+        result = OrderedDict((key, item[field]) for key, item in self.sections.items())
+        for key, item in self.sections.items():
+            parent = key.rpartition(';')[0]
+            if parent in result:
+                result[parent] -= item[field]
+        return result
+
+    def summary(self):
+        """{区段路径: {'calls', 'wall_ms', 'cpu_ms', 'alloc_blocks'}}"""
+        return OrderedDict(
+            (key, {'calls': item['calls'], 'wall_ms': round(item['wall'] * 1000, 3),
+                   'cpu_ms': round(item['cpu'] * 1000, 3), 'alloc_blocks': item['blocks']})
+            for key, item in self.sections.items()
+        )
+
+    def write(self, output_path):
+        """
+        在 output_path 旁写入剖析结果
+
+        Returns:
+            list: 写入的文件路径
+        """
+        base = os.path.splitext(output_path)[0]
+        files = [f'{base}.profile.json', f'{base}.cpu.folded', f'{base}.samples.folded']
+        with open(files[0], 'w', encoding='utf-8') as f:
+            json.dump({'report': os.path.basename(output_path), 'sample_interval': self.interval,
+                       'samples': sum(self.samples.values()), 'sections': self.summary()},
+                      f, ensure_ascii=False, indent=2)
+        with open(files[1], 'w', encoding='utf-8') as f:
+            for key, seconds in self._self_time('cpu').items():
+                f.write(f'{key} {max(round(seconds * 1_000_000), 0)}\n')
+        with open(files[2], 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f'{stack} {count}\n')
+        return files
+
+    def log_summary(self):
+        for key, item in self.summary().items():
+            logging.info(f"剖析 {key}: {item['calls']} 次, 墙钟 {item['wall_ms']:.1f}ms, "
+                         f"CPU {item['cpu_ms']:.1f}ms, 内存块 {item['alloc_blocks']:+d}")
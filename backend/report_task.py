@@ -3,8 +3,12 @@ import sys
 import threading
 import time
 import logging
+import queue
 from datetime import datetime
 from .report_generator_v2 import generate_report
+from .report_process import submit_render
+from backend.config import REPORT_CONFIG
+from backend.metrics import ACTIVE_REPORT_TASKS, REPORT_GENERATION_SECONDS, registry
 try:
     from backend.task_scheduler import global_log_file
 except ImportError:
@@ -25,7 +29,7 @@ logging.basicConfig(
 )
 
 class ReportTask:
-    def __init__(self, input_file, original_filename, variables_filename=None):
+    def __init__(self, input_file, original_filename, variables_filename=None, profile=None):
         self.input_file = input_file
         self.original_filename = original_filename  # 存储原始文件名
         self.output_file = None
@@ -38,14 +42,23 @@ class ReportTask:
         self.output_file_size = None  # 新增文件大小属性
         self.cancelled = False  # 新增取消标志
         self.variables_filename = variables_filename
+        self._cancel_event = None  # 进程模式下通知子进程取消的事件
+        self.profile = profile  # 是否开启性能剖析，None 时使用 REPORT_CONFIG['profile']
+        self.profile_files = None  # 性能剖析结果文件（在报表输出文件旁）
 
     def run(self):
         self.status['status'] = 'running'
+        ACTIVE_REPORT_TASKS.inc()
+        started = time.perf_counter()
         try:
             # 模拟执行过程，实际情况需要根据process_single_file的实现来更新进度,这里设置几个关键节点来更新
             logging.info(f'开始处理文件: {self.input_file}')
             self.logs.append(f'{datetime.now().strftime("%Y-%m-%d %H:%M:%S")} - 开始处理文件: {self.original_filename}')
-            self.output_file = generate_report(self, self, input_file=self.input_file, variables_filename=self.variables_filename)
+            if REPORT_CONFIG['render_mode'] == 'process':
+                self.output_file = self._run_in_process()
+            else:
+                self.output_file = generate_report(self, self, input_file=self.input_file, variables_filename=self.variables_filename,
+                                                   profile=self.profile)
             self.status['status'] = 'success'
             self.output_file_size = os.path.getsize(self.output_file)  # 获取文件大小
             logging.info(f'文件处理成功')
@@ -56,11 +69,42 @@ class ReportTask:
             logging.error(f'处理文件失败: {e}')
             self.logs.append(f'{datetime.now().strftime("%Y-%m-%d %H:%M:%S")} - 处理文件失败: {e}')
         finally:
+            ACTIVE_REPORT_TASKS.dec()
+            REPORT_GENERATION_SECONDS.observe(time.perf_counter() - started, source='manual',
+                                              status=self.status['status'])
             if not self.cancelled:  # 如果任务没有被取消
                 logging.info('任务完成')
                 self.logs.append(f'{datetime.now().strftime("%Y-%m-%d %H:%M:%S")} - 任务完成')
-    def update_progress(self, progress):
-        """更新进度"""
+    def _run_in_process(self):
+        """在进程池中生成报表，转发子进程的进度并传递取消操作"""
+        future, progress_queue, self._cancel_event = submit_render(
+            self.input_file, self.original_filename, self.variables_filename, global_log_file, profile=self.profile)
+        if self.cancelled:
+            self._cancel_event.set()
+        while not future.done():
+            try:
+                progress = progress_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self._record_progress(progress)
+        # 子进程结束前发出的进度可能还在队列中
+        while True:
+            try:
+                progress = progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            self._record_progress(progress)
+        output_file, attributes = future.result()
+        # 阶段耗时、SQL统计和剖析结果文件写回任务对象，与线程模式一致
+        for name, value in attributes.items():
+            setattr(self, name, value)
+        return output_file
+
+    def _record_progress(self, progress):
+        if isinstance(progress, dict) and 'metrics' in progress:
+          # 子进程生成报表时累加的指标
+          registry.merge(progress['metrics'])
+          return
         if isinstance(progress, dict):
           self.progress = progress.get('progress', self.progress)
           if 'log' in progress:
@@ -68,6 +112,10 @@ class ReportTask:
         else:
           self.progress = progress
 
+    def update_progress(self, progress):
+        """更新进度"""
+        self._record_progress(progress)
+
         # 检查是否取消
         if self.cancelled:
             raise Exception('任务已取消')
@@ -83,12 +131,15 @@ class ReportTask:
             'output_file': self.output_file,
             'output_file_size': self.output_file_size,
             'error': self.error,
+            'profile_files': self.profile_files,
             'logs': self.logs  # 返回日志信息
         }
     
     def cancel(self):
         """取消任务"""
         self.cancelled = True
+        if self._cancel_event is not None:
+            self._cancel_event.set()
 
 if __name__ == '__main__':
     # 示例用法
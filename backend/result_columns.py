@@ -0,0 +1,94 @@
+"""
+查询结果的按列处理
+
+查询结果按分块转换为 NumPy 对象数组，按列统一处理后再交给渲染：
+- 空值：NaN/NaT 统一为 None（写入时跳过）
+- 类型：Decimal 列转换为 float
+- 数字格式：按列推断（日期/时间列使用对应的日期格式，数字和文本列为 General），
+  同一列类型不一致时不推断，由写入时逐单元格判断
+转置同样在数组上完成。
+"""
+import numpy as np
+import pandas as pd
+from openpyxl.cell.cell import get_time_format
+from pandas.api.types import infer_dtype
+
+# 列中没有非空值，合并分块时不影响其他分块推断出的格式
+EMPTY_COLUMN = ''
+
+# 按列推断为 General 的类型（pandas infer_dtype 的结果）
+GENERAL_KINDS = {'integer', 'floating', 'mixed-integer-float', 'decimal', 'boolean', 'string'}
+TIME_KINDS = {'datetime', 'date', 'time', 'timedelta'}
+
+
+def to_matrix(rows, width):
+    """将行列表转换为 (行数, width) 的对象数组"""
+    matrix = np.empty((len(rows), width), dtype=object)
+    if rows:
+        try:
+            matrix[:] = rows
+        except ValueError:
+            # 值本身为序列（如 list）时 NumPy 无法整体赋值，逐个填充
+            for row_index, row in enumerate(rows):
+                for column_index, value in enumerate(row):
+                    matrix[row_index, column_index] = value
+    return matrix
+
+
+def coerce_column(column):
+    """
+    统一一列的空值和类型（原地修改）
+
+    Returns:
+        str: 推断出的数字格式；没有非空值时为 EMPTY_COLUMN，类型不一致时为 None
+    """
+    nulls = pd.isna(column)
+    if nulls.any():
+        column[nulls] = None
+        if nulls.all():
+            return EMPTY_COLUMN
+
+    kind = infer_dtype(column, skipna=True)
+    if kind == 'empty':
+        return EMPTY_COLUMN
+    if kind == 'decimal':
+        values = ~nulls
+        column[values] = column[values].astype(float)
+    if kind in GENERAL_KINDS:
+        return 'General'
+    if kind in TIME_KINDS:
+        return get_time_format(type(column[~nulls][0]))
+    return None
+
+
+def coerce_rows(rows, width):
+    """
+    按列处理一批行
+
+    Returns:
+        tuple: (处理后的行列表, 每列的数字格式)
+    """
+    matrix = to_matrix(rows, width)
+    number_formats = [coerce_column(matrix[:, index]) for index in range(width)]
+    return matrix.tolist(), number_formats
+
+
+def merge_number_formats(current, number_formats):
+    """合并两个分块推断出的列格式，任一分块类型不一致或两者不同则不推断"""
+    if current is None:
+        return list(number_formats)
+    merged = []
+    for old, new in zip(current, number_formats):
+        if old == EMPTY_COLUMN:
+            merged.append(new)
+        elif new == EMPTY_COLUMN or old == new:
+            merged.append(old)
+        else:
+            merged.append(None)
+    return merged
+
+
+def transpose_rows(columns, rows):
+    """将表头和数据行作为一个矩阵转置，返回转置后的行列表（第一行为原表头列）"""
+    rows = list(rows)
+    return to_matrix([list(columns)] + rows, len(columns)).T.tolist()
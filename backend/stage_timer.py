@@ -0,0 +1,65 @@
+"""
+报表生成阶段耗时统计
+
+generate_report 把流程划分为固定的几个阶段（读取模板、等待查询、转置、应用样式、布局、写入、
+条件格式、保存），每个阶段的耗时按名称累加，生成结束后记录到日志和任务进度中。
+开启性能剖析时，每个阶段同时作为剖析区段记录（见 backend.report_profiler）。
+"""
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# 阶段名称及显示名称（按流程顺序）
+STAGES = OrderedDict([
+    ('load_template', '读取模板'),
+    ('query_wait', '等待查询'),
+    ('transpose', '转置'),
+    ('format', '应用样式'),
+    ('layout', '布局'),
+    ('render', '写入'),
+    ('conditional_format', '条件格式'),
+    ('save', '保存'),
+])
+
+
+class StageTimer:
+    """
+    各阶段耗时（秒），同名阶段多次计时累加
+
+    Args:
+        profiler: ReportProfiler，设置后每个阶段同时记录为剖析区段
+    """
+
+    def __init__(self, profiler=None):
+        self.timings = OrderedDict((name, 0.0) for name in STAGES)
+        self.profiler = profiler
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        """统计 with 块的耗时，计入 name 阶段"""
+        start = time.perf_counter()
+        try:
+            if self.profiler is None:
+                yield
+            else:
+                with self.profiler.section(name):
+                    yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    @property
+    def total(self):
+        return time.perf_counter() - self._started
+
+    def as_dict(self):
+        """返回 {阶段: 秒}，另含 total 表示从创建到现在的总耗时"""
+        result = {name: round(seconds, 3) for name, seconds in self.timings.items()}
+        result['total'] = round(self.total, 3)
+        return result
+
+    def summary(self):
+        """可读的耗时摘要，如 "读取模板 0.12s, 等待查询 3.40s, ..., 总计 5.01s" """
+        parts = [f'{STAGES.get(name, name)} {seconds:.2f}s' for name, seconds in self.timings.items()]
+        parts.append(f'总计 {self.total:.2f}s')
+        return ', '.join(parts)
@@ -0,0 +1,126 @@
+"""
+多节点调度的任务租约
+
+多个后端实例共用一个数据库时（SCHEDULER_CONFIG['mode'] 为 distributed），到期任务必须先在
+autoreport_tasks 中取得租约才能执行：
+
+    UPDATE autoreport_tasks SET lease_owner = 本节点, lease_expires_at = NOW() + INTERVAL 租约时长 SECOND
+    WHERE id = 任务ID AND is_enabled = TRUE AND next_run_at <= NOW()
+      AND (lease_owner IS NULL OR lease_expires_at < NOW())
+
+只有一个节点的更新能成功。租约到期和任务到期都按数据库的 NOW() 判断，各节点的时钟偏差不会让一个节点
+把其他节点仍有效的租约当作已过期；条件中的 next_run_at <= NOW() 保证刚被其他节点执行完、
+已写入下次执行时间的任务不会再次被取得。本节点时钟比数据库快时，本地触发的取得会因未到期而失败，
+任务由之后的巡检（due_tasks）取得执行。执行结束后释放租约并写入下次执行时间，其他节点随后看到任务未到期而不会重复执行。
+执行期间本节点定期为正在执行的任务续约；节点崩溃后租约到期，其他节点巡检时重新取得租约执行。
+释放租约失败时（数据库错误、连接池超时）租约仍记在本节点名下，但不再续约：本节点可以立即重新取得
+（调用方保证任务不在本节点执行中），其他节点在租约到期后取得。
+"""
+import logging
+import os
+import socket
+import uuid
+
+from backend.config import DB_CONFIG, SCHEDULER_CONFIG
+from backend.db_pool import control_pool
+
+
+def default_node_id():
+    """节点标识：主机名 + 进程号 + 随机后缀（同一台机器上的多个进程互不相同）"""
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+
+
+class TaskLeases:
+    """
+    任务租约
+
+    Args:
+        node_id: 本节点标识，默认 SCHEDULER_CONFIG['node_id'] 或 default_node_id()
+        lease_seconds: 租约时长（秒），执行期间按 SCHEDULER_CONFIG['lease_check_interval'] 续约
+    """
+
+    def __init__(self, node_id=None, lease_seconds=None):
+        self.node_id = node_id or SCHEDULER_CONFIG['node_id'] or default_node_id()
+        self.lease_seconds = lease_seconds or SCHEDULER_CONFIG['lease_seconds']
+
+    def _execute(self, sql, params=(), fetch=False):
+        """执行一条语句并提交，fetch 为 True 时返回所有行（字典）"""
+        with control_pool.connection(DB_CONFIG) as connection:
+            cursor = connection.cursor(dictionary=True)
+            try:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall() if fetch else cursor.rowcount
+                connection.commit()
+                return rows
+            finally:
+                cursor.close()
+
+    def claim(self, task_id):
+        """
+        尝试取得到期任务的租约
+
+        本节点名下遗留的租约（释放失败）也可以重新取得，调用方需保证该任务不在本节点执行中。
+
+        Returns:
+            bool: 是否取得租约（任务未到期、已停用或其他节点持有未过期的租约时为 False）
+        """
+        claimed = self._execute(
+            "UPDATE autoreport_tasks SET lease_owner = %s, lease_expires_at = NOW() + INTERVAL %s SECOND "
+            "WHERE id = %s AND is_enabled = TRUE AND next_run_at <= NOW() "
+            "AND (lease_owner IS NULL OR lease_expires_at < NOW() OR lease_owner = %s)",
+            (self.node_id, self.lease_seconds, task_id, self.node_id)
+        )
+        if claimed:
+            logging.info(f"节点 {self.node_id} 取得任务 {task_id} 的租约")
+        return bool(claimed)
+
+    def release(self, task_id, next_run_at):
+        """释放租约并写入下次执行时间（只释放本节点持有的租约）"""
+        self._execute(
+            "UPDATE autoreport_tasks SET lease_owner = NULL, lease_expires_at = NULL, next_run_at = %s "
+            "WHERE id = %s AND lease_owner = %s",
+            (next_run_at, task_id, self.node_id)
+        )
+
+    def abandon(self, task_id):
+        """放弃尚未执行的任务的租约，不改变下次执行时间，其他节点可以立即取得（如调度器停止时取消的排队任务）"""
+        self._execute(
+            "UPDATE autoreport_tasks SET lease_owner = NULL, lease_expires_at = NULL WHERE id = %s AND lease_owner = %s",
+            (task_id, self.node_id)
+        )
+
+    def renew(self, task_ids):
+        """
+        延长本节点正在执行的任务的租约
+
+        只续约 task_ids 中的任务：释放失败而遗留在本节点名下的租约不再延长，到期后其他节点可以接手。
+
+        Returns:
+            int: 续约的任务数量
+        """
+        task_ids = list(task_ids)
+        if not task_ids:
+            return 0
+        placeholders = ', '.join(['%s'] * len(task_ids))
+        return self._execute(
+            f"UPDATE autoreport_tasks SET lease_expires_at = NOW() + INTERVAL %s SECOND "
+            f"WHERE lease_owner = %s AND id IN ({placeholders})",
+            (self.lease_seconds, self.node_id, *task_ids)
+        )
+
+    def due_tasks(self, limit, exclude=()):
+        """
+        已到期且没有有效租约的启用任务，按到期时间排序
+
+        包括崩溃节点遗留的过期租约，以及本节点名下释放失败的租约；exclude 为本节点正在执行的任务ID，不返回。
+        """
+        sql = ("SELECT * FROM autoreport_tasks WHERE is_enabled = TRUE AND next_run_at <= NOW() "
+               "AND (lease_owner IS NULL OR lease_expires_at < NOW() OR lease_owner = %s)")
+        params = [self.node_id]
+        exclude = list(exclude)
+        if exclude:
+            sql += f" AND id NOT IN ({', '.join(['%s'] * len(exclude))})"
+            params.extend(exclude)
+        sql += " ORDER BY next_run_at LIMIT %s"
+        params.append(limit)
+        return self._execute(sql, params, fetch=True)
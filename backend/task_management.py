@@ -3,9 +3,13 @@ from datetime import datetime
 import mysql.connector
 from flask import request, jsonify, send_file, Response, send_from_directory
 import os
+import json
 
 from backend.config import DB_CONFIG
 from backend.task_scheduler import calculate_next_run_at
+from backend.mail_queue import mail_queue
+from backend.recipient_cache import recipient_cache
+from backend.task_runs import task_runs
 
 def register_task_management_routes(app, task_scheduler):
     """
@@ -221,6 +225,7 @@ def register_task_management_routes(app, task_scheduler):
             conn.commit()
             cursor.close()
             conn.close()
+            recipient_cache.invalidate(task_id)
             
             logging.info(f"成功更新任务收件人，任务ID: {task_id}, 收件人数量: {len(recipients)}")
             return jsonify({"message": "收件人更新成功"})
@@ -446,6 +451,7 @@ def register_task_management_routes(app, task_scheduler):
                 
                 # 提交事务
                 connection.commit()
+                recipient_cache.invalidate(task_id)
                 logging.info(f"更新任务 - 影响行数: {cursor.rowcount}")
                 
             except Exception as e:
@@ -460,9 +466,9 @@ def register_task_management_routes(app, task_scheduler):
             cursor.close()
             connection.close()
             
-            # 重新加载任务
-            task_scheduler.load_tasks()
-            logging.info("更新任务 - 任务重新加载成功")
+            # 更新该任务的调度
+            task_scheduler.upsert_task(task_id)
+            logging.info("更新任务 - 任务调度更新成功")
             
             return jsonify({"message": "任务更新成功！"}), 200
             
@@ -496,9 +502,10 @@ def register_task_management_routes(app, task_scheduler):
                 
                 # 提交事务
                 connection.commit()
+                recipient_cache.invalidate(task_id)
                 
-                # 重新加载任务
-                task_scheduler.load_tasks()
+                # 移除该任务的调度
+                task_scheduler.remove_task(task_id)
                 
                 return jsonify({"message": "任务删除成功！"}), 200
                 
@@ -558,13 +565,16 @@ def register_task_management_routes(app, task_scheduler):
                 
                 # 提交事务
                 connection.commit()
+                for task_id in task_ids:
+                    recipient_cache.invalidate(task_id)
                 
                 # 关闭数据库连接
                 cursor.close()
                 connection.close()
                 
-                # 重新加载任务
-                task_scheduler.load_tasks()
+                # 移除这些任务的调度
+                for task_id in task_ids:
+                    task_scheduler.remove_task(task_id)
                 
                 return jsonify({"message": f"成功删除 {len(task_ids)} 个任务！"}), 200
                 
@@ -634,6 +644,48 @@ def register_task_management_routes(app, task_scheduler):
             logging.error(f"获取任务文件列表失败: {str(e)}", exc_info=True)
             return jsonify({'error': f'获取任务文件列表失败: {str(e)}'}), 500
 
+    @app.route('/task_management/mail_queue/<string:task_id>', methods=['GET'])
+    def get_task_mail_queue(task_id):
+        """获取指定任务最近的邮件发送记录及状态"""
+        try:
+            limit = request.args.get('limit', 50, type=int)
+            messages = mail_queue.list_messages(task_id=int(task_id), limit=limit)
+            for message in messages:
+                message['recipients'] = json.loads(message['recipients'])
+                for field in ('next_attempt_at', 'sent_at', 'created_at'):
+                    if message[field]:
+                        message[field] = message[field].strftime('%Y-%m-%d %H:%M:%S')
+            return jsonify(messages), 200
+        except Exception as e:
+            logging.error(f"获取邮件发送记录失败: {str(e)}", exc_info=True)
+            return jsonify({'error': f'获取邮件发送记录失败: {str(e)}'}), 500
+
+    @app.route('/task_management/task_runs/<string:task_id>', methods=['GET'])
+    def get_task_runs(task_id):
+        """获取指定任务最近的运行记录（含各阶段耗时和SQL统计）"""
+        try:
+            limit = request.args.get('limit', 50, type=int)
+            runs = task_runs.recent(int(task_id), limit=limit)
+            for run in runs:
+                for field in ('started_at', 'finished_at', 'created_at'):
+                    if run[field]:
+                        run[field] = run[field].strftime('%Y-%m-%d %H:%M:%S')
+            return jsonify(runs), 200
+        except Exception as e:
+            logging.error(f"获取任务运行记录失败: {str(e)}", exc_info=True)
+            return jsonify({'error': f'获取任务运行记录失败: {str(e)}'}), 500
+
+    @app.route('/task_management/task_runs_stats', methods=['GET'])
+    def get_task_runs_stats():
+        """按任务汇总最近的运行耗时 p50/p95（可选参数 task_id、days，默认 30 天）"""
+        try:
+            task_id = request.args.get('task_id', None, type=int)
+            days = request.args.get('days', 30, type=int)
+            return jsonify(task_runs.stats(task_id=task_id, days=days)), 200
+        except Exception as e:
+            logging.error(f"获取任务运行统计失败: {str(e)}", exc_info=True)
+            return jsonify({'error': f'获取任务运行统计失败: {str(e)}'}), 500
+
     @app.route('/task_management/download_file/<string:task_id>/<path:filename>', methods=['GET'])
     def download_task_file(task_id, filename):
         """下载指定任务的文件"""
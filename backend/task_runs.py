@@ -0,0 +1,130 @@
+"""
+定时任务运行记录
+
+每次执行在 autoreport_task_runs 中写入一行：状态、排队和总耗时、各阶段耗时（毫秒，见 stage_timer.STAGES，
+另有 email 表示准备附件和加入发送队列的耗时），以及每个SQL结果块的数据库、行数、大小和查询耗时。
+stats 按任务汇总耗时的 p50/p95，用于发现变慢的任务、阶段和SQL。
+"""
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from backend.config import DB_CONFIG
+from backend.db_pool import control_pool
+
+
+def percentiles(values):
+    """p50 / p95 / 最大值（毫秒，取整）"""
+    if not values:
+        return {'p50': None, 'p95': None, 'max': None}
+    p50, p95 = np.percentile(values, [50, 95])
+    return {'p50': round(float(p50)), 'p95': round(float(p95)), 'max': round(float(max(values)))}
+
+
+def to_milliseconds(timings):
+    """{阶段: 秒} 转为 {阶段: 毫秒}"""
+    return {name: round(seconds * 1000) for name, seconds in (timings or {}).items()}
+
+
+class TaskRunStore:
+    """autoreport_task_runs 的读写"""
+
+    def _execute(self, sql, params=(), fetch=False):
+        """执行一条语句并提交，fetch 为 True 时返回所有行（字典）"""
+        with control_pool.connection(DB_CONFIG) as connection:
+            cursor = connection.cursor(dictionary=True)
+            try:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall() if fetch else cursor.rowcount
+                connection.commit()
+                return rows
+            finally:
+                cursor.close()
+
+    def record(self, task_id, started_at, finished_at, status, queue_ms=None, stages=None, queries=None,
+               error=None, node=None):
+        """
+        写入一条运行记录，失败只记录日志（不影响任务本身）
+
+        Args:
+            stages: {阶段: 毫秒}
+            queries: [{'sheet', 'index', 'db', 'rows', 'bytes', 'ms', 'cached'}]
+        """
+        try:
+            self._execute(
+                "INSERT INTO autoreport_task_runs "
+                "(task_id, node, status, started_at, finished_at, duration_ms, queue_ms, stage_timings, query_stats, error) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                (task_id, node, status, started_at, finished_at,
+                 round((finished_at - started_at).total_seconds() * 1000), queue_ms,
+                 json.dumps(stages or {}, ensure_ascii=False), json.dumps(queries or [], ensure_ascii=False),
+                 error)
+            )
+        except Exception as e:
+            logging.error(f"写入任务 {task_id} 的运行记录失败: {e}")
+
+    def recent(self, task_id, limit=50):
+        """任务最近的运行记录，按开始时间倒序"""
+        rows = self._execute(
+            "SELECT * FROM autoreport_task_runs WHERE task_id = %s ORDER BY started_at DESC LIMIT %s",
+            (task_id, limit), fetch=True
+        )
+        for row in rows:
+            row['stage_timings'] = json.loads(row['stage_timings']) if row['stage_timings'] else {}
+            row['query_stats'] = json.loads(row['query_stats']) if row['query_stats'] else []
+        return rows
+
+    def stats(self, task_id=None, days=30):
+        """
+        按任务汇总最近 days 天的运行耗时
+
+        Returns:
+            list: 每个任务一项，包含运行/失败次数、总耗时、各阶段和各SQL（工作表#序号）的 p50/p95，按总耗时 p95 倒序
+        """
+        sql = ("SELECT task_id, status, duration_ms, stage_timings, query_stats FROM autoreport_task_runs "
+               "WHERE started_at >= %s")
+        params = [datetime.now() - timedelta(days=days)]
+        if task_id is not None:
+            sql += " AND task_id = %s"
+            params.append(task_id)
+        rows = self._execute(sql, params, fetch=True)
+
+        tasks = defaultdict(lambda: {'runs': 0, 'failures': 0, 'durations': [],
+                                     'stages': defaultdict(list), 'queries': defaultdict(list), 'query_db': {}})
+        for row in rows:
+            item = tasks[row['task_id']]
+            item['runs'] += 1
+            if row['status'] != 'success':
+                item['failures'] += 1
+                continue
+            item['durations'].append(row['duration_ms'])
+            for name, ms in json.loads(row['stage_timings'] or '{}').items():
+                item['stages'][name].append(ms)
+            for query in json.loads(row['query_stats'] or '[]'):
+                if query.get('cached'):
+                    continue
+                name = f"{query['sheet']}#{query['index']}"
+                item['queries'][name].append(query['ms'])
+                item['query_db'][name] = query.get('db')
+
+        result = []
+        for key, item in tasks.items():
+            result.append({
+                'task_id': key,
+                'runs': item['runs'],
+                'failures': item['failures'],
+                'duration': percentiles(item['durations']),
+                'stages': {name: percentiles(values) for name, values in item['stages'].items()},
+                'queries': [dict(name=name, db=item['query_db'][name], **percentiles(values))
+                            for name, values in item['queries'].items()],
+            })
+            result[-1]['queries'].sort(key=lambda query: query['p95'], reverse=True)
+        result.sort(key=lambda item: item['duration']['p95'] or 0, reverse=True)
+        return result
+
+
+# 进程内共享的运行记录存储
+task_runs = TaskRunStore()
@@ -1,25 +1,33 @@
-import schedule
+import heapq
+import itertools
+import socket
 import time
 import threading
 import json
 import os
 import sys  # 导入 sys 模块
 import pandas as pd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 # import mysql.connector # 不需要直接导入
 from datetime import datetime, timedelta
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from .report_generator_v2 import generate_report
 import logging
-from backend.config import DB_CONFIG
+from backend.config import DB_CONFIG, SCHEDULER_CONFIG
 from backend.tools.excel_utils import check_excel_file
 from backend.config.mail_config import MAIL_CONFIG
 from backend.email_sender import EmailSender
+from backend.mail_queue import mail_queue
+from backend.mail_attachments import prepare_attachments
+from backend.recipient_cache import recipient_cache
+from backend.task_lease import TaskLeases
+from backend.task_runs import task_runs, to_milliseconds
+from backend.stage_timer import StageTimer
+from backend.metrics import REPORT_GENERATION_SECONDS, SCHEDULER_LAG_SECONDS
 from backend.utils import connect_db, execute_query  # 导入数据库连接函数
-from email.mime.base import MIMEBase
-from email import encoders
 from email.header import Header
-import urllib.parse
 
 # 配置日志
 log_dir = 'logs'
@@ -117,12 +125,36 @@ def check_task_name_api():
     except Exception as e:
         return jsonify({"message": f"An error occurred: {str(e)}"}), 500
 
+# 决定执行时间的任务字段，修改其他字段不需要重新计算调度
+SCHEDULE_FIELDS = ('frequency', 'dayOfMonth', 'dayOfWeek', 'time')
+
+
 class TaskScheduler:
+    """
+    定时任务调度器
+
+    每个启用的任务在最小堆中保留一个 (下次执行时间, 序号, 任务ID) 条目，调度线程只睡眠到堆顶任务到期，
+    任务变化时通过条件变量唤醒。下次执行时间统一由 calculate_next_run_at 计算，每次执行后按当前时间重新计算，
+    不会累积误差；空闲时不占用 CPU，与任务数量无关。
+    """
+
     def __init__(self):
-        self.scheduler = schedule.Scheduler()
         self.stop_event = threading.Event()  # 用于停止调度线程的事件
         self.connection = None  # 初始化为 None
-        self.tasks = []
+        # 调度状态：堆中被替换或删除的条目不立即移除，出堆时按序号与 _jobs 比对后丢弃
+        self._condition = threading.Condition()
+        self._heap = []  # [(下次执行时间, 序号, 任务ID)]
+        self._jobs = {}  # {任务ID（字符串）: (下次执行时间, 序号, 任务信息)}
+        self._sequence = itertools.count()
+        # 到期任务提交到工作线程池执行，同一任务不会重叠执行
+        self.max_workers = SCHEDULER_CONFIG['workers']
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='report-task')
+        self._active_lock = threading.Lock()
+        self._active_tasks = set()  # 正在排队或执行的任务ID
+        self._queued = 0  # 已提交但尚未开始执行的任务数
+        self.run_metrics = deque(maxlen=SCHEDULER_CONFIG['metrics_size'])  # 最近的运行指标
+        # 多节点模式：到期任务需先在数据库中取得租约
+        self.leases = TaskLeases() if SCHEDULER_CONFIG['mode'] == 'distributed' else None
 
     def get_tasks(self):
         """获取所有任务"""
@@ -142,7 +174,7 @@ class TaskScheduler:
                 cursor.close()
 
     def load_tasks(self):
-        """从数据库加载任务"""
+        """从数据库加载所有启用的任务，替换当前的全部调度"""
         cursor = None
         try:
             if self.connection is None or not self.connection.is_connected():
@@ -151,176 +183,286 @@ class TaskScheduler:
             # 修改SQL查询，只加载启用的任务
             cursor.execute("SELECT * FROM autoreport_tasks WHERE is_enabled = TRUE")
             tasks = cursor.fetchall()
+            with self._condition:
+                self._jobs.clear()
+                self._heap.clear()
             for task in tasks:
                 try:
                     # Convert dayOfWeek to string
                     if task['dayOfWeek'] is not None:
                         task['dayOfWeek'] = str(task['dayOfWeek'])
-                    self.tasks.append(task)
                     self.schedule_task(task)  # 重新安排已加载的任务
                 except Exception as e:
                     logging.error(f"加载任务 {task} 失败: {e}", exc_info=True)
-            logging.info(f"已加载任务: {len(self.tasks)}")
+            logging.info(f"已加载任务: {len(self._jobs)}")
 
         except Exception as e:
             logging.error(f"加载任务失败: {e}", exc_info=True)
-            self.tasks = []
         finally:
             if cursor:
                 cursor.close()
 
+    def _fetch_task(self, task_id):
+        """从数据库读取一个任务，不存在时返回 None"""
+        cursor = None
+        try:
+            if self.connection is None or not self.connection.is_connected():
+                self.connection = connect_db()
+            cursor = self.connection.cursor(dictionary=True)
+            cursor.execute("SELECT * FROM autoreport_tasks WHERE id = %s", (task_id,))
+            return cursor.fetchone()
+        finally:
+            if cursor:
+                cursor.close()
+
+    def upsert_task(self, task_id):
+        """
+        任务新增或修改后更新其调度，只影响这一个任务
 
-    def schedule_task(self, task_info):
-        """根据任务信息安排定时任务"""
+        任务不存在或已停用时移除调度；执行时间相关字段（frequency / dayOfMonth / dayOfWeek / time）
+        未变化时保留原来的下次执行时间，只更新任务信息。
+        """
         try:
-            logging.info(f"Scheduling task with time: {task_info['time']}")
-            
-            frequency = task_info['frequency']
-            day_of_month = task_info['dayOfMonth']
-            day_of_week = task_info['dayOfWeek']
-            
-            # 将数字形式的星期几转换为英文名称 (1-7 对应 周一-周日)
-            weekday_mapping = {
-                '1': 'monday',
-                '2': 'tuesday',
-                '3': 'wednesday',
-                '4': 'thursday',
-                '5': 'friday',
-                '6': 'saturday',
-                '7': 'sunday'
-            }
-            
-            # 根据频率安排任务
-            if frequency == 'day':
-                job = self.scheduler.every().day.at(task_info['time'])
-            elif frequency == 'week' and day_of_week:
-                # 将数字转换为英文星期几名称
-                if day_of_week in weekday_mapping:
-                    day_of_week_name = weekday_mapping[day_of_week]
-                    # 先计算今天的目标时间
-                    target_time = datetime.strptime(task_info['time'], '%H:%M').time()
-                    target_datetime = datetime.combine(datetime.now().date(), target_time)
-                    
-                    # 如果是目标星期几，且目标时间还没到，就用今天的时间
-                    if datetime.now().weekday() == int(day_of_week) - 1 and target_datetime > datetime.now():
-                        next_run_at = target_datetime
-                    else:
-                        # 否则计算到下一个目标星期几的天数
-                        days_ahead = (int(day_of_week) - 1) - datetime.now().weekday()
-                        if days_ahead <= 0:  # 如果已经过了本周的目标日期
-                            days_ahead += 7
-                        next_run_at = datetime.combine((datetime.now() + timedelta(days=days_ahead)).date(), target_time)
-                    
-                    logging.info(f"周任务 {task_info['taskName']} 的下次执行时间: {next_run_at}")
-                    
-                    # 使用 schedule 的 every().seconds.do() 来调度
-                    time_diff = (next_run_at - datetime.now()).total_seconds()
-                    job = self.scheduler.every(int(time_diff)).seconds
-                    
-                    def weekly_job_wrapper():
-                        try:
-                            # 执行任务
-                            self.run_task(task_info)
-                        finally:
-                            # 计算下次执行时间
-                            next_run_at = calculate_next_run_at(task_info['frequency'], task_info['dayOfMonth'], task_info['dayOfWeek'], task_info['time'])
-                            # 创建新的调度（使用新的时间）
-                            new_time_diff = (next_run_at - datetime.now()).total_seconds()
-                            new_job = self.scheduler.every(int(new_time_diff)).seconds
-                            new_job.do(weekly_job_wrapper)
-                            logging.info(f"周任务 {task_info['taskName']} 重新调度到 {next_run_at}")
-                            # 取消当前的一次性任务
-                            return schedule.CancelJob
-                    
-                    # 直接设置任务回调
-                    job.do(weekly_job_wrapper)
-                    
-                    logging.info(f"周任务 {task_info['taskName']} 已调度到 {next_run_at}")
-                    return job
-            elif frequency == 'month' and day_of_month:
-                # 月度任务处理逻辑
-                try:
-                    day_of_month = int(day_of_month)
-                    logging.info(f"月份日期: {day_of_month}")
-                    
-                    # 先计算今天的目标时间
-                    target_time = datetime.strptime(task_info['time'], '%H:%M').time()
-                    target_datetime = datetime.combine(datetime.now().date(), target_time)
-                    
-                    # 如果是目标日期当天，且目标时间还没到，就用今天的时间
-                    if datetime.now().day == day_of_month and target_datetime > datetime.now():
-                        next_run_at = target_datetime
-                    else:
-                        # 否则计算下个月的执行时间
-                        if datetime.now().day > day_of_month or (datetime.now().day == day_of_month and target_datetime <= datetime.now()):
-                            # 如果今天的日期已经过了目标日期，或者是目标日期但时间已过，调度到下个月
-                            month = datetime.now().month + 1
-                            year = datetime.now().year
-                            if month > 12:
-                                month = 1
-                                year += 1
-                        else:
-                            # 如果今天的日期还没到目标日期，调度到本月
-                            month = datetime.now().month
-                            year = datetime.now().year
-                        
-                        next_run_at = datetime(year, month, day_of_month, int(task_info['time'][:2]), int(task_info['time'][3:]))
-                    
-                    logging.info(f"计算得到的下次执行时间: {next_run_at}")
-                    
-                    # 使用 schedule 的 every().seconds.do() 来调度
-                    time_diff = (next_run_at - datetime.now()).total_seconds()
-                    job = self.scheduler.every(int(time_diff)).seconds
-                    
-                    def monthly_job_wrapper():
-                        try:
-                            # 执行任务
-                            self.run_task(task_info)
-                        finally:
-                            # 计算下次执行时间
-                            next_run_at = calculate_next_run_at(task_info['frequency'], task_info['dayOfMonth'], task_info['dayOfWeek'], task_info['time'])
-                            # 创建新的调度（使用新的时间）
-                            new_time_diff = (next_run_at - datetime.now()).total_seconds()
-                            new_job = self.scheduler.every(int(new_time_diff)).seconds
-                            new_job.do(monthly_job_wrapper)
-                            logging.info(f"月度任务 {task_info['taskName']} 重新调度到 {next_run_at}")
-                            # 取消当前的一次性任务
-                            return schedule.CancelJob
-                    
-                    # 直接设置任务回调
-                    job.do(monthly_job_wrapper)
-                    
-                    logging.info(f"月度任务 {task_info['taskName']} 已调度到 {next_run_at}")
-                    return job
-                except ValueError:
-                    logging.error(f"无效的月份日期格式: {day_of_month}")
-                    return None
-            else:
-                logging.error(f"无效的频率设置: {frequency}")
-                return None
-            
-            # 只为非月度任务设置任务回调
-            if frequency != 'month':
-                job.do(self.run_task, task_info)
-            
-            return job
+            task = self._fetch_task(task_id)
+        except Exception as e:
+            logging.error(f"读取任务 {task_id} 失败: {e}", exc_info=True)
+            return
+        if not task or not task.get('is_enabled'):
+            self.remove_task(task_id)
+            return
+        if task['dayOfWeek'] is not None:
+            task['dayOfWeek'] = str(task['dayOfWeek'])
+
+        with self._condition:
+            job = self._jobs.get(str(task_id))
+            if job is not None and all(job[2].get(field) == task.get(field) for field in SCHEDULE_FIELDS):
+                self._jobs[str(task_id)] = (job[0], job[1], task)
+                logging.info(f"任务 {task['taskName']} 执行时间未变化，保留调度: {job[0]}")
+                return
+        self.schedule_task(task)
+
+    def remove_task(self, task_id):
+        """移除任务的调度，正在执行的本次运行不受影响"""
+        with self._condition:
+            job = self._jobs.pop(str(task_id), None)
+            self._compact()
+            self._condition.notify()
+        if job is not None:
+            logging.info(f"任务 {job[2]['taskName']} 已移除调度")
+
+    def schedule_task(self, task_info):
+        """
+        按任务信息计算下次执行时间并加入调度（替换该任务已有的调度）
 
+        Returns:
+            datetime: 下次执行时间，频率设置无效时为 None
+        """
+        try:
+            next_run_at = calculate_next_run_at(task_info['frequency'], task_info['dayOfMonth'],
+                                                task_info['dayOfWeek'], task_info['time'])
         except Exception as e:
             logging.error(f"安排任务失败: {e}")
+            next_run_at = None
+        if next_run_at is None:
+            logging.error(f"无效的频率设置: {task_info.get('frequency')}，任务 {task_info.get('taskName')} 未调度")
             return None
 
-    def run_task(self, task_info):
-        """运行任务"""
+        with self._condition:
+            self._push(task_info, next_run_at)
+            self._condition.notify()
+        logging.info(f"任务 {task_info['taskName']} 已调度到 {next_run_at}")
+        return next_run_at
+
+    def _push(self, task_info, next_run_at):
+        """加入堆（调用方持有 _condition）"""
+        sequence = next(self._sequence)
+        task_id = str(task_info['id'])
+        self._jobs[task_id] = (next_run_at, sequence, task_info)
+        heapq.heappush(self._heap, (next_run_at, sequence, task_id))
+        self._compact()
+
+    def _compact(self):
+        """堆中已失效的条目超过有效条目时重建堆，频繁修改任务时堆大小保持与任务数量同级"""
+        if len(self._heap) > 2 * len(self._jobs) + 16:
+            self._heap = [(next_run_at, sequence, task_id) for task_id, (next_run_at, sequence, _) in self._jobs.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_due(self):
+        """
+        等待并取出下一个到期的任务，同时安排其下次执行（调用方持有 _condition）
+
+        Returns:
+            dict: 到期的任务信息，调度器停止时为 None
+        """
+        while not self.stop_event.is_set():
+            # 丢弃已被替换或删除的条目
+            while self._heap and self._jobs.get(self._heap[0][2], (None, None))[1] != self._heap[0][1]:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                self._condition.wait()
+                continue
+
+            next_run_at, _, task_id = self._heap[0]
+            delay = (next_run_at - datetime.now()).total_seconds()
+            if delay > 0:
+                self._condition.wait(min(delay, threading.TIMEOUT_MAX))
+                continue
+
+            heapq.heappop(self._heap)
+            task_info = self._jobs.pop(task_id)[2]
+            SCHEDULER_LAG_SECONDS.observe(-delay)
+            try:
+                following = calculate_next_run_at(task_info['frequency'], task_info['dayOfMonth'],
+                                                  task_info['dayOfWeek'], task_info['time'])
+            except Exception as e:
+                logging.error(f"计算任务 {task_info['taskName']} 的下次执行时间失败: {e}")
+                following = None
+            if following is not None:
+                self._push(task_info, following)
+                logging.info(f"任务 {task_info['taskName']} 下次执行时间: {following}")
+            return task_info
+        return None
+
+    def get_jobs(self):
+        """当前调度中的任务及下次执行时间，按执行时间排序"""
+        with self._condition:
+            jobs = [(next_run_at, task_id) for task_id, (next_run_at, _, _) in self._jobs.items()]
+        return [{'task_id': task_id, 'next_run_at': next_run_at} for next_run_at, task_id in sorted(jobs)]
+
+    def dispatch(self, task_info):
+        """将到期任务提交到工作线程池执行，同一任务正在排队或执行时跳过本次触发"""
+        task_id = task_info['id']
+        with self._active_lock:
+            if task_id in self._active_tasks:
+                logging.warning(f"任务 {task_info['taskName']} 上一次执行尚未结束，跳过本次触发")
+                return
+            self._active_tasks.add(task_id)
+        # 多节点模式下先取得租约，未取得说明其他节点正在执行、已执行或任务尚未到期
+        if self.leases is not None and not self._claim(task_info):
+            with self._active_lock:
+                self._active_tasks.discard(task_id)
+            return
+        with self._active_lock:
+            self._queued += 1
+            queue_depth = self._queued
+        enqueued_at = time.monotonic()
+        logging.info(f"任务 {task_info['taskName']} 已提交到工作线程池，当前队列深度: {queue_depth}")
+        future = self.executor.submit(self._run_dispatched, task_info, enqueued_at, queue_depth)
+        future.add_done_callback(lambda done: self._cancelled(task_info) if done.cancelled() else None)
+
+    def _cancelled(self, task_info):
+        """停止调度器时取消的排队任务没有执行 _run_dispatched：移出排队和执行中的任务，并放弃租约"""
+        with self._active_lock:
+            self._queued -= 1
+            self._active_tasks.discard(task_info['id'])
+        if self.leases is not None:
+            try:
+                self.leases.abandon(task_info['id'])
+            except Exception as e:
+                logging.error(f"放弃任务 {task_info['taskName']} 的租约失败: {e}")
+        logging.info(f"任务 {task_info['taskName']} 尚未开始执行，已取消")
+
+    def _claim(self, task_info):
+        try:
+            return self.leases.claim(task_info['id'])
+        except Exception as e:
+            logging.error(f"取得任务 {task_info['taskName']} 的租约失败: {e}")
+            return False
+
+    def _release(self, task_info):
+        """释放租约并写入下次执行时间，其他节点据此判断任务是否到期"""
+        try:
+            next_run_at = calculate_next_run_at(task_info['frequency'], task_info['dayOfMonth'],
+                                                task_info['dayOfWeek'], task_info['time'])
+            self.leases.release(task_info['id'], next_run_at)
+        except Exception as e:
+            logging.error(f"释放任务 {task_info['taskName']} 的租约失败: {e}")
+
+    def _lease_loop(self):
+        """多节点模式：定期续约正在执行的任务，并接手已到期但没有节点执行的任务（如持有租约的节点已崩溃）"""
+        while not self.stop_event.wait(SCHEDULER_CONFIG['lease_check_interval']):
+            try:
+                with self._active_lock:
+                    active = list(self._active_tasks)
+                self.leases.renew(active)
+                free = self.max_workers - len(active)
+                if free <= 0:
+                    continue
+                for task in self.leases.due_tasks(free, exclude=active):
+                    if task['dayOfWeek'] is not None:
+                        task['dayOfWeek'] = str(task['dayOfWeek'])
+                    logging.info(f"巡检发现到期任务 {task['taskName']}（计划执行时间 {task['next_run_at']}）")
+                    self.dispatch(task)
+            except Exception as e:
+                logging.error(f"任务租约巡检失败: {e}")
+
+    def _run_dispatched(self, task_info, enqueued_at, queue_depth):
+        """工作线程中执行任务，并记录排队和执行耗时"""
+        task_id = task_info['id']
+        started_at = time.monotonic()
+        started_wall = datetime.now()
+        run = {}
+        with self._active_lock:
+            self._queued -= 1
+        try:
+            self.run_task(task_info, run)
+        finally:
+            finished_at = time.monotonic()
+            REPORT_GENERATION_SECONDS.observe(finished_at - started_at, source='scheduled',
+                                              status=run.get('status', 'failure'))
+            task_runs.record(
+                task_id, started_wall, datetime.now(), run.get('status', 'failure'),
+                queue_ms=round((started_at - enqueued_at) * 1000), stages=run.get('stages'),
+                queries=run.get('queries'), error=run.get('error'),
+                node=self.leases.node_id if self.leases is not None else socket.gethostname()
+            )
+            metric = {
+                'task_id': task_id,
+                'task_name': task_info['taskName'],
+                'queue_depth': queue_depth,
+                'queue_latency': round(started_at - enqueued_at, 3),
+                'duration': round(finished_at - started_at, 3),
+                'finished_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            }
+            if self.leases is not None:
+                self._release(task_info)
+            with self._active_lock:
+                self._active_tasks.discard(task_id)
+                self.run_metrics.append(metric)
+            logging.info(f"任务 {task_info['taskName']} 运行指标: 队列深度 {queue_depth}, "
+                         f"排队 {metric['queue_latency']}s, 执行 {metric['duration']}s")
+
+    def get_metrics(self):
+        """获取调度器当前状态和最近的运行指标"""
+        with self._active_lock:
+            return {
+                'workers': self.max_workers,
+                'queue_depth': self._queued,
+                'running': len(self._active_tasks) - self._queued,
+                'recent_runs': list(self.run_metrics)
+            }
+
+    def run_task(self, task_info, run=None):
+        """
+        运行任务
+
+        Args:
+            run: 传入字典时写入本次运行的状态（status / error）、各阶段耗时（stages，毫秒）和SQL统计（queries）
+        """
+        run = run if run is not None else {}
+        # 每次运行使用独立的数据库连接，多个任务可以在工作线程中并发执行
+        connection = None
+        cursor = None
+        task = None
         try:
             logging.info(f"开始执行任务: {task_info['taskName']}")
 
             # 1. 参数准备
             task_id = task_info['id']
-            cursor = None
+            timer = StageTimer()  # 各阶段耗时，传给 generate_report 继续计时
             try:
-                if self.connection is None or not self.connection.is_connected():
-                    self.connection = connect_db()
-                cursor = self.connection.cursor(dictionary=True)
+                connection = connect_db()
+                cursor = connection.cursor(dictionary=True)
 
                 # 查询 autoreport_tasks 表
                 cursor.execute("SELECT * FROM autoreport_tasks WHERE id = %s", (task_id,))
@@ -350,9 +492,10 @@ class TaskScheduler:
                 task_info['settings'] = settings
                 logging.info(f"任务 {task_name} 的 settings: {settings}")  # 添加日志
 
-                # 查询 autoreport_templates 表
-                cursor.execute("SELECT * FROM autoreport_templates WHERE task_id = %s ORDER BY sql_order", (task_id,))
-                templates = cursor.fetchall()
+                # 查询 autoreport_templates 表（与手动生成读取模板文件一样计入 load_template 阶段）
+                with timer.stage('load_template'):
+                    cursor.execute("SELECT * FROM autoreport_templates WHERE task_id = %s ORDER BY sql_order", (task_id,))
+                    templates = cursor.fetchall()
                 if not templates:
                     raise Exception(f"任务 ID: {task_id} 没有找到对应的 SQL 模板")
 
@@ -419,7 +562,12 @@ class TaskScheduler:
             os.makedirs(output_dir, exist_ok=True)
             
             # 调用 generate_report 函数，指定输出目录
-            output_path = generate_report(task, task_info, data_frame=sheets_data, variables_filename=None, output_dir=output_dir)
+            # settings 中 profile 为 true 时开启性能剖析，结果写在报表旁
+            output_path = generate_report(task, task_info, data_frame=sheets_data, variables_filename=None, output_dir=output_dir,
+                                          profile=settings.get('profile'), timer=timer)
+            run['stages'] = to_milliseconds(getattr(task, 'stage_timings', None))
+            run['queries'] = getattr(task, 'query_stats', [])
+            run['status'] = 'success'
 
             if output_path is None:
                 logging.error(f"任务 {task_info['taskName']} 执行完成，但报表路径为空")
@@ -438,36 +586,17 @@ class TaskScheduler:
             update_sql = "UPDATE autoreport_tasks SET last_run_at = %s, last_run_status = %s, last_run_log = %s, next_run_at = %s WHERE id = %s"
             update_values = (now, 'success', '', next_run_at, task_info['id'])
             try:
-                cursor = self.connection.cursor()
+                cursor = connection.cursor()
                 cursor.execute(update_sql, update_values)
-                self.connection.commit()
+                connection.commit()
                 logging.info(f"任务 {task_info['taskName']} 数据库更新成功")
                 
                 # 如果成功生成报表，发送邮件
+                email_started = time.perf_counter()
                 if output_path:
                     try:
-                        # 获取任务的收件人邮箱列表
-                        cursor.execute("""
-                            WITH task_emails AS (
-                                -- 直接关联的邮箱
-                                SELECT e.email
-                                FROM autoreport_emails e
-                                JOIN autoreport_task_recipients tr ON e.id = tr.email_id
-                                WHERE tr.task_id = %s
-                                
-                                UNION
-                                
-                                -- 通过邮箱组关联的邮箱
-                                SELECT e.email
-                                FROM autoreport_emails e
-                                JOIN autoreport_email_group_members egm ON e.id = egm.email_id
-                                JOIN autoreport_task_recipients tr ON egm.group_id = tr.group_id
-                                WHERE tr.task_id = %s
-                            )
-                            SELECT email FROM task_emails ORDER BY email
-                        """, (task_id, task_id))
-                        
-                        recipients = [row[0] for row in cursor.fetchall()]
+                        # 获取任务的收件人邮箱列表（按任务缓存，收件人修改时清除）
+                        recipients = recipient_cache.get(task_id, cursor)
                         
                         if recipients:
                             # 获取Excel文件名（不包含路径和扩展名）
@@ -479,37 +608,29 @@ class TaskScheduler:
                             subject = f"【{game_type}】{excel_name_without_ext}"
                             body = f"Dear all,\n\n请查收 {subject}。"
 
-                            # 发送邮件
-                            sender = EmailSender()
+                            # 大附件压缩，超过大小上限的改为在正文中附下载链接
+                            attachments, links = prepare_attachments([output_path], task_id)
+                            if links:
+                                body += "\n\n报表文件较大，请通过以下链接下载：\n" + "\n".join(links)
+
+                            # 加入邮件发送队列，由后台线程发送，任务到此结束
                             logging.info(f"任务 {task_info['taskName']} 的 output_path: {output_path}")
                             try:
-                                with open(output_path, 'rb') as attachment:
-                                    part = MIMEBase('application', 'octet-stream')
-                                    part.set_payload(attachment.read())
-                                encoders.encode_base64(part)
-                                
-                                # 修改这里，使用更简单的方式处理中文文件名
-                                filename = os.path.basename(output_path)
-                                # 直接使用RFC 5987编码方式，不使用Header类
-                                encoded_filename = urllib.parse.quote(filename)
-                                part.add_header(
-                                    'Content-Disposition',
-                                    f'attachment; filename*=UTF-8\'\'{encoded_filename}'
-                                )
-                                
-                                sender.send_email(
+                                message_id = mail_queue.enqueue(
                                     subject=subject,
                                     recipients=recipients,
                                     body=body,
-                                    attachments=[part]  # 这里传入的是MIMEBase对象
+                                    attachments=attachments,
+                                    task_id=task_id
                                 )
-                                logging.info(f"任务 {task_info['taskName']} 邮件发送成功，收件人: {', '.join(recipients)}")
+                                logging.info(f"任务 {task_info['taskName']} 邮件已加入发送队列: id={message_id}，收件人: {', '.join(recipients)}")
                             except Exception as e:
-                                logging.error(f"任务 {task_info['taskName']} 邮件发送失败: {e}")
+                                logging.error(f"任务 {task_info['taskName']} 邮件加入发送队列失败: {e}")
                         else:
                             logging.info(f"任务 {task_info['taskName']} 没有配置收件人，跳过邮件发送")
                     except Exception as e:
                         logging.error(f"任务 {task_info['taskName']} 邮件发送失败: {e}") # 这行重复了，删除
+                run['stages']['email'] = round((time.perf_counter() - email_started) * 1000)
             except Exception as e:
                 logging.error(f"任务 {task_info['taskName']} 数据库更新失败: {e}")
             finally:
@@ -518,33 +639,54 @@ class TaskScheduler:
 
         except Exception as e:
             logging.error(f"任务 {task_info['taskName']} 执行失败: {e}")
+            run['status'] = 'failure'
+            run['error'] = str(e)
+            if task is not None:
+                run['stages'] = to_milliseconds(getattr(task, 'stage_timings', None))
+                run['queries'] = getattr(task, 'query_stats', [])
             # 更新数据库
             now = datetime.now()
             next_run_at = calculate_next_run_at(task_info['frequency'], task_info['dayOfMonth'], task_info['dayOfWeek'], task_info['time'])
             update_sql = "UPDATE autoreport_tasks SET last_run_at = %s, last_run_status = %s, last_run_log = %s, next_run_at = %s WHERE id = %s"
             update_values = (now, 'failure', str(e), next_run_at, task_info['id'])
             try:
-                cursor = self.connection.cursor()
+                if connection is None or not connection.is_connected():
+                    connection = connect_db()
+                cursor = connection.cursor()
                 cursor.execute(update_sql, update_values)
-                self.connection.commit()
+                connection.commit()
                 logging.info(f"任务 {task_info['taskName']} 数据库更新失败: {e}")
             except Exception as e:
                 logging.error(f"任务 {task_info['taskName']} 数据库更新失败: {e}")
             finally:
                 if cursor:
                     cursor.close()
+        finally:
+            if connection and connection.is_connected():
+                connection.close()
 
     def start(self):
-        """启动调度器"""
+        """启动调度器，在当前线程中等待并提交到期任务"""
         self.load_tasks()  # 启动时加载任务
+        mail_queue.start()
+        if self.leases is not None:
+            threading.Thread(target=self._lease_loop, name='task-lease', daemon=True).start()
+            logging.info(f"定时任务调度器以多节点模式启动，节点: {self.leases.node_id}")
         logging.info("定时任务调度器已启动")
-        while not self.stop_event.is_set():
-            self.scheduler.run_pending()
-            time.sleep(1)
+        while True:
+            with self._condition:
+                task_info = self._pop_due()
+            if task_info is None:
+                break
+            self.dispatch(task_info)
 
     def stop(self):
-        """停止调度器"""
-        self.stop_event.set()
+        """停止调度器，排队中的任务取消（见 _cancelled），正在执行的任务继续完成"""
+        with self._condition:
+            self.stop_event.set()
+            self._condition.notify_all()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        mail_queue.stop()
         self.close_connection()
         logging.info("定时任务调度器已停止")
 
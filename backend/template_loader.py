@@ -0,0 +1,185 @@
+"""
+Excel 报表模板加载
+
+模板文件只解析一次：所有工作表一次读入，解析为 ExcelTemplate（工作表、SQL 行、setting 配置），
+并按文件内容的哈希缓存。上传校验、创建任务和生成报表共用同一份解析结果。
+"""
+import hashlib
+import io
+import logging
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from backend.config import REPORT_CONFIG
+
+
+class TemplateError(ValueError):
+    """模板内容不符合要求"""
+
+
+class ExcelTemplate:
+    """
+    解析后的 Excel 模板
+
+    Attributes:
+        content_hash: 文件内容的 SHA-256
+        sheet_names: 全部工作表名称（按文件中的顺序，包含 setting 工作表）
+        setting_sheet: setting 工作表名称，没有时为 None
+        freeze: 冻结配置 {工作表名称: 配置}
+        cache_ttl: 查询结果缓存有效期（秒），模板未设置时为 None
+        incremental: 增量模式配置 {'column': 水位列, 'initial': 初始水位}，模板未启用时为 None
+    """
+
+    def __init__(self, content_hash, sheets):
+        self.content_hash = content_hash
+        self._sheets = sheets
+        self.sheet_names = list(sheets.keys())
+
+        # 查找setting工作表
+        self.setting_sheet = None
+        for sheet_name in self.sheet_names:
+            if '{setting}' in sheet_name.lower():
+                self.setting_sheet = sheet_name
+                break
+
+        self.freeze = OrderedDict()
+        self.cache_ttl = None
+        self.incremental = None
+        if self.setting_sheet:
+            self._parse_settings(sheets[self.setting_sheet])
+
+    def _parse_settings(self, setting_df):
+        """解析 setting 工作表（fun / title / config 三列，不区分大小写）"""
+        try:
+            setting_df = setting_df.copy()
+            setting_df.columns = setting_df.columns.str.lower()
+
+            # 检查必要的列是否存在
+            required_columns = ['fun', 'title', 'config']
+            if not all(col in setting_df.columns for col in required_columns):
+                return
+
+            for index, row in setting_df.iterrows():
+                fun = str(row['fun']).strip()
+                title = str(row['title']).strip()
+                config = str(row['config']).strip() if pd.notna(row['config']) else ''
+
+                if fun == '冻结' and title:
+                    self.freeze[title] = config
+                elif fun == '缓存' and config:
+                    # 单行配置无效时只跳过该行，继续解析后面的设置
+                    try:
+                        self.cache_ttl = int(float(config))
+                    except ValueError:
+                        logging.warning(f'setting工作表第 {index + 2} 行的缓存时间无效，已忽略: {config}')
+                elif fun == '增量' and title:
+                    self.incremental = {'column': title, 'initial': config or None}
+        except Exception as e:
+            logging.warning(f'处理setting工作表时出错: {e}')
+
+    @property
+    def data_sheet_names(self):
+        """除 setting 工作表以外的工作表名称"""
+        return [name for name in self.sheet_names if name != self.setting_sheet]
+
+    def sheet(self, sheet_name):
+        """获取工作表数据（副本，调用方可以修改）"""
+        return self._sheets[sheet_name].copy()
+
+    @property
+    def settings(self):
+        """保存到任务 settings 字段的配置"""
+        settings = {}
+        if self.freeze:
+            settings['freeze'] = [{'title': title, 'config': config} for title, config in self.freeze.items()]
+        if self.cache_ttl is not None:
+            settings['cache_ttl'] = self.cache_ttl
+        if self.incremental is not None:
+            settings['incremental'] = dict(self.incremental)
+        return settings
+
+    def sql_rows(self):
+        """
+        所有工作表的 SQL 行，列名不区分大小写
+
+        Returns:
+            list[dict]: 每行包含 db_name, output_sql, sql_order, sheet_name, sheet_order，
+                        以及非空的 sql1..sqlN, format, pos, transpose(Y/N)
+
+        Raises:
+            TemplateError: 工作表缺少 db_name 或 output_sql 字段
+        """
+        sql_list = []
+        sheet_order = 1
+        for sheet_name in self.data_sheet_names:
+            df = self.sheet(sheet_name)
+            # 将列名转换为小写以进行不区分大小写的比较
+            df.columns = df.columns.str.lower()
+            columns = df.columns.tolist()
+
+            if 'db_name' not in columns or 'output_sql' not in columns:
+                raise TemplateError(f"工作表 '{sheet_name}' 必须包含 db_name 和 output_sql 字段（不区分大小写）")
+
+            # 获取每一行的数据
+            for index, row in df.iterrows():
+                sql_dict = {
+                    'db_name': row['db_name'],
+                    'output_sql': row['output_sql'],
+                    'sql_order': index + 1,
+                    'sheet_name': sheet_name,
+                    'sheet_order': sheet_order
+                }
+
+                # 检查并添加 sql1, sql2, sql3 等字段
+                i = 1
+                while f'sql{i}' in columns:
+                    if pd.notna(row[f'sql{i}']):  # 检查值是否为空
+                        sql_dict[f'sql{i}'] = row[f'sql{i}']
+                    i += 1
+
+                # 添加其他可选字段
+                if 'format' in columns and pd.notna(row['format']):
+                    sql_dict['format'] = row['format']
+                if 'pos' in columns and pd.notna(row['pos']):
+                    sql_dict['pos'] = row['pos']
+                if 'transpose(y/n)' in columns and pd.notna(row['transpose(y/n)']):
+                    sql_dict['transpose(Y/N)'] = row['transpose(y/n)']
+
+                sql_list.append(sql_dict)
+            sheet_order += 1
+        return sql_list
+
+
+_cache = OrderedDict()  # {content_hash: ExcelTemplate}
+_cache_lock = threading.Lock()
+
+
+def load_template(file_path):
+    """
+    加载 Excel 模板，相同内容的文件只解析一次
+
+    Raises:
+        FileNotFoundError: 文件不存在
+    """
+    with open(file_path, 'rb') as f:
+        content = f.read()
+    content_hash = hashlib.sha256(content).hexdigest()
+
+    with _cache_lock:
+        template = _cache.get(content_hash)
+        if template is not None:
+            _cache.move_to_end(content_hash)
+            return template
+
+    # 一次读取所有工作表
+    sheets = pd.read_excel(io.BytesIO(content), sheet_name=None)
+    template = ExcelTemplate(content_hash, sheets)
+    logging.info(f'解析模板: {file_path}, 工作表: {template.sheet_names}')
+
+    with _cache_lock:
+        _cache[content_hash] = template
+        while len(_cache) > REPORT_CONFIG['template_cache_size']:
+            _cache.popitem(last=False)
+    return template
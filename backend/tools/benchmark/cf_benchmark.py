@@ -0,0 +1,79 @@
+"""
+条件格式回归基准
+
+构造不同行数的结果块（含 data_bar/color_scale 规则），按汇总表的写入流程渲染并保存，
+输出条件格式规则数量和保存耗时。规则数量应与行数无关，否则以非零状态退出。
+
+用法（在项目根目录执行）:
+    python -m backend.tools.benchmark.cf_benchmark --rows 1000 5000 20000
+"""
+import argparse
+import io
+import logging
+import sys
+import time
+
+from openpyxl import Workbook
+from openpyxl.styles import Font, Border, Side
+
+from backend.report_blocks import ReportBlock, StyleCache, ConditionalFormatRegistry, place_block, render_block
+from backend.report_generator_v2 import apply_format_rules
+
+FORMAT_RULES = 'bold:1-1,1-max;data_bar:2-max,1-1;color_scale:2-max,2-2'
+
+
+def build_block(rows, cols=6):
+    """生成指定行数的结果块并应用样式规则"""
+    columns = [f'col_{j}' for j in range(cols)]
+    data = [[i * cols + j for j in range(cols)] for i in range(rows)]
+    border = Border(left=Side(style=None), right=Side(style=None), top=Side(style=None), bottom=Side(style=None))
+    block = ReportBlock(columns, data, Font(name='微软雅黑', size=12, bold=True), Font(name='微软雅黑', size=12), border)
+    apply_format_rules(block, FORMAT_RULES)
+    return block
+
+
+def run(rows, blocks=2):
+    """渲染 blocks 个结果块到同一汇总表并保存，返回 (规则数量, 保存耗时)"""
+    wb = Workbook()
+    ws = wb.active
+    styles = StyleCache(ws)
+    conditional_formats = ConditionalFormatRegistry(row_offset=1, col_offset=1)
+    pos_dict = {}
+    summary_row_offset = 1
+    for index in range(blocks):
+        block = build_block(rows)
+        start_row, start_col, summary_row_offset = place_block(
+            f'1-{index + 1}', block.max_row, block.max_column, pos_dict, summary_row_offset)
+        render_block(ws, block, start_row + 1, start_col + 1, styles)
+        conditional_formats.add_block(block, start_row, start_col)
+        summary_row_offset += block.max_row + 1
+    conditional_formats.apply(ws)
+
+    rule_count = sum(len(cf.rules) for cf in ws.conditional_formatting)
+    start = time.perf_counter()
+    wb.save(io.BytesIO())
+    return rule_count, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='条件格式规则数量与保存耗时基准')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 5000, 20000], help='每个结果块的数据行数')
+    parser.add_argument('--blocks', type=int, default=2, help='每个工作表的结果块数量')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stdout)
+
+    rule_counts = set()
+    for rows in args.rows:
+        rule_count, seconds = run(rows, args.blocks)
+        rule_counts.add(rule_count)
+        logging.info(f'行数: {rows:>8}  条件格式规则: {rule_count:>4}  保存耗时: {seconds:.3f}s  '
+                     f'每千行: {seconds / rows * 1000:.4f}s')
+
+    if len(rule_counts) != 1:
+        logging.error(f'条件格式规则数量随行数变化: {sorted(rule_counts)}')
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
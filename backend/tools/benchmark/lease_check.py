@@ -0,0 +1,256 @@
+"""
+多节点任务租约检查
+
+插入一批已到期的测试任务，启动多个本地进程模拟调度节点争抢租约（与调度器一样只续约正在执行的任务）。检查：
+- 每个任务只被一个节点执行一次
+- node-0 取得第一个租约后不释放直接退出（模拟崩溃），该任务在租约到期后被其他节点接手
+- node-1 第一次释放租约失败（模拟数据库错误），遗留的租约不再续约，任务被重新取得执行
+- node-2 的第一个任务执行时间超过租约时长，期间按时续约，不会被其他节点重复执行
+- 任务分散到多个节点执行
+不满足时以非零状态退出。
+
+默认使用配置的 MySQL（DB_CONFIG，需先执行过 check_and_create_tables 添加租约字段），
+测试任务的名称以 __lease_check_ 开头，结束后删除。
+--sqlite 指定文件时改用本地 SQLite 数据库，不需要 MySQL：租约语句（TaskLeases 中的 SQL）
+只把占位符和 NOW() / NOW() + INTERVAL n SECOND 换成等价的 SQLite 写法后执行，多个进程共用该文件。
+
+用法（在项目根目录执行）:
+    python -m backend.tools.benchmark.lease_check --nodes 4 --tasks 40 --lease-seconds 5
+    python -m backend.tools.benchmark.lease_check --sqlite /tmp/lease_check.db --lease-seconds 2
+"""
+import argparse
+import multiprocessing
+import os
+import re
+import sqlite3
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from backend.task_lease import TaskLeases
+
+TASK_PREFIX = '__lease_check_'
+FAR_FUTURE = datetime(2999, 1, 1)
+SQLITE_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def _sqlite_time(value):
+    return value.strftime(SQLITE_TIME_FORMAT)
+
+
+def connect_sqlite(path):
+    """打开 SQLite 数据库，注册与 MySQL NOW() 等价的函数（同一台机器上各进程共用系统时钟，相当于数据库时间）"""
+    sqlite3.register_adapter(datetime, _sqlite_time)
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    connection.create_function('DB_NOW', 0, lambda: _sqlite_time(datetime.now()))
+    connection.create_function('DB_NOW_PLUS', 1,
+                               lambda seconds: _sqlite_time(datetime.now() + timedelta(seconds=seconds)))
+    return connection
+
+
+def to_sqlite(sql):
+    """把 TaskLeases 中的 MySQL 语句换成 SQLite 写法"""
+    sql = sql.replace('%s', '?')
+    sql = re.sub(r'NOW\(\) \+ INTERVAL \? SECOND', 'DB_NOW_PLUS(?)', sql)
+    return sql.replace('NOW()', 'DB_NOW()')
+
+
+class SqliteLeases(TaskLeases):
+    """在 SQLite 中执行租约语句的 TaskLeases"""
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.connection = connect_sqlite(path)
+
+    def _execute(self, sql, params=(), fetch=False):
+        cursor = self.connection.execute(to_sqlite(sql), tuple(params))
+        if fetch:
+            return [dict(row) for row in cursor.fetchall()]
+        return cursor.rowcount
+
+
+class FailingRelease:
+    """包装 TaskLeases，第一次 release 抛出异常（模拟释放租约时数据库出错）"""
+
+    def __init__(self, leases):
+        self.leases = leases
+        self.failed = False
+
+    def __getattr__(self, name):
+        return getattr(self.leases, name)
+
+    def release(self, task_id, next_run_at):
+        if not self.failed:
+            self.failed = True
+            raise RuntimeError('模拟释放租约失败')
+        self.leases.release(task_id, next_run_at)
+
+
+def create_tasks(count, sqlite_path=None):
+    """插入 count 个已到期的测试任务，返回任务ID列表"""
+    if sqlite_path:
+        connection = connect_sqlite(sqlite_path)
+        connection.execute("DROP TABLE IF EXISTS autoreport_tasks")
+        connection.execute(
+            "CREATE TABLE autoreport_tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, taskName TEXT, "
+            "is_enabled INTEGER, next_run_at TEXT, lease_owner TEXT, lease_expires_at TEXT)"
+        )
+        task_ids = []
+        for index in range(count):
+            cursor = connection.execute(
+                "INSERT INTO autoreport_tasks (taskName, is_enabled, next_run_at) VALUES (?, 1, ?)",
+                (f'{TASK_PREFIX}{index}', datetime.now() - timedelta(minutes=1))
+            )
+            task_ids.append(cursor.lastrowid)
+        connection.close()
+        return task_ids
+
+    from backend.config import DB_CONFIG
+    from backend.utils import connect_db_with_config
+
+    connection = connect_db_with_config(DB_CONFIG)
+    cursor = connection.cursor()
+    try:
+        task_ids = []
+        for index in range(count):
+            cursor.execute(
+                "INSERT INTO autoreport_tasks (gameType, taskName, frequency, `time`, next_run_at, is_enabled) "
+                "VALUES (%s, %s, %s, %s, NOW() - INTERVAL 1 MINUTE, TRUE)",
+                ('lease_check', f'{TASK_PREFIX}{index}', 'day', '00:00')
+            )
+            task_ids.append(cursor.lastrowid)
+        connection.commit()
+        return task_ids
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def delete_tasks(sqlite_path=None):
+    if sqlite_path:
+        if os.path.exists(sqlite_path):
+            os.remove(sqlite_path)
+        return
+
+    from backend.config import DB_CONFIG
+    from backend.utils import connect_db_with_config
+
+    connection = connect_db_with_config(DB_CONFIG)
+    cursor = connection.cursor()
+    try:
+        cursor.execute("DELETE FROM autoreport_tasks WHERE taskName LIKE %s", (f'{TASK_PREFIX}%',))
+        connection.commit()
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def node(index, task_ids, lease_seconds, run_seconds, deadline, results, sqlite_path):
+    """模拟一个调度节点：巡检到期任务、取得租约、执行（长任务期间续约）、释放租约"""
+    node_id = f'node-{index}'
+    if sqlite_path:
+        leases = SqliteLeases(sqlite_path, node_id=node_id, lease_seconds=lease_seconds)
+    else:
+        leases = TaskLeases(node_id=node_id, lease_seconds=lease_seconds)
+    if index == 1:
+        leases = FailingRelease(leases)
+    slow = index == 2  # 第一个任务执行 2 倍租约时长
+    task_ids = set(task_ids)
+    while time.time() < deadline:
+        claimed = False
+        for task in leases.due_tasks(10):
+            if task['id'] not in task_ids or not leases.claim(task['id']):
+                continue
+            claimed = True
+            results.put((task['id'], node_id))
+            if index == 0:
+                # 持有租约时崩溃，不释放（先等结果写入队列）
+                results.close()
+                results.join_thread()
+                os._exit(0)
+            seconds = 2 * lease_seconds if slow else run_seconds
+            slow = False
+            finish = time.time() + seconds
+            while time.time() < finish:
+                time.sleep(min(lease_seconds / 3, finish - time.time()))
+                leases.renew([task['id']])
+            try:
+                leases.release(task['id'], FAR_FUTURE)
+            except RuntimeError:
+                pass
+        if not claimed:
+            # 与调度器的巡检一样定期续约：空闲时没有正在执行的任务
+            leases.renew([])
+            time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多节点任务租约检查')
+    parser.add_argument('--nodes', type=int, default=4, help='模拟的节点（进程）数量，至少 4 个')
+    parser.add_argument('--tasks', type=int, default=40, help='测试任务数量')
+    parser.add_argument('--lease-seconds', type=int, default=5, help='租约时长（秒）')
+    parser.add_argument('--run-seconds', type=float, default=0.1, help='每个任务的模拟执行时间（秒）')
+    parser.add_argument('--sqlite', help='使用该 SQLite 文件代替 MySQL（检查结束后删除）')
+    args = parser.parse_args()
+    if args.nodes < 4:
+        parser.error('--nodes 至少为 4（崩溃、释放失败、长任务各需一个节点）')
+
+    delete_tasks(args.sqlite)
+    task_ids = create_tasks(args.tasks, args.sqlite)
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    deadline = time.time() + 4 * args.lease_seconds + args.tasks * args.run_seconds + 5
+    processes = [
+        context.Process(target=node, args=(index, task_ids, args.lease_seconds, args.run_seconds,
+                                           deadline, results, args.sqlite))
+        for index in range(args.nodes)
+    ]
+    runs = []
+    try:
+        for process in processes:
+            process.start()
+        # 先取出结果再等待进程结束，避免队列未读完时子进程无法退出
+        while any(process.is_alive() for process in processes) or not results.empty():
+            try:
+                runs.append(results.get(timeout=0.5))
+            except Exception:
+                pass
+        for process in processes:
+            process.join()
+    finally:
+        delete_tasks(args.sqlite)
+
+    counts = Counter(task_id for task_id, _ in runs)
+    first_run = {}
+    for task_id, node_id in runs:
+        first_run.setdefault(node_id, task_id)
+    crashed = first_run.get('node-0')
+    failed_release = first_run.get('node-1')
+    per_node = Counter(node_id for _, node_id in runs)
+    print(f'执行次数: {len(runs)}  各节点: {dict(sorted(per_node.items()))}')
+
+    errors = []
+    missing = [task_id for task_id in task_ids if task_id not in counts]
+    if missing:
+        errors.append(f'未执行的任务: {missing}')
+    for task_id, count in counts.items():
+        expected = 2 if task_id in (crashed, failed_release) else 1
+        if count != expected:
+            errors.append(f'任务 {task_id} 执行了 {count} 次，应为 {expected} 次')
+    if crashed is None or failed_release is None:
+        errors.append('崩溃节点或释放失败的节点没有取得任务')
+    if len([node_id for node_id in per_node if node_id != 'node-0']) < 2:
+        errors.append('任务没有分散到多个节点')
+
+    if errors:
+        for error in errors:
+            print(error)
+        sys.exit(1)
+    print(f'每个任务只执行一次；崩溃节点的任务 {crashed} 已被接手，释放失败的任务 {failed_release} 已重新执行，'
+          f'续约中的长任务未被重复执行')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+查询缓存键检查
+
+检查 normalize_sql 的规范化结果：只有空白、注释或结尾分号不同的SQL使用同一个缓存键，
+注释吞掉的换行、引号内的内容、优化器提示等不同的SQL使用不同的缓存键。
+不满足时以非零状态退出。
+
+用法（在项目根目录执行）:
+    python -m backend.tools.benchmark.query_cache_check
+"""
+import argparse
+import sys
+
+from backend.query_cache import cache_key, normalize_sql
+
+DB_CONFIG = {'host': 'localhost', 'port': 3306, 'user': 'report', 'database': 'report'}
+
+# (SQL A, SQL B, 是否应使用同一个缓存键)
+CASES = [
+    ("SELECT a FROM t WHERE b = 1", "SELECT  a\n  FROM t\n WHERE b = 1;", True),
+    ("SELECT 1 -- x\nFROM t WHERE a=1", "SELECT 1 FROM t WHERE a=1", True),
+    ("SELECT 1 -- x\nFROM t WHERE a=1", "SELECT 1 -- x FROM t WHERE a=1", False),
+    ("SELECT 1 # x\nFROM t", "SELECT 1 # x FROM t", False),
+    ("SELECT a /* 说明\n多行 */ FROM t", "SELECT a FROM t", True),
+    ("SELECT a--1\nFROM t", "SELECT a FROM t", False),
+    ("SELECT 'a  -- b' FROM t", "SELECT 'a -- b' FROM t", False),
+    ("SELECT /*+ MAX_EXECUTION_TIME(1000) */ a FROM t", "SELECT a FROM t", False),
+    ("SELECT /*!40001 SQL_NO_CACHE */ a FROM t", "SELECT a FROM t", False),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='查询缓存键检查')
+    parser.parse_args()
+
+    errors = []
+    for sql_a, sql_b, same in CASES:
+        key_a = cache_key(sql_a, {}, DB_CONFIG)
+        key_b = cache_key(sql_b, {}, DB_CONFIG)
+        if (key_a == key_b) != same:
+            expected = '相同' if same else '不同'
+            errors.append(f'缓存键应{expected}: {normalize_sql(sql_a)!r} / {normalize_sql(sql_b)!r}')
+
+    if errors:
+        for error in errors:
+            print(error)
+        sys.exit(1)
+    print(f'{len(CASES)} 组SQL的缓存键均符合预期')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+调度器增量更新回归检查
+
+用内存中的任务代替数据库，反复修改、停用、启用和删除任务，检查每次修改后调度中的任务数量
+与启用的任务数量一致、堆大小保持在任务数量的常数倍以内，并输出每次修改的平均耗时。
+调度数量或堆大小随修改次数增长时以非零状态退出。
+
+用法（在项目根目录执行）:
+    python -m backend.tools.benchmark.scheduler_reload_check --tasks 1000 --edits 20000
+"""
+import argparse
+import logging
+import random
+import sys
+import time
+
+from backend.task_scheduler import TaskScheduler
+
+
+class InMemoryScheduler(TaskScheduler):
+    """从字典读取任务的调度器"""
+
+    def __init__(self, rows):
+        super().__init__()
+        self.rows = rows
+
+    def _fetch_task(self, task_id):
+        row = self.rows.get(str(task_id))
+        return dict(row) if row else None
+
+
+def make_task(task_id, rng):
+    frequency = rng.choice(['day', 'week', 'month'])
+    return {
+        'id': task_id,
+        'taskName': f'task_{task_id}',
+        'frequency': frequency,
+        'dayOfMonth': rng.randint(1, 28) if frequency == 'month' else None,
+        'dayOfWeek': rng.randint(1, 7) if frequency == 'week' else None,
+        'time': f'{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}',
+        'is_enabled': True,
+    }
+
+
+def run(task_count, edits, seed=0):
+    """
+    执行 edits 次随机修改
+
+    Returns:
+        tuple: (出错信息列表, 每次修改的平均耗时)
+    """
+    rng = random.Random(seed)
+    rows = {}
+    scheduler = InMemoryScheduler(rows)
+    for task_id in range(task_count):
+        rows[str(task_id)] = make_task(task_id, rng)
+        scheduler.upsert_task(task_id)
+
+    errors = []
+    start = time.perf_counter()
+    for edit in range(edits):
+        task_id = str(rng.randrange(task_count))
+        action = rng.random()
+        if action < 0.6:
+            # 修改执行时间或其他字段
+            if task_id not in rows:
+                rows[task_id] = make_task(int(task_id), rng)
+            elif rng.random() < 0.5:
+                rows[task_id]['time'] = f'{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}'
+            else:
+                rows[task_id]['taskName'] = f'task_{task_id}_{edit}'
+            scheduler.upsert_task(task_id)
+        elif action < 0.8 and task_id in rows:
+            rows[task_id]['is_enabled'] = not rows[task_id]['is_enabled']
+            scheduler.upsert_task(task_id)
+        else:
+            rows.pop(task_id, None)
+            scheduler.remove_task(task_id)
+
+        enabled = sum(1 for row in rows.values() if row['is_enabled'])
+        scheduled = len(scheduler._jobs)
+        if scheduled != enabled:
+            errors.append(f'第 {edit} 次修改后调度数量 {scheduled} 与启用任务数量 {enabled} 不一致')
+            break
+        if len(scheduler._heap) > 2 * enabled + 16:
+            errors.append(f'第 {edit} 次修改后堆大小 {len(scheduler._heap)} 超过启用任务数量 {enabled} 的 2 倍')
+            break
+    seconds = time.perf_counter() - start
+    scheduler.executor.shutdown(wait=False)
+    return errors, seconds / max(edits, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='调度器增量更新回归检查')
+    parser.add_argument('--tasks', type=int, default=1000, help='任务数量')
+    parser.add_argument('--edits', type=int, default=20000, help='修改次数')
+    args = parser.parse_args()
+
+    # 调度器每次更新都会记录 INFO 日志，检查时只输出结果
+    logging.basicConfig(level=logging.WARNING, format='%(message)s', stream=sys.stdout, force=True)
+
+    errors, per_edit = run(args.tasks, args.edits)
+    print(f'任务: {args.tasks}  修改: {args.edits}  每次修改: {per_edit * 1000:.3f}ms')
+    if errors:
+        for error in errors:
+            print(error)
+        sys.exit(1)
+    print('调度数量与启用任务数量一致')
+
+
+if __name__ == "__main__":
+    main()
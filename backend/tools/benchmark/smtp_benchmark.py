@@ -0,0 +1,122 @@
+"""
+SMTP 连接复用基准
+
+在本机启动一个最简的 SMTP 服务（每次建立连接和登录时模拟握手延迟），分别按
+"每封邮件新建连接"和"连接池复用连接"发送同样数量的邮件，输出总耗时和建立的连接数。
+
+用法（在项目根目录执行）:
+    python -m backend.tools.benchmark.smtp_benchmark --messages 50 --handshake-ms 50
+"""
+import argparse
+import logging
+import socketserver
+import sys
+import threading
+import time
+
+from backend.email_sender import SMTPPool, SMTPSession
+
+MESSAGE = 'From: a@example.com\r\nTo: b@example.com\r\nSubject: benchmark\r\n\r\n' + 'x' * 2048
+
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    """只实现发送邮件所需命令的 SMTP 服务"""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        time.sleep(server.handshake)
+        self.reply('220 benchmark ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply('250-benchmark')
+                self.reply('250 AUTH PLAIN')
+            elif command.startswith('AUTH'):
+                time.sleep(server.handshake)
+                self.reply('235 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                with server.lock:
+                    server.messages += 1
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                # MAIL / RCPT / NOOP / RSET
+                self.reply('250 OK')
+
+
+class FakeSMTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handshake):
+        super().__init__(('127.0.0.1', 0), FakeSMTPHandler)
+        self.handshake = handshake
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0
+
+
+def send_per_connection(port, count):
+    """每封邮件新建连接并登录（复用前的发送方式）"""
+    for _ in range(count):
+        session = SMTPSession('127.0.0.1', port, 'user', 'password', use_ssl=False)
+        session.sendmail('a@example.com', ['b@example.com'], MESSAGE)
+        session.close()
+
+
+def send_pooled(port, count):
+    """通过连接池发送，每封邮件从池中获取连接"""
+    pool = SMTPPool(max_idle=1, keepalive_interval=30, idle_timeout=240)
+    for _ in range(count):
+        with pool.session('127.0.0.1', port, 'user', 'password', use_ssl=False) as session:
+            session.sendmail('a@example.com', ['b@example.com'], MESSAGE)
+    pool.close_all()
+
+
+def run(sender, count, handshake):
+    """启动服务并发送 count 封邮件，返回 (耗时, 连接数, 收到的邮件数)"""
+    server = FakeSMTPServer(handshake)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        start = time.perf_counter()
+        sender(server.server_address[1], count)
+        seconds = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+    return seconds, server.connections, server.messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SMTP 连接复用基准')
+    parser.add_argument('--messages', type=int, default=50, help='发送的邮件数量')
+    parser.add_argument('--handshake-ms', type=float, default=50, help='模拟的建立连接和登录延迟（毫秒）')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(message)s', stream=sys.stdout)
+
+    for name, sender in (('每封新建连接', send_per_connection), ('连接池复用', send_pooled)):
+        seconds, connections, messages = run(sender, args.messages, args.handshake_ms / 1000)
+        print(f'{name}:  邮件: {messages:>5}  连接数: {connections:>5}  耗时: {seconds:.3f}s  '
+              f'每封: {seconds / args.messages * 1000:.1f}ms')
+        if messages != args.messages:
+            print(f'收到的邮件数量不正确: {messages} != {args.messages}')
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
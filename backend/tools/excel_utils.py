@@ -1,4 +1,5 @@
 import pandas as pd
+from backend.template_loader import load_template, TemplateError
 
 def check_excel_file(file_path):
     """
@@ -14,61 +15,12 @@ def check_excel_file(file_path):
             - sql_list: list[dict]: 包含每一行数据的字典列表
     """
     try:
-        # 读取所有工作表
-        all_sheets_data = pd.read_excel(file_path, sheet_name=None)
-
-        # 检查是否包含 db_name 和 output_sql 字段（不区分大小写）
-        sql_list = []
-        sheet_order = 1
-        
-        # 先检查是否存在setting工作表
-        setting_sheet = None
-        for sheet_name in all_sheets_data.keys():
-            if '{setting}' in sheet_name.lower():
-                setting_sheet = sheet_name
-                break
-        
-        for sheet_name, df in all_sheets_data.items():
-            # 跳过setting工作表
-            if sheet_name == setting_sheet:
-                continue
-                
-            # 将列名转换为小写以进行不区分大小写的比较
-            df.columns = df.columns.str.lower()
-            columns = df.columns.tolist()
-            
-            if 'db_name' not in columns or 'output_sql' not in columns:
-                return {"is_valid": False, "message": f"工作表 '{sheet_name}' 必须包含 db_name 和 output_sql 字段（不区分大小写）"}
-
-            # 获取每一行的数据
-            for index, row in df.iterrows():
-                sql_dict = {
-                    'db_name': row['db_name'],
-                    'output_sql': row['output_sql'],
-                    'sql_order': index + 1,
-                    'sheet_name': sheet_name,
-                    'sheet_order': sheet_order
-                }
-                
-                # 检查并添加 sql1, sql2, sql3 等字段
-                i = 1
-                while f'sql{i}' in columns:
-                    if pd.notna(row[f'sql{i}']):  # 检查值是否为空
-                        sql_dict[f'sql{i}'] = row[f'sql{i}']
-                    i += 1
-                
-                # 添加其他可选字段
-                if 'format' in columns and pd.notna(row['format']):
-                    sql_dict['format'] = row['format']
-                if 'pos' in columns and pd.notna(row['pos']):
-                    sql_dict['pos'] = row['pos']
-                if 'transpose(y/n)' in columns and pd.notna(row['transpose(y/n)']):
-                    sql_dict['transpose(Y/N)'] = row['transpose(y/n)']
-                
-                sql_list.append(sql_dict)
-            sheet_order += 1
-            
+        # 使用模板加载器解析（相同内容的文件只解析一次）
+        template = load_template(file_path)
+        sql_list = template.sql_rows()
         return {"is_valid": True, "message": "", "sql_list": sql_list}
+    except TemplateError as e:
+        return {"is_valid": False, "message": str(e)}
     except FileNotFoundError:
         return {"is_valid": False, "message": "文件未找到"}
     except pd.errors.EmptyDataError:
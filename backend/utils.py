@@ -38,10 +38,82 @@ def connect_db_with_config(db_config):
         logging.error(f'数据库连接失败: {e}')
         raise
 
-def execute_query(connection, query):
+def apply_session_settings(connection):
+    """
+    设置连接的字符集和会话参数，以支持大型SQL
+    连接池在创建连接和每次归还时重置会话后调用
+    """
+    # 修改连接设置以支持大型查询
+    connection.set_charset_collation('utf8mb4', 'utf8mb4_general_ci')
+    
+    # 使用会话级别的设置来提高大型SQL的兼容性
+    with connection.cursor() as config_cursor:
+        try:
+            # 设置会话级别参数，不影响全局设置
+            config_cursor.execute("SET SESSION net_read_timeout=3600")  # 1小时
+            config_cursor.execute("SET SESSION max_execution_time=3600000")  # 1小时(毫秒)
+            config_cursor.execute("SET SESSION max_allowed_packet=1073741824")  # 1GB
+            # 设置 SQL 模式以保留空格
+            config_cursor.execute("SET SESSION sql_mode='NO_BACKSLASH_ESCAPES'")
+        except Exception as e:
+            logging.warning(f"设置会话参数失败: {e}")
+
+def _run_query(cursor, query):
+    """
+    在游标上执行SQL，保持原始格式
+    """
+    # 记录SQL长度
+    sql_length = len(query)
+    if sql_length > 100000:
+        logging.info(f"执行长SQL查询, 长度: {sql_length} 字符")
+    elif sql_length > 10000:
+        logging.info(f"执行中等长度SQL查询, 长度: {sql_length} 字符")
+    
+    # 执行查询，保持原始格式
+    multi = False
+    if ";" in query and not query.strip().endswith(';'):
+        multi = True  # 如果查询包含多个语句，使用multi=True
+        
+    # 不对查询进行任何格式化或清理，直接执行
+    cursor.execute(query, multi=multi)
+
+def _log_query_error(query, e):
+    """
+    记录SQL执行失败的信息，长SQL保存到单独的文件
+    """
+    logging.error(f'SQL查询失败: {e}')
+    # 记录更多信息以便调试
+    logging.error(f'SQL长度: {len(query)} 字符')
+    
+    # 将长SQL片段保存到单独的文件
+    if len(query) > 1000:
+        try:
+            from datetime import datetime
+            error_log_dir = os.path.join('logs', 'sql_errors')
+            os.makedirs(error_log_dir, exist_ok=True)
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            error_log_file = os.path.join(error_log_dir, f'sql_error_utils_{timestamp}.sql')
+            
+            with open(error_log_file, 'w', encoding='utf-8') as f:
+                f.write(f"-- 错误信息: {str(e)}\n")
+                f.write(f"-- SQL长度: {len(query)} 字符\n")
+                f.write(f"-- 时间: {timestamp}\n\n")
+                f.write(query)
+            
+            logging.error(f'完整SQL已保存到: {error_log_file}')
+        except Exception as log_error:
+            logging.error(f'保存SQL日志失败: {log_error}')
+    else:
+        # 只记录查询的前100个和后100个字符
+        logging.error(f'SQL前100字符: {query[:100]}')
+        logging.error(f'SQL后100字符: {query[-100:]}')
+
+def execute_query(connection, query, apply_session=True):
     """
     执行SQL查询，支持大型SQL语句，保留换行和空格
+    apply_session 为 False 时跳过会话参数设置（连接已设置过，如连接池中的连接）
     """
+    cursor = None
     try:
         # 在执行前记录完整的SQL
         # logging.info("准备执行的SQL查询:")
@@ -49,75 +121,67 @@ def execute_query(connection, query):
         # logging.info(f"\n{query}")
         # logging.info("-" * 80)
         
-        # 修改连接设置以支持大型查询
-        connection.set_charset_collation('utf8mb4', 'utf8mb4_general_ci')
-        
-        # 使用会话级别的设置来提高大型SQL的兼容性
-        with connection.cursor() as config_cursor:
-            try:
-                # 设置会话级别参数，不影响全局设置
-                config_cursor.execute("SET SESSION net_read_timeout=3600")  # 1小时
-                config_cursor.execute("SET SESSION max_execution_time=3600000")  # 1小时(毫秒)
-                config_cursor.execute("SET SESSION max_allowed_packet=1073741824")  # 1GB
-                # 设置 SQL 模式以保留空格
-                config_cursor.execute("SET SESSION sql_mode='NO_BACKSLASH_ESCAPES'")
-            except Exception as e:
-                logging.warning(f"设置会话参数失败: {e}")
+        if apply_session:
+            apply_session_settings(connection)
                 
         cursor = connection.cursor()
-        
-        # 记录SQL长度
-        sql_length = len(query)
-        if sql_length > 100000:
-            logging.info(f"执行长SQL查询, 长度: {sql_length} 字符")
-        elif sql_length > 10000:
-            logging.info(f"执行中等长度SQL查询, 长度: {sql_length} 字符")
-        
-        # 执行查询，保持原始格式
-        multi = False
-        if ";" in query and not query.strip().endswith(';'):
-            multi = True  # 如果查询包含多个语句，使用multi=True
-            
-        # 不对查询进行任何格式化或清理，直接执行
-        cursor.execute(query, multi=multi)
+        _run_query(cursor, query)
         
         result = cursor.fetchall()
         column_names = [desc[0] for desc in cursor.description]
         return column_names, result
     except Error as e:
-        logging.error(f'SQL查询失败: {e}')
-        # 记录更多信息以便调试
-        logging.error(f'SQL长度: {len(query)} 字符')
-        
-        # 将长SQL片段保存到单独的文件
-        if len(query) > 1000:
-            try:
-                import os
-                from datetime import datetime
-                error_log_dir = os.path.join('logs', 'sql_errors')
-                os.makedirs(error_log_dir, exist_ok=True)
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                error_log_file = os.path.join(error_log_dir, f'sql_error_utils_{timestamp}.sql')
-                
-                with open(error_log_file, 'w', encoding='utf-8') as f:
-                    f.write(f"-- 错误信息: {str(e)}\n")
-                    f.write(f"-- SQL长度: {len(query)} 字符\n")
-                    f.write(f"-- 时间: {timestamp}\n\n")
-                    f.write(query)
-                
-                logging.error(f'完整SQL已保存到: {error_log_file}')
-            except Exception as log_error:
-                logging.error(f'保存SQL日志失败: {log_error}')
-        else:
-            # 只记录查询的前100个和后100个字符
-            logging.error(f'SQL前100字符: {query[:100]}')
-            logging.error(f'SQL后100字符: {query[-100:]}')
-        
+        _log_query_error(query, e)
         raise
     finally:
         if cursor:
             cursor.close()
 
+def iter_query(connection, query, chunk_size, apply_session=True):
+    """
+    流式执行SQL查询：使用非缓冲游标，结果按 chunk_size 行分块读取
+
+    Returns:
+        tuple: (column_names, chunks)，chunks 为逐块返回行列表的生成器，
+               读取完毕或关闭生成器时释放游标；读取完之前同一连接不能执行其他SQL
+    """
+    cursor = None
+    try:
+        if apply_session:
+            apply_session_settings(connection)
+
+        cursor = connection.cursor(buffered=False)
+        _run_query(cursor, query)
+        column_names = [desc[0] for desc in cursor.description]
+    except Error as e:
+        _log_query_error(query, e)
+        if cursor:
+            cursor.close()
+        raise
+    except Exception:
+        if cursor:
+            cursor.close()
+        raise
+
+    def chunks():
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        except Error as e:
+            _log_query_error(query, e)
+            raise
+        finally:
+            try:
+                cursor.close()
+            except Error as e:
+                # 提前结束读取时游标中可能还有未读的结果，由调用方丢弃连接
+                logging.warning(f'关闭游标失败: {e}')
+
+    return column_names, chunks()
+
 def ensure_dir_exists(path):
     """
     确保目录存在，不存在则创建
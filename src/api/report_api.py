@@ -21,6 +21,7 @@ from backend.config import OUTPUT_DIR, DB_CONFIG
 from backend.report_task import ReportTask
 from backend.task_scheduler import TaskScheduler, calculate_next_run_at  # 导入 TaskScheduler
 from backend.tools.excel_utils import check_excel_file
+from backend.template_loader import load_template
 from backend.utils import connect_db, execute_query
 import sqlparse
 import mysql.connector
@@ -28,6 +29,9 @@ from backend.task_management import register_task_management_routes
 from backend.dify import register_dify_routes
 from backend.file_name_formatter import format_filename
 from backend import task_scheduler
+from backend import metrics
+from backend.db_pool import connection_pool, control_pool
+from backend.mail_queue import mail_queue
 from backend.email_management import (
     get_all_emails, search_emails, add_email, update_email, delete_email, batch_delete_emails,
     get_all_groups, search_groups, add_group, update_group, delete_group, batch_delete_groups,
@@ -50,6 +54,46 @@ register_task_management_routes(app, task_scheduler)
 # 注册Dify相关的路由
 register_dify_routes(app)
 
+
+# 连接池名称：报表查询 / 系统表读写
+DB_POOLS = {'report': connection_pool, 'control': control_pool}
+
+
+def _pool_gauge(field):
+    """数据库连接池各组连接数，按连接池和 host:port/database 分组"""
+    def collect():
+        values = []
+        for kind, pool in DB_POOLS.items():
+            for (host, port, user, database), stats in pool.stats().items():
+                value = stats['open'] - stats['idle'] if field == 'in_use' else stats[field]
+                values.append(({'kind': kind, 'pool': f'{host}:{port}/{database}', 'user': user}, value))
+        return values
+    return collect
+
+
+# 采集时读取的当前状态（不访问数据库）
+metrics.registry.register(metrics.Gauge(
+    'autoreport_scheduler_queue_depth', '已提交到工作线程池、尚未开始执行的定时任务数',
+    callback=lambda: [({}, task_scheduler.get_metrics()['queue_depth'])]))
+metrics.registry.register(metrics.Gauge(
+    'autoreport_scheduler_running_tasks', '正在执行的定时任务数',
+    callback=lambda: [({}, task_scheduler.get_metrics()['running'])]))
+metrics.registry.register(metrics.Gauge(
+    'autoreport_scheduler_workers', '定时任务工作线程数',
+    callback=lambda: [({}, task_scheduler.max_workers)]))
+metrics.registry.register(metrics.Gauge(
+    'autoreport_mail_queue_in_flight', '正在发送的队列邮件数',
+    callback=lambda: [({}, mail_queue.in_flight)]))
+metrics.registry.register(metrics.Gauge(
+    'autoreport_db_pool_open_connections', '连接池已创建的连接数', labelnames=('kind', 'pool', 'user'),
+    callback=_pool_gauge('open')))
+metrics.registry.register(metrics.Gauge(
+    'autoreport_db_pool_in_use_connections', '连接池中正在使用的连接数', labelnames=('kind', 'pool', 'user'),
+    callback=_pool_gauge('in_use')))
+metrics.registry.register(metrics.Gauge(
+    'autoreport_db_pool_max_size', '连接池每组的最大连接数', labelnames=('kind',),
+    callback=lambda: [({'kind': kind}, pool.max_size) for kind, pool in DB_POOLS.items()]))
+
 # 添加错误处理中间件
 @app.errorhandler(Exception)
 def handle_exception(e):
@@ -220,41 +264,10 @@ def create_task_api():
                 return jsonify({"message": f"读取 Excel 文件失败: {excel_result['message']}"}), 500
             sql_list = excel_result['sql_list']
             
-            # 读取setting工作表的配置
+            # 读取setting工作表的配置（模板已在校验时解析并缓存，这里不会重新读取文件）
             settings = {}
             try:
-                xls = pd.ExcelFile(file_path)
-                setting_sheet = None
-                
-                # 查找setting工作表
-                for sheet_name in xls.sheet_names:
-                    if '{setting}' in sheet_name.lower():
-                        setting_sheet = sheet_name
-                        break
-                
-                if setting_sheet:
-                    setting_df = pd.read_excel(file_path, sheet_name=setting_sheet)
-                    setting_df.columns = setting_df.columns.str.lower()
-                    
-                    # 检查必要的列是否存在
-                    required_columns = ['fun', 'title', 'config']
-                    if all(col in setting_df.columns for col in required_columns):
-                        # 处理冻结功能
-                        freeze_settings = []
-                        for _, row in setting_df.iterrows():
-                            fun = str(row['fun']).strip()
-                            title = str(row['title']).strip()
-                            config = str(row['config']).strip() if pd.notna(row['config']) else ''
-                            
-                            if fun == '冻结' and title:
-                                freeze_settings.append({
-                                    'title': title,
-                                    'config': config
-                                })
-                        
-                        if freeze_settings:
-                            settings['freeze'] = freeze_settings
-                            
+                settings = load_template(file_path).settings
             except Exception as e:
                 logging.warning(f"处理setting工作表时出错: {e}")
                 # 这里我们只记录错误但不中断流程，因为setting是可选的
@@ -356,8 +369,8 @@ def create_task_api():
             connection.commit()
             print(f"数据库插入成功，任务ID: {task_id}")
 
-            # 重新加载任务
-            task_scheduler.load_tasks()
+            # 加入新任务的调度
+            task_scheduler.upsert_task(task_id)
 
             return jsonify({"message": "任务创建成功！", "task_id": task_id, "next_run_at": next_run_at}), 200
 
@@ -391,9 +404,10 @@ def upload_file():
         file.save(filepath)
         print(f"File saved to: {filepath}") # 打印文件保存路径
 
-        # 检查模板文件格式
+        # 检查模板文件格式（解析结果会被缓存，后续校验和生成报表不再重复解析）
         try:
-            df = pd.read_excel(filepath)
+            template = load_template(filepath)
+            df = template.sheet(template.sheet_names[0])
             required_columns = ['db_name', 'output_sql']
             if not all(col in df.columns for col in required_columns):
                 raise ValueError(f'Invalid template format. Expected columns: {required_columns}')
@@ -429,7 +443,8 @@ def generate_report_route():
     # 创建一个uuid作为task_id
     task_id = str(uuid.uuid4())
     variables_filename = data.get('variables_filename')
-    task = ReportTask(filepath, original_filename, variables_filename)  # 传递 original_filename
+    # profile 为 true 时开启性能剖析，结果文件在 /progress 的 profile_files 中返回
+    task = ReportTask(filepath, original_filename, variables_filename, profile=data.get('profile'))  # 传递 original_filename
     tasks[task_id] = task
     task.start()
     return jsonify({'message': 'Report generation started', 'task_id': task_id, 'original_filename': original_filename}), 200
@@ -712,9 +727,13 @@ def get_report_options_api():
 def health_check():
     """健康检查API"""
     try:
-        # 尝试连接数据库
-        conn = connect_db()
-        conn.close()
+        # 从系统表连接池取一个连接检查数据库是否可用（不再每次新建连接；
+        # 不与报表查询争用连接，取不到连接时按 control_acquire_timeout 几秒内失败）
+        with control_pool.connection(DB_CONFIG) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
         
         return jsonify({
             'status': 'ok',
@@ -728,6 +747,12 @@ def health_check():
             'timestamp': datetime.now().isoformat()
         }), 500
 
+# Prometheus 指标
+@app.route('/metrics', methods=['GET'])
+def metrics_api():
+    """运行指标（Prometheus 文本格式），只读取内存中的数据"""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
 # 简单的测试API
 @app.route('/ping', methods=['GET'])
 def ping():
@@ -836,6 +861,67 @@ def check_and_create_tables():
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='管理任务与邮箱/邮箱组的多对多关联'
         """)
         
+        # 检查邮件发送队列表
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS `autoreport_mail_queue` (
+          `id` INT AUTO_INCREMENT PRIMARY KEY COMMENT '主键',
+          `task_id` INT DEFAULT NULL COMMENT '关联到autoreport_tasks表的id',
+          `subject` VARCHAR(500) NOT NULL COMMENT '邮件主题',
+          `recipients` TEXT NOT NULL COMMENT '收件人列表（JSON）',
+          `cc` TEXT DEFAULT NULL COMMENT '抄送人列表（JSON）',
+          `body` TEXT DEFAULT NULL COMMENT '邮件正文',
+          `attachments` TEXT DEFAULT NULL COMMENT '附件路径列表（JSON）',
+          `status` VARCHAR(20) NOT NULL DEFAULT 'pending' COMMENT '状态：pending/sending/sent/failed',
+          `attempts` INT NOT NULL DEFAULT 0 COMMENT '已尝试发送次数',
+          `next_attempt_at` DATETIME NOT NULL COMMENT '下一次尝试发送的时间',
+          `last_error` TEXT DEFAULT NULL COMMENT '最后一次发送失败的错误信息',
+          `sent_at` DATETIME DEFAULT NULL COMMENT '发送成功时间',
+          `claimed_by` VARCHAR(255) DEFAULT NULL COMMENT '取走邮件发送的节点',
+          `claimed_at` DATETIME DEFAULT NULL COMMENT '取走邮件的时间（数据库时间）',
+          `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+          `updated_at` DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+          KEY `idx_status_next_attempt` (`status`, `next_attempt_at`),
+          KEY `idx_task_id` (`task_id`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='待发送邮件队列'
+        """)
+        
+        # 检查任务运行记录表
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS `autoreport_task_runs` (
+          `id` INT AUTO_INCREMENT PRIMARY KEY COMMENT '主键',
+          `task_id` INT NOT NULL COMMENT '关联到autoreport_tasks表的id',
+          `node` VARCHAR(255) DEFAULT NULL COMMENT '执行的调度节点',
+          `status` VARCHAR(20) NOT NULL COMMENT '状态：success/failure',
+          `started_at` DATETIME NOT NULL COMMENT '开始执行时间',
+          `finished_at` DATETIME NOT NULL COMMENT '结束时间',
+          `duration_ms` INT NOT NULL COMMENT '执行耗时（毫秒）',
+          `queue_ms` INT DEFAULT NULL COMMENT '排队耗时（毫秒）',
+          `stage_timings` TEXT DEFAULT NULL COMMENT '各阶段耗时（JSON，毫秒）',
+          `query_stats` MEDIUMTEXT DEFAULT NULL COMMENT '各SQL结果块的数据库、行数、字节数和耗时（JSON）',
+          `error` TEXT DEFAULT NULL COMMENT '失败原因',
+          `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+          KEY `idx_task_started` (`task_id`, `started_at`),
+          KEY `idx_started_at` (`started_at`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='定时任务运行记录'
+        """)
+        
+        # 检查多节点运行需要的字段：任务表的租约、邮件队列的取走节点
+        added_columns = [
+            ('autoreport_tasks', 'lease_owner', "VARCHAR(255) DEFAULT NULL COMMENT '持有执行租约的调度节点'"),
+            ('autoreport_tasks', 'lease_expires_at', "DATETIME DEFAULT NULL COMMENT '租约到期时间，到期后其他节点可以接手'"),
+            ('autoreport_mail_queue', 'claimed_by', "VARCHAR(255) DEFAULT NULL COMMENT '取走邮件发送的节点'"),
+            ('autoreport_mail_queue', 'claimed_at', "DATETIME DEFAULT NULL COMMENT '取走邮件的时间（数据库时间）'"),
+        ]
+        for table, column, definition in added_columns:
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+                (table, column)
+            )
+            if cursor.fetchone()[0] == 0:
+                cursor.execute(f"ALTER TABLE `{table}` ADD COLUMN `{column}` {definition}")
+                print(f"{table} 表已添加字段: {column}")
+        
         conn.commit()
         cursor.close()
         conn.close()